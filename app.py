@@ -1,45 +1,245 @@
-from flask import Flask, render_template, request, flash, redirect, url_for, session
-from services.api_client import OpenFoodFactsAPI
-from services.database import Database
-from services.calorie_calculator import CalorieCalculator
-from datetime import datetime
-from services.recommendation_engine import RecommendationEngine
+from flask import (Blueprint, Flask, Response, current_app, render_template, request, flash, redirect, url_for,
+                   session, g, jsonify, make_response)
+from jinja2 import pass_context
+from markupsafe import Markup
+from services.api_client import OpenFoodFactsAPI, network_errors
+from services.storage import StorageBackend, create_storage, init_storage
+from services.calorie_calculator import CalorieCalculator, parse_macro_ratios
+from datetime import datetime, timedelta
+from services.importer import DiaryImporter, ImportStats, ProductDumpImporter
+from services.exporter import DiaryExporter, parquet_supported
+from services.executor import run_db, warm_db_pool
+from services.metrics import metrics, timed
+from services.fragment_cache import fragment_cache
+from services.write_queue import write_queue
+from typing import Dict, Optional
+import asyncio
+import hashlib
 import secrets
-
-app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+import threading
+import time
+import io
+import os
+import click
+
+# Рекомендации и аналитика считаются на numpy, а поиск по штрих-коду идёт
+# через requests/httpx: эти модули импортируются при первом использовании
+# (или в warmup_app), а не при импорте приложения
+
+# Маршруты и команды приложения; само приложение собирает create_app
+bp = Blueprint("nutrition", __name__, cli_group=None)
 RESET_TOKEN = secrets.token_urlsafe(16)
+DIARY_PAGE_SIZE = 50  # Записей дневника на одной странице
+
+# Число очисток дневника в этом процессе: входит в ETag главной, чтобы после
+# /reset-db устарели страницы во всех сессиях, а не только в сбросившей
+reset_generation = 0
+_reset_lock = threading.Lock()
+
+render_template = timed("render_template")(render_template)
 
 
 def get_db_connection():
-    return Database()
+    """Возвращает хранилище текущего запроса (соединение берётся из пула)"""
+    if 'db' not in g:
+        g.db = create_storage()
+    return g.db
+
+
+def close_db_connection(exception):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+
+def current_user_id() -> int:
+    """ID пользователя сессии; новый пользователь создаётся при первом визите"""
+    if 'user_id' not in session:
+        session['user_id'] = get_db_connection().create_user()
+        session.permanent = True
+    return session['user_id']
+
+
+async def acurrent_user_id() -> int:
+    """Асинхронный current_user_id: пользователь создаётся в пуле потоков БД"""
+    if 'user_id' not in session:
+        session['user_id'] = await run_db(lambda db: db.create_user())
+        session.permanent = True
+    return session['user_id']
+
+
+def recommend_products(db, daily_norms, today_stats):
+    from services.recommendation_engine import RecommendationEngine
+    return RecommendationEngine(db).recommend_products(daily_norms, today_stats)
+
+
+def get_daily_norms():
+    """Дневные нормы пользователя (кэшируются по набору настроек)"""
+    if 'user_settings' not in session:
+        return None
+    settings = session['user_settings']
+    return CalorieCalculator.daily_norms(
+        weight=settings['weight'],
+        height=settings['height'],
+        age=settings['age'],
+        gender=settings['gender'],
+        activity_level=settings['activity_level']
+    )
+
+def settings_key():
+    """Всё, от чего зависят нормы: настройки сессии и доли БЖУ"""
+    settings = session.get('user_settings')
+    return (tuple(sorted(settings.items())) if settings else None,
+            tuple(CalorieCalculator.MACRO_RATIOS.items()))
+
+
+def page_etag(user_id: int, today: str):
+    """
+    ETag главной страницы без обращения к БД
+
+    Строится по версии данных, с которой страница была отрисована в
+    последний раз (session['page_version']), настройкам и дате. Запись
+    в дневник через главную отрисовывает страницу заново, остальные
+    записывающие обработчики сбрасывают page_version. RESET_TOKEN меняется
+    при перезапуске процесса, а с ним и ETag: страница могла измениться
+    вместе с кодом.
+
+    Записи из других сессий session не видит, поэтому в ETag входят и
+    счётчики процесса: поколение каталога (рекомендации) и число очисток
+    дневника. Записи других процессов эти счётчики не учитывают.
+    """
+    version = session.get('page_version')
+    if version is None:
+        return None
+    state = (user_id, version, settings_key(), today, RESET_TOKEN,
+             reset_generation, StorageBackend.catalog_generation)
+    return hashlib.sha1(repr(state).encode()).hexdigest()
+
+
+def page_fragments(user_id: int, version, today: str):
+    """
+    Кэшируемые фрагменты главной: шаблон -> (ключ, HTML из кэша или None)
+
+    Ключ включает версии всех данных фрагмента, поэтому кэш не нужно
+    сбрасывать. version — get_data_version (None — дневник не кэшируется).
+    """
+    settings = settings_key()
+    keys = {
+        "partials/user_data.html": ("user_data", settings),
+        "partials/nutrition_chart.html": ("nutrition_chart",),
+    }
+    if version is not None:
+        # Дневник показывает последние 30 дней, поэтому зависит и от даты
+        keys["partials/food_history.html"] = ("food_history", user_id, *version, today)
+        keys["partials/product_recommendations.html"] = ("recommendations", user_id, *version, today, settings)
+    return {name: (key, fragment_cache.get(key)) for name, key in keys.items()}
+
+
+@bp.app_template_global()
+@pass_context
+def fragment(context, template_name: str):
+    """Частичный шаблон из кэша фрагментов (ключи задаёт page_fragments во view)"""
+    key, html = context.get("fragments", {}).get(template_name, (None, None))
+    if html is None:
+        html = context.environment.get_template(template_name).render(context.get_all())
+        if key is not None:
+            fragment_cache.set(key, html)
+    return Markup(html)
+
+
+def parse_diary_cursor(value):
+    """Разбирает курсор дневника вида 'YYYY-MM-DD:id'"""
+    if not value:
+        return None
+    date, _, entry_id = value.rpartition(':')
+    return date, int(entry_id)
+
+
+def format_diary_cursor(cursor):
+    return f"{cursor[0]}:{cursor[1]}" if cursor else None
+
+
+def parse_export_date(value):
+    """Граница выгрузки 'YYYY-MM-DD' или None; ValueError для некорректной даты"""
+    return datetime.strptime(value, '%Y-%m-%d').date().isoformat() if value else None
+
+
+def catalog_cache_stats():
+    from services.product_catalog import catalog_cache
+    return catalog_cache.stats()
+
+
+metrics.register_collector("nutrition_catalog_cache", "Кэш каталога продуктов", catalog_cache_stats)
+metrics.register_collector("nutrition_barcode_cache", "Кэш штрих-кодов OpenFoodFacts",
+                           lambda: OpenFoodFactsAPI.cache.stats())
+metrics.register_collector("nutrition_fragment_cache", "Кэш фрагментов страниц", fragment_cache.stats)
+metrics.register_collector("nutrition_write_queue", "Очередь записей в БД", write_queue.stats)
+
+
+@bp.before_app_request
+def start_request_trace():
+    g.request_trace = metrics.start_request()
 
-@app.context_processor
+
+@bp.after_app_request
+def add_server_timing(response):
+    trace = metrics.current_trace()
+    if trace is not None and current_app.config["SERVER_TIMING"]:
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+
+@bp.teardown_app_request
+def finish_request_trace(exception):
+    metrics.finish_request(request.endpoint or "unknown", g.pop("request_trace", None))
+
+
+@bp.route("/metrics")
+def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus"""
+    if not metrics.enabled:
+        return "Метрики отключены", 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.app_context_processor
 def inject_now():
     return {'now': datetime.now()}
 
-@app.route("/", methods=["GET", "POST"])
-def index():
-    db = get_db_connection()
+@bp.route("/", methods=["GET", "POST"])
+async def index():
     today = datetime.now().strftime('%Y-%m-%d')
 
+    # Повторный заход без изменений: 304 без обращения к БД. Страница с
+    # уведомлениями всегда отрисовывается, иначе они потеряются
+    if request.method == "GET" and 'user_id' in session and '_flashes' not in session:
+        etag = page_etag(session['user_id'], today)
+        if etag is not None and request.if_none_match.contains(etag):
+            response = make_response("", 304)
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+
+    user_id = await acurrent_user_id()
+
     # Инициализация переменных
     product = None
     today_stats = None
     daily_norms = None
     food_history = None
+    diary_cursor = None
+    recommendations = []
+    lookup = None
+    version = None
+    fragments = {}
 
     try:
         # Обработка POST-запросов
-        # Получаем настройки пользователя из БД при первом заходе
-        if 'user_settings' not in session:
-            user_settings = db.get_user_settings()
-            if user_settings:
-                session['user_settings'] = user_settings
         if request.method == "POST":
             if "search_product" in request.form:
+                # Поиск в OpenFoodFacts идёт параллельно с запросами к БД ниже
                 barcode = request.form.get("barcode")
-                product = OpenFoodFactsAPI.get_product_by_barcode(barcode)
+                lookup = asyncio.ensure_future(OpenFoodFactsAPI.aget_product_by_barcode(barcode))
 
             elif "save_entry" in request.form:
                 try:
@@ -53,59 +253,86 @@ def index():
                     }
 
                     grams = float(request.form.get("grams", 100))
-                    product_id = db.add_or_update_product(product_data)
-
-                    if db.add_consumption(product_id, grams):
+                    # Запись идёт через очередь: поток-писатель фиксирует её
+                    # вместе с записями других запросов одной транзакцией
+                    saved = await write_queue.run(
+                        lambda db: db.add_consumption(user_id, db.add_or_update_product(product_data), grams)
+                    )
+                    if saved:
                         flash("Запись успешно добавлена в дневник!", "success")
 
                 except Exception as e:
                     flash(f"Ошибка: {str(e)}", "danger")
 
-        # Получение данных для отображения
-        today_stats = db.get_today_nutrition(today)
-        food_history = db.get_food_diary()
+        # Получаем настройки пользователя из БД при первом заходе
+        if 'user_settings' not in session:
+            user_settings = await run_db(lambda db: db.get_user_settings(user_id))
+            if user_settings:
+                session['user_settings'] = user_settings._asdict()
 
         # Расчет дневных норм если есть данные пользователя
-        if 'user_settings' in session:
-            try:
-                settings = session['user_settings']
-                calories = CalorieCalculator.calculate_daily_calories(
-                    weight=settings['weight'],
-                    height=settings['height'],
-                    age=settings['age'],
-                    gender=settings['gender'],
-                    activity_level=settings['activity_level']
-                )
-                daily_norms = CalorieCalculator.get_macronutrients(calories)
-                daily_norms['calories'] = calories  # Добавляем калории в нормы
-            except Exception as e:
-                flash(f"Ошибка расчета норм: {str(e)}", "warning")
+        try:
+            daily_norms = get_daily_norms()
+        except Exception as e:
+            flash(f"Ошибка расчета норм: {str(e)}", "warning")
+
+        # Версия данных читается до самих данных: фрагмент, закэшированный
+        # под этой версией, может оказаться только новее, но не старее её
+        version, today_stats = await run_db(
+            lambda db: (db.get_data_version(user_id), db.get_today_nutrition(user_id, today))
+        )
+        fragments = page_fragments(user_id, version, today)
+
+        def cached(template_name):
+            return fragments.get(template_name, (None, None))[1] is not None
+
+        # Дневник и рекомендации читаются одновременно и только для
+        # фрагментов, которых нет в кэше
+        async def diary():
+            if cached("partials/food_history.html"):
+                return None, None
+            return await run_db(lambda db: db.get_food_diary_page(user_id, limit=DIARY_PAGE_SIZE))
+
+        async def recommend():
+            if cached("partials/product_recommendations.html") or daily_norms is None or not today_stats:
+                return []
+            return await run_db(recommend_products, daily_norms, today_stats)
+
+        (food_history, diary_cursor), recommendations = await asyncio.gather(diary(), recommend())
 
     except Exception as e:
         flash(f"Ошибка базы данных: {str(e)}", "danger")
-    finally:
-        db.close()
 
-        recommendations = []
-        if 'user_settings' in session and today_stats:
-            engine = RecommendationEngine()
-            recommendations = engine.recommend_products(daily_norms, today_stats)
-            engine.close()
+    if lookup is not None:
+        try:
+            product = await lookup
+        except Exception as e:
+            flash(f"Ошибка поиска продукта: {str(e)}", "warning")
 
-    return render_template(
+    if version is not None:
+        session['page_version'] = list(version)
+    else:
+        session.pop('page_version', None)
+
+    response = make_response(render_template(
         "index.html",
         product=product,
         food_history=food_history,
+        diary_cursor=format_diary_cursor(diary_cursor),
         today_stats=today_stats,
         daily_norms=daily_norms,
         reset_token=RESET_TOKEN,
-        recommendations=recommendations
-    )
+        recommendations=recommendations,
+        fragments=fragments
+    ))
+    if request.method == "GET" and version is not None:
+        response.set_etag(page_etag(user_id, today))
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 
-@app.route("/save-settings", methods=["POST"])
+@bp.route("/save-settings", methods=["POST"])
 def save_settings():
-    db = get_db_connection()
     try:
         user_data = {
             'weight': float(request.form.get('weight')),
@@ -116,8 +343,9 @@ def save_settings():
         }
 
         # Сохраняем в базу данных
-        if db.save_user_settings(user_data):
-            # Также сохраняем в сессию для удобства
+        user_id = current_user_id()
+        if write_queue.submit(lambda db: db.save_user_settings(user_id, user_data)).result():
+            # Также сохраняем в сессию для удобства; нормы считаются по ним
             session['user_settings'] = user_data
             flash("Настройки успешно сохранены", "success")
         else:
@@ -125,89 +353,399 @@ def save_settings():
 
     except Exception as e:
         flash(f"Ошибка сохранения настроек: {str(e)}", "danger")
-    finally:
-        db.close()
-    return redirect(url_for("index"))
+    return redirect(url_for(".index"))
 
 
-@app.route("/reset-db", methods=["POST"])
+@bp.route("/reset-db", methods=["POST"])
 def reset_db():
+    global reset_generation
     if request.method == "POST" and request.form.get("token") == RESET_TOKEN:
         db = get_db_connection()
+        # Главная уже не та, что закэширована браузером под прежним ETag
+        session.pop('page_version', None)
         try:
-            if db.reset_database():
-                flash("Все данные успешно удалены", "success")
+            if db.clear_food_diary(current_user_id()):
+                flash("Дневник питания успешно очищен", "success")
             else:
-                flash("Ошибка при очистке базы данных", "danger")
+                flash("Ошибка при очистке дневника", "danger")
         except Exception as e:
             flash(f"Ошибка: {str(e)}", "danger")
-        finally:
-            db.close()
+        # После очистки: иначе другая сессия успела бы закэшировать старый дневник
+        with _reset_lock:
+            reset_generation += 1
     else:
         flash("Неверный запрос на очистку", "danger")
-    return redirect(url_for("index"))
+    return redirect(url_for(".index"))
 
-@app.route("/clear-settings", methods=["POST"])
+@bp.route("/clear-settings", methods=["POST"])
 def clear_settings():
-    db = get_db_connection()
     try:
-        if db.clear_user_settings():
+        user_id = current_user_id()
+        if write_queue.submit(lambda db: db.clear_user_settings(user_id)).result():
             # Удаляем из сессии тоже
-            if 'user_settings' in session:
-                session.pop('user_settings')
+            session.pop('user_settings', None)
             flash("Пользовательские данные успешно очищены", "success")
         else:
             flash("Ошибка при очистке пользовательских данных", "danger")
     except Exception as e:
         flash(f"Ошибка: {str(e)}", "danger")
-    finally:
-        db.close()
-    return redirect(url_for("index"))
+    return redirect(url_for(".index"))
+
+
+@bp.route("/import", methods=["POST"])
+def import_diary():
+    """Импорт дневника из тела запроса: ?format=csv|jsonl"""
+    fmt = request.args.get("format", "jsonl")
+    if fmt not in DiaryImporter.FORMATS:
+        return jsonify({"error": f"Неизвестный формат: {fmt}"}), 400
+
+    # Тело читается потоком, а не целиком в память; байты не в UTF-8 дают
+    # некорректную запись, которая пропускается, а не обрывают импорт
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8", errors="replace", newline="")
+    session.pop('page_version', None)
+    # Пачки пишутся по мере чтения: при ошибке ответ сообщает, сколько уже записано
+    stats = ImportStats()
+    try:
+        DiaryImporter(get_db_connection(), current_user_id()).import_stream(stream, fmt, stats)
+    except Exception as e:
+        return jsonify({"error": str(e), **stats.as_dict()}), 400 if isinstance(e, ValueError) else 500
+    return jsonify(stats.as_dict())
+
+
+@bp.route("/diary")
+def diary():
+    """Страница дневника в JSON: ?cursor=<курсор>&limit=<размер>"""
+    try:
+        after = parse_diary_cursor(request.args.get("cursor"))
+        limit = min(max(int(request.args.get("limit", DIARY_PAGE_SIZE)), 1), 500)
+        days = int(request.args.get("days", 30))
+    except ValueError:
+        return jsonify({"error": "Некорректные параметры запроса"}), 400
+
+    rows, next_cursor = get_db_connection().get_food_diary_page(current_user_id(), days, limit, after)
+    columns = ("id", "name", "barcode", "date", "grams", "calories", "proteins", "fats", "carbs")
+    return jsonify({
+        "entries": [dict(zip(columns, row)) for row in rows],
+        "next_cursor": format_diary_cursor(next_cursor)
+    })
+
+
+@bp.route("/diary/page")
+def diary_page():
+    """Следующая страница таблицы дневника (для подгрузки через htmx)"""
+    try:
+        after = parse_diary_cursor(request.args.get("cursor"))
+    except ValueError:
+        return "", 400
+
+    rows, next_cursor = get_db_connection().get_food_diary_page(current_user_id(), limit=DIARY_PAGE_SIZE, after=after)
+    return render_template(
+        "partials/food_history_rows.html",
+        food_history=rows,
+        diary_cursor=format_diary_cursor(next_cursor)
+    )
+
+
+@bp.route("/export")
+def export_diary():
+    """Весь дневник файлом: ?format=csv|jsonl|parquet&start=YYYY-MM-DD&end=YYYY-MM-DD"""
+    fmt = request.args.get("format", "csv")
+    if fmt not in DiaryExporter.FORMATS:
+        return jsonify({"error": f"Неизвестный формат: {fmt}"}), 400
+    if fmt == "parquet" and not parquet_supported():
+        return jsonify({"error": "Выгрузка в Parquet недоступна: не установлен pyarrow"}), 501
+    try:
+        start = parse_export_date(request.args.get("start"))
+        end = parse_export_date(request.args.get("end"))
+    except ValueError:
+        return jsonify({"error": "Некорректные параметры запроса"}), 400
+    user_id = current_user_id()
+
+    def generate():
+        # Ответ отдаётся уже после выхода из обработчика, когда хранилище
+        # запроса закрыто, поэтому у выгрузки своё
+        db = create_storage()
+        try:
+            yield from DiaryExporter(db, user_id, start, end).stream(fmt)
+        finally:
+            db.close()
+
+    response = Response(generate(), mimetype=DiaryExporter.MIMETYPES[fmt])
+    response.headers["Content-Disposition"] = f"attachment; filename=diary.{fmt}"
+    return response
+
+
+@bp.route("/search")
+def search():
+    """Поиск продуктов каталога по названию: ?q=<начало слов>&limit=<число>"""
+    query = request.args.get("q", "").strip()
+    try:
+        limit = min(max(int(request.args.get("limit", 10)), 1), 50)
+    except ValueError:
+        return jsonify({"error": "Некорректные параметры запроса"}), 400
+
+    products = get_db_connection().search_products(query, limit) if query else []
+    # Подсказки под полем поиска запрашиваются через htmx и вставляются как HTML
+    if request.headers.get("HX-Request"):
+        return render_template("partials/search_results.html", products=products, query=query)
+    return jsonify({"query": query, "results": [product._asdict() for product in products]})
+
+
+@bp.route("/analytics")
+def analytics():
+    """Итоги питания в JSON: ?period=day|week|month&days=<глубина>&window=<окно среднего>"""
+    from services.analytics import NutritionReport, PERIODS, DEFAULT_DAYS, MAX_DAYS
+
+    period = request.args.get("period", "day")
+    if period not in PERIODS:
+        return jsonify({"error": f"Неизвестный период: {period}"}), 400
+    try:
+        days = min(max(int(request.args.get("days", DEFAULT_DAYS[period])), 1), MAX_DAYS)
+        window = min(max(int(request.args.get("window", 7)), 1), 90)
+    except ValueError:
+        return jsonify({"error": "Некорректные параметры запроса"}), 400
+
+    end = datetime.now().date()
+    start = end - timedelta(days=days - 1)
+    report = NutritionReport.load(get_db_connection(), current_user_id(), start, end, get_daily_norms(), window)
+    return jsonify(report.as_dict(period, window))
 
 
 # Добавим новый маршрут
-@app.route("/get-recommendations")
-def get_recommendations():
+@bp.route("/get-recommendations")
+async def get_recommendations():
     if 'user_settings' not in session:
         flash("Сначала установите свои параметры", "warning")
-        return redirect(url_for("index"))
+        return redirect(url_for(".index"))
 
-    db = get_db_connection()
+    user_id = await acurrent_user_id()
     today = datetime.now().strftime('%Y-%m-%d')
 
     try:
         # Получаем текущую статистику
-        today_stats = db.get_today_nutrition(today)
-
-        # Рассчитываем нормы
-        settings = session['user_settings']
-        calories = CalorieCalculator.calculate_daily_calories(
-            weight=settings['weight'],
-            height=settings['height'],
-            age=settings['age'],
-            gender=settings['gender'],
-            activity_level=settings['activity_level']
-        )
-        daily_norms = CalorieCalculator.get_macronutrients(calories)
-        daily_norms['calories'] = calories
+        today_stats = await run_db(lambda db: db.get_today_nutrition(user_id, today))
+
+        # Нормы берутся из сессии
+        daily_norms = get_daily_norms()
+
+        # ?mode=plan — подбор сочетания продуктов вместо списка по одному
+        if request.args.get("mode") == "plan":
+            from services.recommendation_engine import RecommendationEngine
+            plan = await run_db(lambda db: RecommendationEngine(db).plan_meal(daily_norms, today_stats))
+            return render_template("partials/meal_plan.html", plan=plan)
 
         # Получаем рекомендации
-        engine = RecommendationEngine()
-        recommendations = engine.recommend_products(daily_norms, today_stats)
-        engine.close()
+        recommendations = await run_db(recommend_products, daily_norms, today_stats)
 
-        return render_template("partials/product_recommendations.html", recommendations=recommendations)
+        return render_template(
+            "partials/product_recommendations.html",
+            recommendations=recommendations,
+            daily_norms=daily_norms,
+            today_stats=today_stats
+        )
 
     except Exception as e:
         flash(f"Ошибка получения рекомендаций: {str(e)}", "danger")
-        return redirect(url_for("index"))
+        return redirect(url_for(".index"))
+
+@bp.cli.command("rebuild-totals")
+def rebuild_totals_command():
+    """Сверяет дневные итоги с исходными записями дневника"""
+    db = create_storage()
+    try:
+        days = db.rebuild_daily_totals()
+        print(f"Дневные итоги пересчитаны: {days} строк")
+    finally:
+        db.close()
+
+
+@bp.cli.command("resolve-barcodes")
+@click.argument("path", type=click.File("r"))
+@click.option("--workers", default=8, show_default=True, help="Одновременных запросов к API")
+@click.option("--rate", default=None, type=float, help="Максимум запросов в секунду")
+def resolve_barcodes_command(path, workers, rate):
+    """Загружает продукты по списку штрих-кодов (по одному на строку) в каталог"""
+    started = time.perf_counter()
+    results = OpenFoodFactsAPI.get_products_by_barcodes(path, max_workers=workers, rate_limit=rate)
+    found = [product for product in results.values() if product is not None]
+
+    db = create_storage()
+    try:
+        db.add_or_update_products(found)
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - started
+    print(f"Найдено {len(found)} из {len(results)} штрих-кодов за {elapsed:.1f} с")
+
+
+@bp.cli.command("import-diary")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(DiaryImporter.FORMATS), default=None,
+              help="Формат файла (по умолчанию по расширению)")
+@click.option("--chunk-size", default=5000, show_default=True, help="Записей в одной транзакции")
+@click.option("--user-id", default=1, show_default=True, help="Пользователь, в чей дневник идёт импорт")
+def import_diary_command(path, fmt, chunk_size, user_id):
+    """Импортирует дневник питания из CSV или JSON Lines"""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+
+    def report(stats):
+        print(f"\rИмпортировано {stats.records} записей ({stats.rows_per_sec:.0f} строк/с)", end="")
+
+    db = create_storage()
+    try:
+        with open(path, encoding="utf-8", newline="") as stream:
+            stats = DiaryImporter(db, user_id, chunk_size=chunk_size, progress=report).import_stream(stream, fmt)
+    finally:
+        db.close()
+    print(f"\nГотово: {stats.as_dict()}")
+
+
+@bp.cli.command("import-products")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(ProductDumpImporter.FORMATS), default=None,
+              help="Формат выгрузки (по умолчанию по расширению, .gz допускается)")
+@click.option("--workers", default=None, type=int, help="Процессов разбора (по умолчанию по числу ядер)")
+@click.option("--chunk-size", default=20000, show_default=True, help="Продуктов в одной транзакции")
+@click.option("--full", is_flag=True, help="Записать все продукты, а не только изменившиеся")
+@click.option("--restart", is_flag=True, help="Начать файл сначала, а не с места остановки")
+def import_products_command(path, fmt, workers, chunk_size, full, restart):
+    """Загружает выгрузку OpenFoodFacts (JSONL или CSV) в локальный каталог"""
+    def report(stats):
+        print(f"\rПрочитано {stats.records} строк, записано {stats.products} продуктов "
+              f"({stats.rows_per_sec:.0f} строк/с)", end="")
+
+    db = create_storage()
+    try:
+        importer = ProductDumpImporter(db, workers=workers, chunk_size=chunk_size, progress=report)
+        stats = importer.import_file(path, fmt, incremental=not full, resume=not restart)
+    finally:
+        db.close()
+    print(f"\nГотово: {stats.as_dict()}")
+
+
+@bp.cli.command("export-diary")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--format", "fmt", type=click.Choice(DiaryExporter.FORMATS), default=None,
+              help="Формат файла (по умолчанию по расширению)")
+@click.option("--user-id", default=None, type=int, help="Пользователь (по умолчанию все)")
+@click.option("--start", default=None, help="Первая дата, YYYY-MM-DD")
+@click.option("--end", default=None, help="Последняя дата, YYYY-MM-DD")
+@click.option("--chunk-size", default=10000, show_default=True, help="Строк в одной пачке")
+def export_diary_command(path, fmt, user_id, start, end, chunk_size):
+    """Выгружает дневник питания в CSV, JSON Lines или Parquet"""
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in DiaryExporter.FORMATS:
+        raise click.BadParameter(f"укажите один из форматов: {', '.join(DiaryExporter.FORMATS)}",
+                                 param_hint="--format")
+    if fmt == "parquet" and not parquet_supported():
+        raise click.ClickException("Для выгрузки в Parquet установите pyarrow")
+    try:
+        start, end = parse_export_date(start), parse_export_date(end)
+    except ValueError:
+        raise click.BadParameter("даты в формате YYYY-MM-DD", param_hint="--start/--end")
+
+    def report(stats):
+        print(f"\rВыгружено {stats.records} записей ({stats.rows_per_sec:.0f} строк/с)", end="")
+
+    db = create_storage()
+    try:
+        stats = DiaryExporter(db, user_id, start, end, chunk_size, progress=report).export_file(path, fmt)
+    finally:
+        db.close()
+    print(f"\nГотово: {stats.as_dict()}")
+
+
+@bp.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Проверяет, что запросы дневника используют индексы (для CI)"""
+    db = create_storage()
+    try:
+        problems = db.check_query_plans()
     finally:
         db.close()
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+    print("Все запросы используют индексы")
+
 
-@app.route("/about")
+@bp.route("/about")
 def about():
     """Страница 'О сервисе'"""
     return render_template("about.html")
 
+
+def warmup_app(app: Flask) -> Dict[str, float]:
+    """
+    Прогревает процесс до того, как он начнёт принимать запросы
+
+    Открывает соединения с БД во всех потоках пула, импортирует модули
+    рекомендаций, аналитики и HTTP-клиентов, загружает каталог продуктов
+    в кэш процесса и компилирует шаблоны — иначе всё это ждал бы первый
+    посетитель. Ошибка шага не мешает старту. Возвращает длительность
+    шагов, мс.
+    """
+    def import_modules():
+        import services.analytics  # noqa: F401
+        import services.recommendation_engine  # noqa: F401
+        network_errors()
+
+    def load_catalog():
+        from services.product_catalog import catalog_cache
+        db = create_storage()
+        try:
+            catalog_cache.get(db)
+        finally:
+            db.close()
+
+    def compile_templates():
+        for name in app.jinja_env.list_templates(extensions=["html"]):
+            app.jinja_env.get_template(name)
+
+    timings = {}
+    for name, step in (("db_pool", warm_db_pool), ("imports", import_modules),
+                       ("catalog", load_catalog), ("templates", compile_templates)):
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"Ошибка прогрева ({name}): {e}")
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+    return timings
+
+
+def create_app(warmup: Optional[bool] = None) -> Flask:
+    """
+    Фабрика приложения: flask --app app ..., gunicorn "app:create_app()"
+
+    Хранилище выбирается переменной окружения DATABASE_URL (по умолчанию
+    SQLite); схема проверяется и мигрируется один раз на процесс. warmup —
+    прогреть процесс до первого запроса (warmup_app), по умолчанию по
+    переменной окружения WARMUP=1.
+    """
+    app = Flask(__name__)
+    # Сессия хранит ID пользователя, поэтому ключ должен быть общим для всех
+    # процессов и переживать перезапуск: задайте SECRET_KEY в окружении
+    app.secret_key = os.environ.get("SECRET_KEY") or secrets.token_hex(16)
+    # Заголовок Server-Timing с промежутками запроса (для отладки в DevTools)
+    app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING") == "1"
+
+    # Доли калорий БЖУ в процентах, например MACRO_RATIOS=25/35/40
+    if os.environ.get("MACRO_RATIOS"):
+        CalorieCalculator.set_macro_ratios(parse_macro_ratios(os.environ["MACRO_RATIOS"]))
+
+    init_storage()
+
+    app.register_blueprint(bp)
+    app.teardown_appcontext(close_db_connection)
+
+    if warmup is None:
+        warmup = os.environ.get("WARMUP") == "1"
+    if warmup:
+        app.config["WARMUP_MS"] = warmup_app(app)
+    return app
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5002, debug=True)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=5002, debug=True)
\ No newline at end of file
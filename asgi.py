@@ -0,0 +1,73 @@
+"""
+ASGI-точка входа приложения
+
+    uvicorn asgi:application --workers 2
+
+Асинхронные маршруты (index, get_recommendations) выполняются в цикле
+событий сервера: ожидание OpenFoodFacts и пула потоков БД не блокирует
+другие запросы воркера. Синхронная часть запросов выполняется в общем
+ограниченном пуле из ASGI_THREADS потоков: потоки переиспользуются, и число
+их соединений SQLite не растёт с числом запросов. С WARMUP=1 воркер прогревается (соединения с БД,
+каталог продуктов, шаблоны) на старте lifespan, до приёма запросов.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import create_app, warmup_app
+
+# Потоков для синхронной части запросов: столько запросов воркер обрабатывает
+# одновременно, остальные ждут свободного потока в цикле событий
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 32))
+
+
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    """Запрос WsgiToAsgi, синхронная часть которого выполняется в заданном пуле"""
+
+    def __init__(self, wsgi_application, executor: ThreadPoolExecutor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        # Исходный метод обёрнут sync_to_async; берём саму функцию. Поток
+        # пула знает цикл событий сервера, поэтому асинхронные маршруты Flask
+        # выполняются в нём, как и раньше.
+        run = WsgiToAsgiInstance.__dict__["run_wsgi_app"].func
+        await sync_to_async(run, thread_sensitive=False, executor=self.executor)(self, body)
+
+
+class FlaskASGI(WsgiToAsgi):
+    """WsgiToAsgi, выполняющий запросы в ограниченном пуле потоков"""
+
+    def __init__(self, wsgi_application, warmup: bool = False, threads: int = ASGI_THREADS):
+        super().__init__(wsgi_application)
+        self.warmup = warmup
+        # Без своего пула asgiref либо выполняет синхронный код всех запросов
+        # по очереди в одном потоке, либо (ThreadSensitiveContext) создаёт
+        # поток на каждый запрос, и соединения SQLite этих потоков копятся
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        await PooledWsgiInstance(self.wsgi_application, self.executor)(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Сервер не принимает запросы, пока старт не подтверждён
+                if self.warmup:
+                    app = self.wsgi_application
+                    app.config["WARMUP_MS"] = await asyncio.to_thread(warmup_app, app)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = FlaskASGI(create_app(warmup=False), warmup=os.environ.get("WARMUP") == "1")
@@ -0,0 +1,9 @@
+"""
+Набор бенчмарков NutritionTracker
+
+    python -m benchmarks run --scale 100k --out results.json
+    python -m benchmarks compare base.json results.json --threshold 0.15
+
+Данные генерируются детерминированно (generator.py) в отдельную БД, поэтому
+результаты двух прогонов с одинаковыми параметрами сравнимы между собой.
+"""
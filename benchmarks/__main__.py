@@ -0,0 +1,155 @@
+import os
+import sys
+import tempfile
+
+import click
+
+from benchmarks.generator import SCALES, DatasetSpec, generate
+from benchmarks.harness import environment, write_results, load_results, compare
+
+# Результаты по умолчанию складываются рядом с бенчмарками (не в git)
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def prepare_storage(storage_url, scale):
+    """
+    Открывает чистое хранилище для прогона
+
+    По умолчанию — новый файл SQLite во временном каталоге. Адрес
+    PostgreSQL должен указывать на одноразовую БД: она очищается.
+    """
+    if storage_url is None:
+        path = os.path.join(tempfile.gettempdir(), f"nutrition-bench-{scale}.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        storage_url = "sqlite:///" + path
+
+    # Приложение и пул потоков БД открывают хранилище по DATABASE_URL
+    os.environ["DATABASE_URL"] = storage_url
+    from services.storage import create_storage
+    db = create_storage(storage_url)
+    if not storage_url.startswith("sqlite:"):
+        db.reset_database()
+    return storage_url, db
+
+
+def report_progress(written, total):
+    click.echo(f"\rЗаписей дневника: {written}/{total}", nl=written >= total)
+
+
+@click.group()
+def cli():
+    """Бенчмарки NutritionTracker"""
+
+
+@cli.command("run")
+@click.option("--scale", type=click.Choice(list(SCALES)), default="10k", show_default=True,
+              help="Число записей дневника")
+@click.option("--products", type=int, default=None, help="Размер каталога (по умолчанию от масштаба)")
+@click.option("--users", type=int, default=None, help="Число пользователей (по умолчанию от масштаба)")
+@click.option("--days", type=int, default=90, show_default=True, help="Глубина истории в днях")
+@click.option("--seed", type=int, default=42, show_default=True)
+@click.option("--storage-url", default=None, help="Хранилище (по умолчанию временный файл SQLite)")
+@click.option("--repeat", type=int, default=50, show_default=True, help="Замеров на бенчмарк")
+@click.option("--only", multiple=True, help="Префикс имени бенчмарка (можно несколько)")
+@click.option("--no-load", is_flag=True, help="Без сквозного сценария")
+@click.option("--sessions", type=int, default=8, show_default=True, help="Параллельных посетителей")
+@click.option("--iterations", type=int, default=5, show_default=True, help="Кругов сценария на посетителя")
+@click.option("--upstream-delay", type=float, default=0.2, show_default=True,
+              help="Задержка заглушки OpenFoodFacts в сценарии, с")
+@click.option("--server-url", default=None, help="Гонять сценарий по HTTP против запущенного сервера")
+@click.option("--out", type=click.Path(dir_okay=False), default=None, help="Файл результатов JSON")
+def run_command(scale, products, users, days, seed, storage_url, repeat, only, no_load,
+                sessions, iterations, upstream_delay, server_url, out):
+    """Генерирует данные, запускает микробенчмарки и сквозной сценарий"""
+    spec = DatasetSpec.from_scale(scale, products=products, users=users, days=days, seed=seed)
+    storage_url, db = prepare_storage(storage_url, scale)
+    backend = storage_url.split(":", 1)[0]
+
+    click.echo(f"Генерация данных: {spec.as_dict()} ({backend})")
+    dataset = generate(db, spec, progress=report_progress)
+    user_ids = dataset.pop("user_ids")
+    generation_s = dataset.pop("elapsed")
+    click.echo(f"Готово за {generation_s} с")
+
+    from benchmarks.micro import Context, run_micro
+
+    def report(name, result):
+        summary = ", ".join(f"{key}={value}" for key, value in result.items())
+        click.echo(f"{name:45} {summary}")
+
+    try:
+        results = run_micro(Context(db, user_ids, repeat=repeat, seed=seed), only=list(only), progress=report)
+    finally:
+        db.close()
+
+    if not no_load and not only:
+        from benchmarks.load import run_load, TestClientSession, HttpSession
+        if server_url:
+            load = run_load(lambda: HttpSession(server_url), sessions, iterations, seed=seed)
+        else:
+            from benchmarks.upstream import FakeOpenFoodFacts
+            from services.api_client import OpenFoodFactsAPI
+            from app import create_app
+            app = create_app()
+            with FakeOpenFoodFacts(upstream_delay) as upstream:
+                OpenFoodFactsAPI.BASE_URL = upstream.base_url
+                load = run_load(lambda: TestClientSession(app), sessions, iterations, search=True, seed=seed)
+        for name, result in load.items():
+            report(name, result)
+        results.update(load)
+
+    meta = {**environment(), "backend": backend, "dataset": dataset,
+            "generation_s": generation_s, "repeat": repeat}
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{scale}-{meta['commit'] or 'local'}-{meta['timestamp'][:19].replace(':', '')}.json")
+    write_results(out, meta, results)
+    click.echo(f"Результаты: {out}")
+
+
+@cli.command("generate")
+@click.option("--scale", type=click.Choice(list(SCALES)), default="10k", show_default=True)
+@click.option("--products", type=int, default=None)
+@click.option("--users", type=int, default=None)
+@click.option("--days", type=int, default=90, show_default=True)
+@click.option("--seed", type=int, default=42, show_default=True)
+@click.option("--storage-url", default=None, help="Хранилище (по умолчанию временный файл SQLite)")
+def generate_command(scale, products, users, days, seed, storage_url):
+    """Только генерирует набор данных (например, для ручной проверки)"""
+    spec = DatasetSpec.from_scale(scale, products=products, users=users, days=days, seed=seed)
+    storage_url, db = prepare_storage(storage_url, scale)
+    try:
+        dataset = generate(db, spec, progress=report_progress)
+    finally:
+        db.close()
+    dataset.pop("user_ids")
+    click.echo(f"{storage_url}: {dataset}")
+
+
+@cli.command("compare")
+@click.argument("base", type=click.Path(exists=True, dir_okay=False))
+@click.argument("new", type=click.Path(exists=True, dir_okay=False))
+@click.option("--threshold", type=float, default=0.1, show_default=True,
+              help="Допустимое замедление (0.1 — 10%)")
+def compare_command(base, new, threshold):
+    """Сравнивает два прогона; код выхода 1 при регрессиях сверх порога"""
+    base, new = load_results(base), load_results(new)
+    for key in ("backend", "dataset"):
+        if base["meta"].get(key) != new["meta"].get(key):
+            click.echo(f"Внимание: прогоны различаются ({key}), сравнение может быть некорректным")
+    rows = compare(base, new, threshold)
+    for row in rows:
+        mark = "РЕГРЕССИЯ" if row["regression"] else ("ускорение" if row["improvement"] else "")
+        click.echo(f"{row['name']:45} {row['change']:+8.1%}  {mark}")
+
+    regressions = [row["name"] for row in rows if row["regression"]]
+    if regressions:
+        click.echo(f"Регрессий сверх {threshold:.0%}: {len(regressions)}")
+        sys.exit(1)
+    click.echo("Регрессий нет")
+
+
+if __name__ == "__main__":
+    cli(prog_name="python -m benchmarks")
@@ -0,0 +1,170 @@
+import time
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from services.storage import StorageBackend
+
+
+# Размер набора данных — число записей дневника; каталог и пользователи
+# масштабируются вместе с ним
+SCALES = {
+    "1k": 1_000,
+    "10k": 10_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+
+# Средние КБЖУ на 100 г для нескольких типов продуктов: каталог получается
+# похожим на настоящий, а не равномерным шумом
+PRODUCT_PROFILES = np.array([
+    # calories, proteins, fats, carbs
+    [350.0, 10.0, 2.0, 72.0],   # крупы, хлеб
+    [165.0, 28.0, 5.0, 0.5],    # мясо, птица
+    [120.0, 20.0, 4.0, 0.5],    # рыба
+    [60.0, 3.0, 2.5, 5.0],      # молочные продукты
+    [45.0, 1.0, 0.3, 10.0],     # фрукты, овощи
+    [560.0, 20.0, 48.0, 16.0],  # орехи, семена
+    [480.0, 6.0, 24.0, 60.0],   # сладости
+])
+
+# Названия: основа по типу продукта (в порядке PRODUCT_PROFILES), уточнение
+# и марка, чтобы поиск по названию работал на правдоподобном тексте
+PRODUCT_NOUNS = (
+    ("Гречка", "Рис", "Овсянка", "Хлеб", "Макароны", "Булгур", "Хлопья", "Батон", "Лаваш", "Кускус"),
+    ("Курица", "Говядина", "Индейка", "Свинина", "Фарш", "Котлеты", "Колбаса", "Ветчина", "Сосиски", "Бекон"),
+    ("Лосось", "Треска", "Тунец", "Сельдь", "Минтай", "Скумбрия", "Форель", "Креветки", "Кальмар", "Горбуша"),
+    ("Молоко", "Кефир", "Йогурт", "Творог", "Сыр", "Сметана", "Ряженка", "Простокваша", "Айран", "Сливки"),
+    ("Яблоки", "Бананы", "Апельсины", "Морковь", "Томаты", "Огурцы", "Капуста", "Груши", "Брокколи", "Перец"),
+    ("Миндаль", "Фундук", "Арахис", "Кешью", "Грецкий орех", "Семечки", "Фисташки", "Кунжут", "Пекан", "Лён"),
+    ("Шоколад", "Печенье", "Вафли", "Пряники", "Зефир", "Мармелад", "Халва", "Торт", "Конфеты", "Пастила"),
+)
+PRODUCT_MODIFIERS = ("", "", "классика", "домашнее", "фермерское", "органик", "отборное", "премиум",
+                     "лайт", "традиционное", "для детей", "без сахара", "эко", "по-деревенски")
+BRAND_SYLLABLES = ("ма", "ри", "то", "ле", "ва", "ни", "ко", "ра", "си", "по", "лу", "де", "бо", "за", "ми", "та")
+
+BATCH_SIZE = 10_000  # Записей в одной транзакции
+
+
+class DatasetSpec:
+    """Параметры синтетического набора данных"""
+
+    def __init__(self, entries: int, products: int = None, users: int = None,
+                 days: int = 90, seed: int = 42):
+        self.entries = entries
+        self.products = products if products is not None else max(100, min(entries // 10, 200_000))
+        self.users = users if users is not None else max(1, entries // 200)
+        self.days = days
+        self.seed = seed
+
+    @classmethod
+    def from_scale(cls, scale: str, **overrides) -> 'DatasetSpec':
+        if scale not in SCALES:
+            raise ValueError(f"Неизвестный масштаб {scale}, доступны: {', '.join(SCALES)}")
+        return cls(SCALES[scale], **{k: v for k, v in overrides.items() if v is not None})
+
+    def as_dict(self) -> Dict:
+        return {
+            "entries": self.entries,
+            "products": self.products,
+            "users": self.users,
+            "days": self.days,
+            "seed": self.seed
+        }
+
+
+def generate_products(spec: DatasetSpec) -> List[Dict]:
+    """Каталог: профиль продукта плюс разброс ±40%, значения на 100 г"""
+    rng = np.random.default_rng(spec.seed)
+    profiles = rng.integers(0, len(PRODUCT_PROFILES), spec.products)
+    values = PRODUCT_PROFILES[profiles] * rng.uniform(0.6, 1.4, (spec.products, 4))
+    values = np.round(values, 1)
+    nouns = rng.integers(0, len(PRODUCT_NOUNS[0]), spec.products)
+    modifiers = rng.integers(0, len(PRODUCT_MODIFIERS), spec.products)
+    brands = rng.integers(0, len(BRAND_SYLLABLES), (spec.products, 3))
+    brand_lengths = rng.integers(2, 4, spec.products)
+    return [
+        {
+            "barcode": f"2{index:012d}",
+            "name": " ".join(part for part in (
+                PRODUCT_NOUNS[profiles[index]][nouns[index]],
+                PRODUCT_MODIFIERS[modifiers[index]],
+                "".join(BRAND_SYLLABLES[syllable] for syllable in brands[index, :brand_lengths[index]]).capitalize()
+            ) if part),
+            "calories": float(row[0]),
+            "proteins": float(row[1]),
+            "fats": float(row[2]),
+            "carbs": float(row[3])
+        }
+        for index, row in enumerate(values)
+    ]
+
+
+def generate_settings(spec: DatasetSpec) -> Iterator[Dict]:
+    """Параметры пользователей"""
+    rng = np.random.default_rng(spec.seed + 1)
+    for _ in range(spec.users):
+        gender = "male" if rng.random() < 0.5 else "female"
+        yield {
+            "weight": round(float(rng.normal(80 if gender == "male" else 65, 10)), 1),
+            "height": round(float(rng.normal(178 if gender == "male" else 165, 7)), 1),
+            "age": int(rng.integers(18, 70)),
+            "gender": gender,
+            "activity_level": float(rng.choice([1.2, 1.375, 1.55, 1.725]))
+        }
+
+
+def generate_entries(spec: DatasetSpec, user_ids: List[int],
+                     product_ids: List[int]) -> Iterator[List[Tuple[int, int, str, float]]]:
+    """
+    Записи дневника пачками по BATCH_SIZE
+
+    Популярность продуктов распределена по Ципфу, как в реальных дневниках;
+    даты — последние spec.days дней относительно сегодняшнего дня, чтобы
+    запросы «за 30 дней» находили данные при любом дне запуска.
+    """
+    rng = np.random.default_rng(spec.seed + 2)
+    users = np.asarray(user_ids)
+    products = np.asarray(product_ids)
+    today = date.today()
+    dates = np.array([(today - timedelta(days=offset)).isoformat() for offset in range(spec.days)])
+
+    for start in range(0, spec.entries, BATCH_SIZE):
+        size = min(BATCH_SIZE, spec.entries - start)
+        user_index = rng.integers(0, len(users), size)
+        product_index = (rng.zipf(1.3, size) - 1) % len(products)
+        day_index = rng.integers(0, len(dates), size)
+        grams = np.round(rng.gamma(4.0, 40.0, size), 0).clip(5, 1000)
+        yield list(zip(users[user_index].tolist(), products[product_index].tolist(),
+                       dates[day_index].tolist(), grams.tolist()))
+
+
+def generate(db: StorageBackend, spec: DatasetSpec, progress=None) -> Dict:
+    """
+    Заполняет пустое хранилище синтетическими данными
+
+    Returns:
+        Параметры набора и время генерации
+    """
+    started = time.perf_counter()
+
+    products = generate_products(spec)
+    for start in range(0, len(products), BATCH_SIZE):
+        db.add_or_update_products(products[start:start + BATCH_SIZE])
+    product_ids = [row[0] for row in sorted(db.iter_catalog_rows(), key=lambda row: row[0])]
+
+    user_ids = []
+    for settings in generate_settings(spec):
+        user_id = db.create_user()
+        db.save_user_settings(user_id, settings)
+        user_ids.append(user_id)
+
+    written = 0
+    for batch in generate_entries(spec, user_ids, product_ids):
+        written += db.add_consumptions(batch)
+        if progress is not None:
+            progress(written, spec.entries)
+
+    return {**spec.as_dict(), "user_ids": user_ids, "elapsed": round(time.perf_counter() - started, 3)}
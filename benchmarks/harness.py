@@ -0,0 +1,108 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+
+def measure(func: Callable[[], object], repeat: int = 50, warmup: int = 3,
+            min_time: float = 0.0) -> Dict:
+    """
+    Замеряет время вызова func
+
+    Выполняет warmup прогревочных вызовов, затем не меньше repeat замеров
+    и не меньше min_time секунд суммарно. Время — в миллисекундах.
+    """
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < repeat or time.perf_counter() - started < min_time:
+        begin = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - begin) * 1000)
+    return summarize(samples)
+
+
+def summarize(samples: List[float]) -> Dict:
+    """Сводка по замерам (мс)"""
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0], 4),
+        "median_ms": round(statistics.median(ordered), 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 4),
+        "mean_ms": round(total / len(ordered), 4),
+        "ops_per_sec": round(len(ordered) / (total / 1000), 1) if total > 0 else None
+    }
+
+
+def environment() -> Dict:
+    """Описание окружения прогона"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(__file__), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def write_results(path: str, meta: Dict, results: Dict[str, Dict]):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+def load_results(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Метрика сравнения: для замеров времени — медиана, для пропускной
+# способности (rows_per_sec, req_per_sec) — обратная величина
+TIME_METRIC = "median_ms"
+RATE_METRICS = ("rows_per_sec", "req_per_sec")
+
+
+def _cost(result: Dict) -> Optional[float]:
+    """Стоимость результата: чем больше, тем хуже"""
+    if TIME_METRIC in result:
+        return result[TIME_METRIC]
+    for metric in RATE_METRICS:
+        if result.get(metric):
+            return 1.0 / result[metric]
+    return None
+
+
+def compare(base: Dict, new: Dict, threshold: float = 0.1) -> List[Dict]:
+    """
+    Сравнивает два прогона по общим бенчмаркам
+
+    Returns:
+        Строки сравнения; regression = True, если новый прогон медленнее
+        базового больше чем на threshold (0.1 — на 10%)
+    """
+    rows = []
+    for name in sorted(set(base["results"]) & set(new["results"])):
+        before, after = _cost(base["results"][name]), _cost(new["results"][name])
+        if not before or not after:
+            continue
+        change = after / before - 1
+        rows.append({
+            "name": name,
+            "change": round(change, 4),
+            "regression": change > threshold,
+            "improvement": change < -threshold
+        })
+    return rows
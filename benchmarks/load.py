@@ -0,0 +1,122 @@
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.harness import summarize
+
+
+# Сценарий одного посетителя: (название, метод, путь, данные формы)
+SCENARIO = [
+    ("index", "GET", "/", None),
+    ("index_repeat", "GET", "/", None),  # Без изменений: 304 по ETag
+    ("save_entry", "POST", "/", {
+        "save_entry": "1", "name": "Гречка", "barcode": "4600000000017",
+        "calories": "343", "proteins": "12.6", "fats": "3.3", "carbs": "62.1", "grams": "150"
+    }),
+    ("diary", "GET", "/diary?limit=50", None),
+    ("recommendations", "GET", "/get-recommendations", None),
+    ("meal_plan", "GET", "/get-recommendations?mode=plan", None),
+]
+
+SEARCH_STEP = ("search", "POST", "/", {"search_product": "1", "barcode": None})
+
+SETTINGS = {"weight": "72", "height": "176", "age": "31", "gender": "male", "activity_level": "1.55"}
+
+
+class ConditionalGet:
+    """Запоминает ETag ответов на GET и повторяет запрос с If-None-Match, как браузер"""
+
+    def __init__(self):
+        self.etags: Dict[str, str] = {}
+
+    def conditional_headers(self, method: str, path: str) -> Dict[str, str]:
+        etag = self.etags.get(path) if method == "GET" else None
+        return {"If-None-Match": etag} if etag else {}
+
+    def remember(self, method: str, path: str, status: int, etag: Optional[str]):
+        if method == "GET" and status == 200:
+            if etag:
+                self.etags[path] = etag
+            else:
+                self.etags.pop(path, None)
+
+
+class TestClientSession(ConditionalGet):
+    """Посетитель через тестовый клиент Flask (без сети)"""
+
+    def __init__(self, app):
+        super().__init__()
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, data: Optional[Dict] = None) -> int:
+        response = self.client.open(path, method=method, data=data,
+                                    headers=self.conditional_headers(method, path))
+        response.get_data()
+        self.remember(method, path, response.status_code, response.headers.get("ETag"))
+        return response.status_code
+
+
+class HttpSession(ConditionalGet):
+    """Посетитель живого сервера по HTTP"""
+
+    def __init__(self, base_url: str):
+        import requests
+        super().__init__()
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method: str, path: str, data: Optional[Dict] = None) -> int:
+        response = self.session.request(method, self.base_url + path, data=data, allow_redirects=False, timeout=60,
+                                        headers=self.conditional_headers(method, path))
+        self.remember(method, path, response.status_code, response.headers.get("ETag"))
+        return response.status_code
+
+
+def run_load(make_session: Callable[[], object], sessions: int = 8, iterations: int = 10,
+             search: bool = False, seed: int = 42) -> Dict[str, Dict]:
+    """
+    Сквозной сценарий: sessions параллельных посетителей по iterations кругов
+
+    Каждый посетитель сохраняет параметры, затем открывает главную, добавляет
+    запись, листает дневник и запрашивает рекомендации (и поиск по штрих-коду,
+    если search). Returns: сводка по каждому шагу и общий req_per_sec.
+    """
+    steps = SCENARIO + ([SEARCH_STEP] if search else [])
+    samples: Dict[str, List[float]] = {name: [] for name, _, _, _ in steps}
+    errors = []
+    lock = threading.Lock()
+
+    def visitor(number: int):
+        rng = random.Random(seed + number)
+        session = make_session()
+        session.request("POST", "/save-settings", SETTINGS)
+        for _ in range(iterations):
+            for name, method, path, data in steps:
+                if name == "search":
+                    data = {**data, "barcode": str(rng.randrange(10 ** 12, 10 ** 13))}
+                begin = time.perf_counter()
+                status = session.request(method, path, data)
+                elapsed = (time.perf_counter() - begin) * 1000
+                with lock:
+                    samples[name].append(elapsed)
+                    if status >= 400:
+                        errors.append((name, status))
+
+    threads = [threading.Thread(target=visitor, args=(number,)) for number in range(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in samples.values())
+    results = {f"load.{name}": summarize(values) for name, values in samples.items() if values}
+    results["load.total"] = {
+        "requests": total,
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "req_per_sec": round(total / elapsed, 1)
+    }
+    return results
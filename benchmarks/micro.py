@@ -0,0 +1,501 @@
+import asyncio
+import gzip
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from services.api_client import OpenFoodFactsAPI, BarcodeCache
+from services.calorie_calculator import CalorieCalculator
+from services.importer import DiaryImporter, ProductDumpImporter
+from services.exporter import DiaryExporter, parquet_supported
+from services.analytics import NutritionReport
+from services.product_catalog import ProductCatalog, catalog_cache
+from services.recommendation_engine import RecommendationEngine
+from services.storage import StorageBackend, create_storage
+from services.write_queue import WriteQueue
+from benchmarks.harness import measure, summarize
+from benchmarks.upstream import FakeOpenFoodFacts
+
+
+# Бенчмарки по имени; порядок регистрации — порядок запуска
+# (записывающие идут после читающих, чтобы не менять данные под ними)
+BENCHMARKS: Dict[str, Callable[['Context'], Dict]] = {}
+
+
+def benchmark(name: str):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+class Context:
+    """Общие данные бенчмарков: хранилище, пользователи и их нормы"""
+
+    def __init__(self, db: StorageBackend, user_ids: List[int], repeat: int = 50, seed: int = 42):
+        self.db = db
+        self.user_ids = user_ids
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+        self.today = date.today().isoformat()
+        self.norms = {}
+        for user_id in self.rng.sample(user_ids, min(len(user_ids), 64)):
+            self.norms[user_id] = CalorieCalculator.daily_norms(**db.get_user_settings(user_id)._asdict())
+
+    def user(self) -> int:
+        return self.rng.choice(self.user_ids)
+
+    def user_with_norms(self):
+        user_id = self.rng.choice(list(self.norms))
+        return user_id, self.norms[user_id]
+
+    def heaviest_user(self) -> int:
+        """Пользователь с самым длинным дневником среди выборки"""
+        return max(self.norms, key=lambda user_id: len(self.db.get_food_diary(user_id, 90)))
+
+
+# Хранилище: чтение
+
+@benchmark("storage.get_today_nutrition")
+def bench_today_nutrition(ctx: Context) -> Dict:
+    return measure(lambda: ctx.db.get_today_nutrition(ctx.user(), ctx.today), ctx.repeat * 4)
+
+
+@benchmark("storage.get_food_diary")
+def bench_food_diary(ctx: Context) -> Dict:
+    return measure(lambda: ctx.db.get_food_diary(ctx.user()), ctx.repeat)
+
+
+@benchmark("storage.get_food_diary_page.first")
+def bench_food_diary_first_page(ctx: Context) -> Dict:
+    return measure(lambda: ctx.db.get_food_diary_page(ctx.user(), limit=50), ctx.repeat * 4)
+
+
+@benchmark("storage.get_food_diary_page.deep")
+def bench_food_diary_deep_page(ctx: Context) -> Dict:
+    # Страница из середины длинного дневника: keyset-пагинация не должна
+    # зависеть от глубины
+    user_id = ctx.heaviest_user()
+    after = None
+    for _ in range(10):
+        _, next_cursor = ctx.db.get_food_diary_page(user_id, 90, 20, after)
+        if next_cursor is None:
+            break
+        after = next_cursor
+    return measure(lambda: ctx.db.get_food_diary_page(user_id, 90, 20, after), ctx.repeat * 4)
+
+
+@benchmark("storage.iter_food_diary")
+def bench_iter_food_diary(ctx: Context) -> Dict:
+    user_id = ctx.heaviest_user()
+    return measure(lambda: sum(1 for _ in ctx.db.iter_food_diary(user_id, 90)), ctx.repeat)
+
+
+@benchmark("storage.get_user_settings")
+def bench_user_settings(ctx: Context) -> Dict:
+    return measure(lambda: ctx.db.get_user_settings(ctx.user()), ctx.repeat * 4)
+
+
+def _bytes_per_row(rows: List[tuple], convert: Callable[[tuple], object]) -> float:
+    """Память (байт на строку), которую занимают строки в представлении convert"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        converted = [convert(row) for row in rows]
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del converted
+    return round(used / max(1, len(rows)), 1)
+
+
+@benchmark("memory.rows")
+def bench_row_memory(ctx: Context) -> Dict:
+    # Строки каталога и дневника в прежнем виде (словарь на строку) и в виде
+    # типов services.records. Значения полей общие, поэтому разница — это
+    # накладные расходы самого контейнера строки
+    catalog = list(itertools.islice(ctx.db.iter_catalog_rows(), 50_000))
+    diary = list(ctx.db.iter_food_diary(ctx.heaviest_user(), 365))
+    result = {"catalog_rows": len(catalog), "diary_rows": len(diary)}
+    for label, rows in (("catalog", catalog), ("diary", diary)):
+        fields = type(rows[0])._fields
+        result[f"{label}_dict_bytes_per_row"] = _bytes_per_row(rows, lambda row: dict(zip(fields, row)))
+        result[f"{label}_record_bytes_per_row"] = _bytes_per_row(rows, type(rows[0])._make)
+    return result
+
+
+@benchmark("export.diary")
+def bench_export(ctx: Context) -> Dict:
+    # Весь дневник набора (на масштабе 10m — 10 млн строк) во всех форматах;
+    # байты выгрузки не сохраняются, меряется чтение и кодирование
+    result = {}
+    for fmt in DiaryExporter.FORMATS:
+        if fmt == "parquet" and not parquet_supported():
+            continue
+        exporter = DiaryExporter(ctx.db, None)
+        for _ in exporter.stream(fmt):
+            pass
+        result["records"] = exporter.stats.records
+        result[f"{fmt}_rows_per_sec"] = round(exporter.stats.rows_per_sec, 1)
+        result[f"{fmt}_bytes_per_row"] = round(exporter.stats.bytes / max(1, exporter.stats.records), 1)
+    return result
+
+
+@benchmark("analytics.year_by_week")
+def bench_analytics_year(ctx: Context) -> Dict:
+    # Год истории — до 366 строк дневных итогов, сколько бы ни было записей
+    end = date.today()
+    start = end - timedelta(days=364)
+
+    def run():
+        user_id, norms = ctx.user_with_norms()
+        NutritionReport.load(ctx.db, user_id, start, end, norms).as_dict("week")
+
+    return measure(run, ctx.repeat)
+
+
+@benchmark("search.typeahead")
+def bench_search_typeahead(ctx: Context) -> Dict:
+    # Запрос на каждое нажатие клавиши при наборе названий существующих
+    # продуктов: от одной буквы до полного названия
+    names = [row.name for row in itertools.islice(ctx.db.iter_catalog_rows(), 10_000)]
+    queries = [
+        name[:length]
+        for name in ctx.rng.sample(names, min(len(names), 40))
+        for length in range(1, len(name) + 1)
+        if not name[:length].endswith(" ")
+    ]
+    for query in queries[:100]:  # Прогрев страничного кэша
+        ctx.db.search_products(query)
+
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        ctx.db.search_products(query)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"queries": len(queries), **summarize(samples)}
+
+
+# Каталог и рекомендации
+
+@benchmark("catalog.load")
+def bench_catalog_load(ctx: Context) -> Dict:
+    return measure(lambda: ProductCatalog.load(ctx.db), max(5, ctx.repeat // 5), warmup=1)
+
+
+@benchmark("catalog.cache_hit")
+def bench_catalog_cache_hit(ctx: Context) -> Dict:
+    catalog_cache.get(ctx.db)
+    return measure(lambda: catalog_cache.get(ctx.db), ctx.repeat * 4)
+
+
+@benchmark("recommendation.recommend_products")
+def bench_recommend(ctx: Context) -> Dict:
+    engine = RecommendationEngine(ctx.db)
+
+    def run():
+        user_id, norms = ctx.user_with_norms()
+        engine.recommend_products(norms, ctx.db.get_today_nutrition(user_id, ctx.today))
+
+    return measure(run, ctx.repeat)
+
+
+@benchmark("recommendation.plan_meal")
+def bench_plan_meal(ctx: Context) -> Dict:
+    engine = RecommendationEngine(ctx.db)
+
+    def run():
+        user_id, norms = ctx.user_with_norms()
+        engine.plan_meal(norms, ctx.db.get_today_nutrition(user_id, ctx.today))
+
+    return measure(run, max(10, ctx.repeat // 2))
+
+
+@benchmark("calculator.daily_norms")
+def bench_daily_norms(ctx: Context) -> Dict:
+    settings = [ctx.db.get_user_settings(user_id) for user_id in ctx.norms]
+
+    def run():
+        for user_settings in settings:
+            CalorieCalculator.get_macronutrients(CalorieCalculator.calculate_daily_calories(*user_settings))
+
+    return measure(run, ctx.repeat)
+
+
+@benchmark("calculator.daily_norms_batch")
+def bench_daily_norms_batch(ctx: Context) -> Dict:
+    # Нормы для популяции в 100 тысяч пользователей одним векторным проходом
+    rng = np.random.default_rng(ctx.rng.randrange(2 ** 32))
+    users = 100_000
+    settings = {
+        "weight": np.round(rng.uniform(45, 130, users), 1),
+        "height": rng.integers(150, 200, users),
+        "age": rng.integers(16, 80, users),
+        "gender": rng.choice(["male", "female"], users),
+        "activity_level": rng.choice([1.2, 1.375, 1.55, 1.725, 1.9], users)
+    }
+    result = measure(lambda: CalorieCalculator.daily_norms_batch(settings), max(5, ctx.repeat // 5), warmup=1)
+    result["users_per_sec"] = round(users / (result["median_ms"] / 1000))
+    return result
+
+
+# Старт процесса
+
+# Код отдельного процесса: время от импорта приложения до первого ответа
+# главной страницы пользователю с настройками (с рекомендациями)
+STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app(warmup=sys.argv[2] == "1")
+ready = time.perf_counter()
+client = app.test_client()
+with client.session_transaction() as session:
+    session["user_id"] = int(sys.argv[1])
+status = client.get("/").status_code
+done = time.perf_counter()
+print(json.dumps({"status": status, "import_ms": (imported - started) * 1000,
+                  "ready_ms": (ready - started) * 1000, "total_ms": (done - started) * 1000}))
+"""
+STARTUP_RUNS = 10
+
+
+def _startup(ctx: Context, warmup: bool) -> Dict:
+    # Каждый замер — новый интерпретатор; хранилище берётся из DATABASE_URL
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    runs = []
+    for _ in range(STARTUP_RUNS + 1):
+        user_id, _ = ctx.user_with_norms()
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, str(user_id), "1" if warmup else "0"],
+                                cwd=root, capture_output=True, text=True, check=True).stdout
+        run = json.loads(output.splitlines()[-1])
+        if run["status"] != 200:
+            raise RuntimeError(f"Первый ответ: HTTP {run['status']}")
+        runs.append(run)
+    runs = runs[1:]  # Первый запуск прогревает страничный кэш ОС
+    result = summarize([run["total_ms"] for run in runs])
+    for key in ("import_ms", "ready_ms"):
+        result[f"{key[:-3]}_median_ms"] = round(statistics.median(run[key] for run in runs), 1)
+    result["first_request_median_ms"] = round(statistics.median(run["total_ms"] - run["ready_ms"] for run in runs), 1)
+    return result
+
+
+@benchmark("startup.first_response")
+def bench_startup(ctx: Context) -> Dict:
+    return _startup(ctx, warmup=False)
+
+
+@benchmark("startup.first_response.warmup")
+def bench_startup_warmup(ctx: Context) -> Dict:
+    # Прогрев переносит открытие соединений, импорт модулей, загрузку каталога
+    # и компиляцию всех шаблонов до готовности процесса: готовность наступает
+    # позже, зато первый запрос не ждёт ничего из этого
+    return _startup(ctx, warmup=True)
+
+
+# Хранилище: запись
+
+@benchmark("storage.add_consumption")
+def bench_add_consumption(ctx: Context) -> Dict:
+    product_ids = [row.id for row in ctx.db.iter_catalog_rows()]
+    return measure(lambda: ctx.db.add_consumption(ctx.user(), ctx.rng.choice(product_ids), 150), ctx.repeat * 2)
+
+
+@benchmark("storage.add_or_update_product")
+def bench_add_or_update_product(ctx: Context) -> Dict:
+    # Изменение КБЖУ продукта пересчитывает итоги всех дней, где он был съеден
+    barcodes = [row.barcode for row in ctx.db.iter_catalog_rows()]
+
+    def run():
+        ctx.db.add_or_update_product({
+            "barcode": ctx.rng.choice(barcodes), "name": "Обновлённый продукт",
+            "calories": ctx.rng.uniform(50, 500), "proteins": 10.0, "fats": 5.0, "carbs": 20.0
+        })
+
+    return measure(run, ctx.repeat)
+
+
+def _concurrent_writes(write: Callable[[], object], writers: int, total: int) -> Dict:
+    """
+    Выполняет total записей из writers потоков
+
+    Сводка задержек одной записи (мс), пропускная способность и число
+    записей, закончившихся ошибкой (например, БД занята).
+    """
+    samples, errors = [], 0
+    lock = threading.Lock()
+
+    def writer(count: int):
+        nonlocal errors
+        for _ in range(count):
+            begin = time.perf_counter()
+            try:
+                write()
+            except Exception:
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                samples.append((time.perf_counter() - begin) * 1000)
+
+    threads = [threading.Thread(target=writer, args=(total // writers,)) for _ in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    result = summarize(samples) if samples else {}
+    result["writes_per_sec"] = round(len(samples) / elapsed, 1)
+    result["errors"] = errors
+    return result
+
+
+def _bench_write_queue(writers: int):
+    def run(ctx: Context) -> Dict:
+        # Запись из формы дневника: продукт и запись о потреблении. Напрямую
+        # каждый запрос открывает свою транзакцию; через очередь их
+        # фиксирует пакетами один поток-писатель
+        barcodes = [row.barcode for row in itertools.islice(ctx.db.iter_catalog_rows(), 1000)]
+        total = max(writers * 4, ctx.repeat * 8)
+
+        def entry():
+            product = {"barcode": ctx.rng.choice(barcodes), "name": "Запись из формы",
+                       "calories": 250.0, "proteins": 10.0, "fats": 5.0, "carbs": 20.0}
+            return ctx.user(), product
+
+        def save(db: StorageBackend, user_id: int, product: Dict) -> bool:
+            return db.add_consumption(user_id, db.add_or_update_product(product), 150)
+
+        def direct():
+            db = create_storage()
+            try:
+                save(db, *entry())
+            finally:
+                db.close()
+
+        queue = WriteQueue()
+        try:
+            queued = _concurrent_writes(lambda: queue.submit(save, *entry()).result(), writers, total)
+        finally:
+            queue.close()
+        direct_result = _concurrent_writes(direct, writers, total)
+        return {
+            **queued,
+            "writers": writers,
+            "batches": queue.batches,
+            "max_batch": queue.max_batch_seen,
+            "direct_median_ms": direct_result.get("median_ms"),
+            "direct_p99_ms": direct_result.get("p99_ms"),
+            "direct_writes_per_sec": direct_result["writes_per_sec"],
+            "direct_errors": direct_result["errors"]
+        }
+    return run
+
+
+for _writers in (1, 8, 64):
+    benchmark(f"storage.write_queue.{_writers}")(_bench_write_queue(_writers))
+
+
+@benchmark("importer.import_records")
+def bench_import(ctx: Context) -> Dict:
+    records = 20_000
+    rows = [
+        {"barcode": f"3{index % 2000:012d}", "name": f"Импорт {index % 2000}", "calories": 100 + index % 300,
+         "proteins": 10, "fats": 5, "carbs": 20, "grams": 150,
+         "date": (date.today() - timedelta(days=index % 30)).isoformat()}
+        for index in range(records)
+    ]
+    stats = DiaryImporter(ctx.db, ctx.user()).import_records(rows)
+    return {"records": stats.records, "elapsed_s": round(stats.elapsed, 3), "rows_per_sec": round(stats.rows_per_sec, 1)}
+
+
+def _write_product_dump(path: str, products: int, prefix: str):
+    with gzip.open(path, "wt", encoding="utf-8") as dump:
+        for index in range(products):
+            dump.write(json.dumps({
+                "code": f"{prefix}{index:012d}", "product_name": f"Выгрузка {index}",
+                "last_modified_t": 1_700_000_000 + index,
+                "nutriments": {"energy-kcal_100g": 50 + index % 400, "proteins_100g": 10,
+                               "fat_100g": 5, "carbohydrates_100g": 20}
+            }, ensure_ascii=False) + "\n")
+
+
+@benchmark("importer.product_dump")
+def bench_product_dump(ctx: Context) -> Dict:
+    # Выгрузка в формате OpenFoodFacts JSONL: разбор в одном процессе и в
+    # нескольких. У каждого прогона свои штрих-коды, чтобы оба вставляли
+    products = 50_000
+    result = {"products": products}
+    with tempfile.TemporaryDirectory() as directory:
+        for label, workers, prefix in (("single", 1, "6"), ("parallel", None, "7")):
+            path = os.path.join(directory, f"{label}.jsonl.gz")
+            _write_product_dump(path, products, prefix)
+            importer = ProductDumpImporter(ctx.db, workers=workers, source=f"benchmark-{label}")
+            stats = importer.import_file(path, incremental=False, resume=False)
+            result[f"{label}_workers"] = importer.workers
+            result[f"{label}_rows_per_sec"] = round(stats.rows_per_sec, 1)
+    return result
+
+
+# Поиск по штрих-кодам через заглушку OpenFoodFacts
+
+def _resolve_barcodes(ctx: Context, delay: float, resolve: Callable[[List[str]], Dict]) -> Dict:
+    barcodes = [f"{index % 10}{index:012d}" for index in range(300)]  # Каждый десятый не найден
+    base_url, cache = OpenFoodFactsAPI.BASE_URL, OpenFoodFactsAPI.cache
+    with FakeOpenFoodFacts(delay) as upstream:
+        OpenFoodFactsAPI.BASE_URL = upstream.base_url
+        # Часть штрих-кодов есть в сгенерированном каталоге: меряем путь до API
+        OpenFoodFactsAPI.local_lookup = False
+        # Нулевой срок жизни: каждый штрих-код действительно запрашивается
+        OpenFoodFactsAPI.cache = BarcodeCache(ttl=0, negative_ttl=0, stale_ttl=0)
+        try:
+            started = time.perf_counter()
+            results = resolve(barcodes)
+            elapsed = time.perf_counter() - started
+        finally:
+            OpenFoodFactsAPI.BASE_URL, OpenFoodFactsAPI.cache = base_url, cache
+            OpenFoodFactsAPI.local_lookup = True
+    return {
+        "barcodes": len(barcodes),
+        "found": sum(product is not None for product in results.values()),
+        "upstream_calls": upstream.calls,
+        "elapsed_s": round(elapsed, 3),
+        "req_per_sec": round(len(barcodes) / elapsed, 1)
+    }
+
+
+@benchmark("api.get_products_by_barcodes")
+def bench_bulk_barcodes(ctx: Context) -> Dict:
+    return _resolve_barcodes(ctx, 0.02, lambda barcodes: OpenFoodFactsAPI.get_products_by_barcodes(barcodes, max_workers=16))
+
+
+@benchmark("api.aget_products_by_barcodes")
+def bench_bulk_barcodes_async(ctx: Context) -> Dict:
+    return _resolve_barcodes(ctx, 0.02, lambda barcodes: asyncio.run(
+        OpenFoodFactsAPI.aget_products_by_barcodes(barcodes, concurrency=16)))
+
+
+def run_micro(ctx: Context, only: Optional[List[str]] = None, progress=None) -> Dict[str, Dict]:
+    """Запускает бенчмарки, имена которых начинаются с одного из префиксов only"""
+    results = {}
+    for name, func in BENCHMARKS.items():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        results[name] = func(ctx)
+        if progress is not None:
+            progress(name, results[name])
+    return results
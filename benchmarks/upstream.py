@@ -0,0 +1,71 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenFoodFacts:
+    """
+    Локальная заглушка API OpenFoodFacts с настраиваемой задержкой ответа
+
+    Штрих-коды, начинающиеся с 0, «не найдены» (404), остальные возвращают
+    продукт с фиксированным КБЖУ.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/v2"
+
+    def start(self) -> 'FakeOpenFoodFacts':
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+
+            def do_GET(self):
+                with upstream._lock:
+                    upstream.calls += 1
+                if upstream.delay:
+                    time.sleep(upstream.delay)
+                barcode = self.path.rsplit("/", 1)[-1]
+                if barcode.startswith("0"):
+                    status, body = 404, {"status": 0}
+                else:
+                    status, body = 200, {"status": 1, "product": {
+                        "product_name": f"Продукт {barcode}",
+                        "nutriments": {"energy-kcal_100g": 250, "proteins_100g": 12,
+                                       "fat_100g": 9, "carbohydrates_100g": 30}
+                    }}
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 256
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeOpenFoodFacts':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,162 @@
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from services.storage import StorageBackend
+from services.records import DailyTotals
+
+
+# Нутриенты в порядке столбцов daily_totals
+NUTRIENTS = ("calories", "proteins", "fats", "carbs")
+
+PERIODS = ("day", "week", "month")
+# Глубина отчёта по умолчанию, дни
+DEFAULT_DAYS = {"day": 30, "week": 84, "month": 365}
+MAX_DAYS = 3660
+
+# День «в норме»: калории отличаются от нормы не больше чем на 10%
+TARGET_TOLERANCE = 0.1
+
+
+def period_start(day: date, period: str) -> date:
+    """Первый день периода, которому принадлежит day (неделя — с понедельника)"""
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _round(values: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(value) else round(float(value), 1) for value in values]
+
+
+def _nutrients(values: np.ndarray) -> Dict[str, Optional[float]]:
+    return dict(zip(NUTRIENTS, _round(values)))
+
+
+class NutritionReport:
+    """
+    Сводка питания пользователя за диапазон дат
+
+    Строится по дневным итогам (daily_totals): их поддерживают триггеры
+    при каждой записи, поэтому год истории — не больше 366 строк, а не все
+    записи дневника. Недельные и месячные итоги собираются из дневных.
+    Средние и соблюдение нормы считаются по дням с записями: день без
+    записей означает «не заполнено», а не «ничего не съедено».
+    """
+
+    def __init__(self, rows: List[DailyTotals], start: date, end: date, norms: Optional[Dict] = None,
+                 history: int = 0):
+        """
+        rows — строки get_daily_totals за даты от start - history до end;
+        дни до start нужны только скользящему среднему.
+        """
+        self.start = start
+        self.end = end
+        self.norms = norms
+        self.days = (end - start).days + 1
+        self.history = history
+
+        # Плотные массивы по календарным дням; NaN — день без записей
+        first = start - timedelta(days=history)
+        self._values = np.full((self.days + history, len(NUTRIENTS)), np.nan)
+        self._entries = np.zeros(self.days + history, dtype=np.int64)
+        for row in rows:
+            offset = (date.fromisoformat(row.date) - first).days
+            if 0 <= offset < len(self._entries):
+                self._values[offset] = row[1:5]
+                self._entries[offset] = row.entries
+        self.values = self._values[history:]
+        self.entries = self._entries[history:]
+
+    @classmethod
+    def load(cls, db: StorageBackend, user_id: int, start: date, end: date,
+             norms: Optional[Dict] = None, window: int = 7) -> 'NutritionReport':
+        """Читает дневные итоги диапазона и window - 1 дней перед ним"""
+        history = max(window - 1, 0)
+        rows = db.get_daily_totals(user_id, (start - timedelta(days=history)).isoformat(), end.isoformat())
+        return cls(rows, start, end, norms, history)
+
+    def _norm_vector(self) -> Optional[np.ndarray]:
+        if not self.norms:
+            return None
+        return np.array([self.norms.get(nutrient) or np.nan for nutrient in NUTRIENTS], dtype=np.float64)
+
+    def rolling_average(self, window: int = 7) -> np.ndarray:
+        """
+        Скользящее среднее за window календарных дней по дням с записями
+
+        Для первых дней отчёта окно захватывает history дней перед ним.
+        """
+        logged = ~np.isnan(self._values[:, 0])
+        sums = np.cumsum(np.where(logged[:, None], self._values, 0.0), axis=0)
+        counts = np.cumsum(logged)
+        sums[window:] -= sums[:-window].copy()
+        counts[window:] -= counts[:-window].copy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            average = np.where(counts[:, None] > 0, sums / counts[:, None], np.nan)
+        return average[self.history:]
+
+    def _summary(self, values: np.ndarray, norm: Optional[np.ndarray]) -> Dict:
+        """Итоги, средние и соблюдение нормы для дней values (строки могут быть NaN)"""
+        logged = values[~np.isnan(values[:, 0])]
+        summary = {
+            "days_logged": len(logged),
+            "total": _nutrients(logged.sum(axis=0)),
+            "average": _nutrients(logged.mean(axis=0) if len(logged) else np.full(len(NUTRIENTS), np.nan)),
+            "adherence": None,
+            "on_target_days": None
+        }
+        if norm is not None and len(logged):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                summary["adherence"] = _nutrients(logged.mean(axis=0) / norm * 100)
+                deviation = np.abs(logged[:, 0] / norm[0] - 1)
+            summary["on_target_days"] = int(np.count_nonzero(deviation <= TARGET_TOLERANCE))
+        return summary
+
+    def rollup(self, period: str = "day", window: int = 7) -> List[Dict]:
+        """Итоги по дням, неделям или месяцам (периоды обрезаются диапазоном отчёта)"""
+        if period not in PERIODS:
+            raise ValueError(f"Неизвестный период: {period}")
+        norm = self._norm_vector()
+        dates = [self.start + timedelta(days=offset) for offset in range(self.days)]
+
+        if period == "day":
+            rolling = self.rolling_average(window)
+            return [
+                {
+                    "start": day.isoformat(),
+                    "end": day.isoformat(),
+                    "entries": int(self.entries[offset]),
+                    **self._summary(self.values[offset:offset + 1], norm),
+                    "rolling_average": _nutrients(rolling[offset])
+                }
+                for offset, day in enumerate(dates)
+            ]
+
+        buckets = []
+        first = 0
+        for offset in range(1, self.days + 1):
+            if offset < self.days and period_start(dates[offset], period) == period_start(dates[first], period):
+                continue
+            buckets.append({
+                "start": dates[first].isoformat(),
+                "end": dates[offset - 1].isoformat(),
+                "entries": int(self.entries[first:offset].sum()),
+                **self._summary(self.values[first:offset], norm)
+            })
+            first = offset
+        return buckets
+
+    def as_dict(self, period: str = "day", window: int = 7) -> Dict:
+        return {
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "period": period,
+            "window": window,
+            "norms": self.norms,
+            "summary": self._summary(self.values, self._norm_vector()),
+            "periods": self.rollup(period, window)
+        }
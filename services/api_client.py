@@ -1,11 +1,256 @@
-import requests
-from typing import Optional, Dict
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import lru_cache
+from typing import Optional, Dict, Callable, Iterable, List, Awaitable, Tuple, TYPE_CHECKING
+
+from services.storage import create_storage
+from services.executor import run_blocking
+from services.metrics import timed
+
+if TYPE_CHECKING:
+    import requests
+
+# requests и httpx импортируются при первом обращении к сети, а не при
+# импорте модуля: большинство запросов к приложению их не используют
+
+
+@lru_cache(maxsize=None)
+def _httpx():
+    """Модуль httpx или None: без него async-запросы идут через поток"""
+    try:
+        import httpx
+    except ImportError:
+        return None
+    return httpx
+
+
+@lru_cache(maxsize=None)
+def network_errors() -> Tuple[type, ...]:
+    """Ошибки сети и HTTP, а также ответы не в JSON: такие ответы не кэшируются"""
+    import requests
+    httpx = _httpx()
+    # ValueError — тело ответа не разбирается как JSON (например, страница
+    # ошибки прокси с кодом 200)
+    return (requests.exceptions.RequestException, ValueError) + ((httpx.HTTPError,) if httpx is not None else ())
+
+# Поля продукта приложения -> поля питательности OpenFoodFacts (на 100 г)
+NUTRIMENT_FIELDS = {
+    "calories": "energy-kcal_100g",
+    "proteins": "proteins_100g",
+    "fats": "fat_100g",
+    "carbs": "carbohydrates_100g"
+}
+UNKNOWN_PRODUCT_NAME = "Неизвестный продукт"
+
+
+class RateLimiter:
+    """Ограничитель частоты запросов (token bucket), общий для всех потоков"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Блокирует поток, пока не освободится место для запроса"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Токен резервируется сразу: при нехватке счётчик уходит в минус,
+            # и следующие потоки ждут дольше
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class BarcodeCache:
+    """
+    Read-through кэш поиска по штрих-коду: LRU в памяти поверх таблицы barcode_cache
+
+    Найденные продукты живут ttl секунд, ненайденные штрих-коды — negative_ttl.
+    Устаревший, но не старше stale_ttl продукт отдаётся сразу, а обновляется
+    в фоне (stale-while-revalidate).
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 7 * 24 * 3600,
+                 negative_ttl: float = 3600, stale_ttl: float = 30 * 24 * 3600,
+                 storage_url: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.storage_url = storage_url  # None — хранилище из DATABASE_URL
+        self._entries = OrderedDict()  # barcode -> (product или None, fetched_at)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="barcode-revalidate")
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def get(self, barcode: str, fetch: Callable[[str], Optional[Dict]]) -> Optional[Dict]:
+        """
+        Возвращает продукт из кэша или загружает его через fetch
+
+        fetch возвращает продукт или None, если штрих-код не найден, и бросает
+        requests.RequestException при сетевой ошибке (такой ответ не кэшируется).
+        """
+        entry = self._get_entry(barcode)
+        found, product = self._cached(barcode, entry, fetch)
+        if found:
+            return product
+
+        try:
+            product = fetch(barcode)
+        except network_errors():
+            # Источник недоступен: лучше устаревшие данные, чем никаких
+            return entry[0] if entry is not None else None
+        self._store(barcode, product)
+        return product
+
+    async def aget(self, barcode: str, afetch: Callable[[str], Awaitable[Optional[Dict]]],
+                   fetch: Callable[[str], Optional[Dict]]) -> Optional[Dict]:
+        """
+        Асинхронный вариант get: afetch загружает продукт без блокировки потока
+
+        Чтение и запись таблицы barcode_cache идут в пуле потоков БД, фоновое
+        обновление устаревших записей — синхронным fetch, как и в get.
+        """
+        entry = await run_blocking(self._get_entry, barcode)
+        found, product = self._cached(barcode, entry, fetch)
+        if found:
+            return product
+
+        try:
+            product = await afetch(barcode)
+        except network_errors():
+            return entry[0] if entry is not None else None
+        await run_blocking(self._store, barcode, product)
+        return product
+
+    def _cached(self, barcode: str, entry, fetch: Callable[[str], Optional[Dict]]):
+        """Возвращает (True, продукт), если запись можно отдать без загрузки"""
+        if entry is not None:
+            product, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < (self.ttl if product is not None else self.negative_ttl):
+                self.hits += 1
+                return True, product
+            if product is not None and age < self.stale_ttl:
+                self.stale_hits += 1
+                self._revalidate(barcode, fetch)
+                return True, product
+
+        self.misses += 1
+        return False, None
+
+    def _get_entry(self, barcode: str):
+        with self._lock:
+            entry = self._entries.get(barcode)
+            if entry is not None:
+                self._entries.move_to_end(barcode)
+                return entry
+
+        db = create_storage(self.storage_url)
+        try:
+            row = db.get_barcode_cache_entry(barcode)
+        finally:
+            db.close()
+        if row is None:
+            return None
+        entry = (json.loads(row[0]) if row[0] is not None else None, row[1])
+        self._remember(barcode, entry)
+        return entry
+
+    def _remember(self, barcode: str, entry):
+        with self._lock:
+            self._entries[barcode] = entry
+            self._entries.move_to_end(barcode)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _store(self, barcode: str, product: Optional[Dict]):
+        entry = (product, time.time())
+        self._remember(barcode, entry)
+        db = create_storage(self.storage_url)
+        try:
+            db.save_barcode_cache_entry(barcode, json.dumps(product) if product is not None else None, entry[1])
+        finally:
+            db.close()
+
+    def _revalidate(self, barcode: str, fetch: Callable[[str], Optional[Dict]]):
+        """Обновляет запись в фоне, не более одного обновления на штрих-код"""
+        with self._lock:
+            if barcode in self._refreshing:
+                return
+            self._refreshing.add(barcode)
+
+        def refresh():
+            try:
+                self._store(barcode, fetch(barcode))
+            except Exception as e:
+                print(f"Ошибка фонового обновления продукта {barcode}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(barcode)
+
+        self._executor.submit(refresh)
+
+    def clear(self):
+        """Очищает кэш в памяти (таблица barcode_cache не затрагивается)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits,
+            'size': len(self._entries)
+        }
 
 
 class OpenFoodFactsAPI:
     BASE_URL = "https://world.openfoodfacts.org/api/v2"
+    TIMEOUT = (3.05, 5)  # Таймауты соединения и чтения, секунды
+    cache = BarcodeCache()
+    # Сначала штрих-код ищется в локальном каталоге (в том числе в зеркале,
+    # загруженном командой import-products), и только потом в API
+    local_lookup = True
+
+    _session = None
+    _session_lock = threading.Lock()
+
+    # Запросы, выполняющиеся прямо сейчас: повторный запрос того же
+    # штрих-кода ждёт первый вместо второго обращения к API (single-flight)
+    _in_flight: Dict[str, Future] = {}
+    _in_flight_lock = threading.Lock()
+
+    @classmethod
+    def _get_session(cls) -> "requests.Session":
+        """Общая сессия с пулом keep-alive соединений"""
+        with cls._session_lock:
+            if cls._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=1)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._session = session
+            return cls._session
 
     @classmethod
+    @timed("api.get_product_by_barcode")
     def get_product_by_barcode(cls, barcode: str) -> Optional[Dict]:
         """
         Получает информацию о продукте по штрих-коду
@@ -16,30 +261,192 @@ class OpenFoodFactsAPI:
         Returns:
             Словарь с информацией о продукте или None, если продукт не найден
         """
-        url = f"{cls.BASE_URL}/product/{barcode}"
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
+            return cls._resolve(barcode)
+        except network_errors():
+            return None
+
+    @classmethod
+    @timed("api.aget_product_by_barcode")
+    async def aget_product_by_barcode(cls, barcode: str) -> Optional[Dict]:
+        """Асинхронный вариант get_product_by_barcode: ожидание API не занимает поток"""
+        try:
+            return await cls._aresolve(barcode)
+        except network_errors():
+            return None
+
+    @classmethod
+    def get_products_by_barcodes(cls, barcodes: Iterable[str], max_workers: int = 8,
+                                 rate_limit: Optional[float] = None) -> Dict[str, Optional[Dict]]:
+        """
+        Получает продукты по списку штрих-кодов параллельно
+
+        Args:
+            barcodes: Штрих-коды (повторы запрашиваются один раз)
+            max_workers: Число одновременных запросов
+            rate_limit: Максимум запросов к API в секунду (None — без ограничения)
+
+        Returns:
+            Словарь штрих-код -> продукт или None, если продукт не найден
+        """
+        unique = cls._unique_barcodes(barcodes)
+        limiter = RateLimiter(rate_limit) if rate_limit else None
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="barcode-batch") as executor:
+            products = executor.map(lambda barcode: cls._resolve_quietly(barcode, limiter), unique)
+            return dict(zip(unique, products))
+
+    @classmethod
+    async def aget_products_by_barcodes(cls, barcodes: Iterable[str], concurrency: int = 8,
+                                        rate_limit: Optional[float] = None) -> Dict[str, Optional[Dict]]:
+        """Асинхронный вариант get_products_by_barcodes"""
+        unique = cls._unique_barcodes(barcodes)
+        limiter = RateLimiter(rate_limit) if rate_limit else None
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def resolve(barcode: str) -> Optional[Dict]:
+            async with semaphore:
+                return await asyncio.to_thread(cls._resolve_quietly, barcode, limiter)
+
+        products = await asyncio.gather(*(resolve(barcode) for barcode in unique))
+        return dict(zip(unique, products))
+
+    @staticmethod
+    def _unique_barcodes(barcodes: Iterable[str]) -> List[str]:
+        return list(dict.fromkeys(barcode.strip() for barcode in barcodes if barcode and barcode.strip()))
+
+    @classmethod
+    def _resolve_quietly(cls, barcode: str, limiter: Optional[RateLimiter] = None) -> Optional[Dict]:
+        try:
+            return cls._resolve(barcode, limiter)
+        except Exception as e:
+            print(f"Ошибка получения продукта {barcode}: {e}")
+            return None
+
+    @classmethod
+    def _resolve(cls, barcode: str, limiter: Optional[RateLimiter] = None) -> Optional[Dict]:
+        """Получает продукт через кэш, объединяя одновременные запросы одного штрих-кода"""
+        product = cls._local_product(barcode)
+        if product is not None:
+            return product
+
+        with cls._in_flight_lock:
+            future = cls._in_flight.get(barcode)
+            owner = future is None
+            if owner:
+                future = cls._in_flight[barcode] = Future()
+        if not owner:
+            return future.result()
+
+        def fetch(code: str) -> Optional[Dict]:
+            if limiter is not None:
+                limiter.acquire()
+            return cls._fetch_product(code)
+
+        try:
+            product = cls.cache.get(barcode, fetch)
+            future.set_result(product)
+            return product
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with cls._in_flight_lock:
+                del cls._in_flight[barcode]
+
+    @classmethod
+    async def _aresolve(cls, barcode: str) -> Optional[Dict]:
+        """Асинхронный _resolve; одновременные запросы из потоков и корутин объединяются"""
+        product = await run_blocking(cls._local_product, barcode)
+        if product is not None:
+            return product
+
+        with cls._in_flight_lock:
+            future = cls._in_flight.get(barcode)
+            owner = future is None
+            if owner:
+                future = cls._in_flight[barcode] = Future()
+        if not owner:
+            return await asyncio.wrap_future(future)
+
+        try:
+            product = await cls.cache.aget(barcode, cls._afetch_product, cls._fetch_product)
+            future.set_result(product)
+            return product
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with cls._in_flight_lock:
+                del cls._in_flight[barcode]
 
-            if data.get("status") == 1:  # Продукт найден
-                product = data.get("product", {})
-                return {
-                    "name": product.get("product_name", "Неизвестный продукт"),
-                    "barcode": barcode,
-                    "calories": product.get("nutriments", {}).get("energy-kcal_100g"),
-                    "proteins": product.get("nutriments", {}).get("proteins_100g"),
-                    "fats": product.get("nutriments", {}).get("fat_100g"),
-                    "carbs": product.get("nutriments", {}).get("carbohydrates_100g"),
-                    "weight": 100  # По умолчанию данные на 100г продукта
-                }
+    @classmethod
+    @timed("api.fetch_product")
+    async def _afetch_product(cls, barcode: str) -> Optional[Dict]:
+        """Асинхронный _fetch_product"""
+        if _httpx() is None:
+            return await asyncio.to_thread(cls._fetch_product, barcode)
+        # Клиент httpx привязан к циклу событий, а Flask выполняет каждое
+        # async-представление в своём цикле, поэтому клиент живёт один запрос
+        # и закрывается сразу, не оставляя открытых соединений
+        httpx = _httpx()
+        url = f"{cls.BASE_URL}/product/{barcode}"
+        async with httpx.AsyncClient(timeout=httpx.Timeout(cls.TIMEOUT[1], connect=cls.TIMEOUT[0])) as client:
+            response = await client.get(url)
+        if response.status_code == 404:  # Неизвестный штрих-код
+            return None
+        response.raise_for_status()
+        return cls._parse_product(barcode, response.json())
+
+    @classmethod
+    @timed("api.fetch_product")
+    def _fetch_product(cls, barcode: str) -> Optional[Dict]:
+        """Запрашивает продукт у OpenFoodFacts без кэша; сетевые ошибки пробрасываются"""
+        url = f"{cls.BASE_URL}/product/{barcode}"
+        response = cls._get_session().get(url, timeout=cls.TIMEOUT)
+        if response.status_code == 404:  # Неизвестный штрих-код
             return None
-        except requests.exceptions.RequestException:
+        response.raise_for_status()
+        return cls._parse_product(barcode, response.json())
+
+    @staticmethod
+    def _parse_product(barcode: str, data: Dict) -> Optional[Dict]:
+        """Преобразует ответ API в словарь продукта"""
+        if data.get("status") == 1:  # Продукт найден
+            product = data.get("product", {})
+            nutriments = product.get("nutriments", {})
+            return {
+                "name": product.get("product_name", UNKNOWN_PRODUCT_NAME),
+                "barcode": barcode,
+                **{field: nutriments.get(key) for field, key in NUTRIMENT_FIELDS.items()},
+                "weight": 100  # По умолчанию данные на 100г продукта
+            }
+        return None
+
+    @classmethod
+    def _local_product(cls, barcode: str) -> Optional[Dict]:
+        """Продукт из локального каталога в том же виде, что и ответ API, или None"""
+        if not cls.local_lookup:
+            return None
+        db = create_storage(cls.cache.storage_url)
+        try:
+            row = db.get_product_by_barcode(barcode)
+        finally:
+            db.close()
+        if row is None:
             return None
+        return {
+            "name": row.name,
+            "barcode": row.barcode,
+            "calories": row.calories,
+            "proteins": row.proteins,
+            "fats": row.fats,
+            "carbs": row.carbs,
+            "weight": 100
+        }
 
 
 # Пример использования
 if __name__ == "__main__":
     api = OpenFoodFactsAPI()
     product = api.get_product_by_barcode("4680019560922")  # Пример штрих-кода Nutella
-    print(product)
\ No newline at end of file
+    print(product)
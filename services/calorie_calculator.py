@@ -1,7 +1,61 @@
-from typing import Dict
+from functools import lru_cache
+from typing import Dict, Mapping, Optional, Tuple, TYPE_CHECKING
+
+# numpy нужен только векторным *_batch: он импортируется при первом их вызове,
+# чтобы расчёт норм одного пользователя не тянул его при старте приложения
+if TYPE_CHECKING:
+    import numpy as np
+
+
+# Доли калорий по макронутриентам по умолчанию и калорийность грамма
+DEFAULT_MACRO_RATIOS = {"proteins": 0.3, "fats": 0.3, "carbs": 0.4}
+KCAL_PER_GRAM = {"proteins": 4, "fats": 9, "carbs": 4}
+
+# Поля настроек пользователя в порядке аргументов calculate_daily_calories
+SETTINGS_FIELDS = ("weight", "height", "age", "gender", "activity_level")
+
+
+def check_macro_ratios(ratios: Mapping[str, float]) -> Dict[str, float]:
+    """Проверяет доли БЖУ: все три нутриента, неотрицательные, в сумме 1"""
+    if set(ratios) != set(KCAL_PER_GRAM):
+        raise ValueError(f"Нужны доли для {', '.join(KCAL_PER_GRAM)}")
+    if any(ratio < 0 for ratio in ratios.values()) or abs(sum(ratios.values()) - 1) > 1e-9:
+        raise ValueError("Доли БЖУ должны быть неотрицательными и в сумме давать 1")
+    return {nutrient: ratios[nutrient] for nutrient in KCAL_PER_GRAM}
+
+
+def parse_macro_ratios(value: str) -> Dict[str, float]:
+    """Разбирает доли БЖУ в процентах вида '30/30/40' (белки/жиры/углеводы)"""
+    try:
+        percents = [float(part) for part in value.split("/")]
+    except ValueError:
+        raise ValueError(f"Некорректные доли БЖУ: {value!r}")
+    if len(percents) != len(KCAL_PER_GRAM):
+        raise ValueError(f"Некорректные доли БЖУ: {value!r}")
+    return check_macro_ratios({nutrient: percent / 100 for nutrient, percent in zip(KCAL_PER_GRAM, percents)})
+
+
+def _round1(values: "np.ndarray") -> "np.ndarray":
+    """
+    Округление до 0.1, совпадающее со встроенным round(x, 1)
+
+    np.round умножает на 10 и может ошибиться у значений вблизи середины
+    (0.15 -> 0.2, тогда как round даёт 0.1); такие значения округляются round.
+    """
+    import numpy as np
+
+    rounded = np.round(values, 1)
+    scaled = values * 10
+    near_half = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for index in near_half:
+        rounded.flat[index] = round(float(values.flat[index]), 1)
+    return rounded
 
 
 class CalorieCalculator:
+    # Доли калорий БЖУ; меняются set_macro_ratios
+    MACRO_RATIOS = dict(DEFAULT_MACRO_RATIOS)
+
     @staticmethod
     def calculate_daily_calories(weight: float, height: float, age: int, gender: str, activity_level: float) -> float:
         """
@@ -24,27 +78,93 @@ class CalorieCalculator:
 
         return bmr * activity_level
 
-    @staticmethod
-    def get_macronutrients(calories: float) -> Dict[str, float]:
+    @classmethod
+    def get_macronutrients(cls, calories: float, ratios: Optional[Mapping[str, float]] = None) -> Dict[str, float]:
         """
         Рассчитывает рекомендуемое количество белков, жиров и углеводов
 
         Args:
             calories: Дневная норма калорий
+            ratios: Доли калорий БЖУ (по умолчанию MACRO_RATIOS, 30/30/40)
 
         Returns:
             Словарь с нормами БЖУ в граммах
         """
-        proteins_g = (calories * 0.3) / 4  # 30% от калорий, 4 ккал/г
-        fats_g = (calories * 0.3) / 9  # 30% от калорий, 9 ккал/г
-        carbs_g = (calories * 0.4) / 4  # 40% от калорий, 4 ккал/г
+        ratios = cls.MACRO_RATIOS if ratios is None else check_macro_ratios(ratios)
+        return {
+            nutrient: round((calories * ratios[nutrient]) / KCAL_PER_GRAM[nutrient], 1)
+            for nutrient in KCAL_PER_GRAM
+        }
+
+    @classmethod
+    def set_macro_ratios(cls, ratios: Mapping[str, float]):
+        """Задаёт доли калорий БЖУ для всех последующих расчётов"""
+        cls.MACRO_RATIOS = check_macro_ratios(ratios)
+
+    @classmethod
+    def daily_norms(cls, weight: float, height: float, age: int, gender: str, activity_level: float) -> Dict[str, float]:
+        """
+        Нормы калорий и БЖУ ('calories', 'proteins', 'fats', 'carbs')
 
+        Результат кэшируется по набору настроек и долям БЖУ; возвращается
+        копия, которую можно менять.
+        """
+        return dict(_daily_norms((weight, height, age, gender, activity_level),
+                                 tuple(cls.MACRO_RATIOS.items())))
+
+    @staticmethod
+    def calculate_daily_calories_batch(weight, height, age, gender, activity_level) -> "np.ndarray":
+        """
+        Векторный calculate_daily_calories: аргументы — массивы одной длины
+
+        Пол — массив строк ('male'/'female', регистр не важен). Значения
+        совпадают со скалярной функцией для каждого элемента.
+        """
+        import numpy as np
+
+        weight = np.asarray(weight, dtype=np.float64)
+        height = np.asarray(height, dtype=np.float64)
+        age = np.asarray(age, dtype=np.float64)
+        activity_level = np.asarray(activity_level, dtype=np.float64)
+        male = np.char.lower(np.asarray(gender, dtype=str)) == "male"
+
+        bmr = 10 * weight + 6.25 * height - 5 * age + np.where(male, 5.0, -161.0)
+        return bmr * activity_level
+
+    @classmethod
+    def get_macronutrients_batch(cls, calories, ratios: Optional[Mapping[str, float]] = None) -> Dict[str, "np.ndarray"]:
+        """Векторный get_macronutrients: массивы граммов БЖУ по массиву калорий"""
+        import numpy as np
+
+        ratios = cls.MACRO_RATIOS if ratios is None else check_macro_ratios(ratios)
+        calories = np.asarray(calories, dtype=np.float64)
         return {
-            "proteins": round(proteins_g, 1),
-            "fats": round(fats_g, 1),
-            "carbs": round(carbs_g, 1)
+            nutrient: _round1((calories * ratios[nutrient]) / KCAL_PER_GRAM[nutrient])
+            for nutrient in KCAL_PER_GRAM
         }
 
+    @classmethod
+    def daily_norms_batch(cls, settings: Mapping, ratios: Optional[Mapping[str, float]] = None) -> Dict[str, "np.ndarray"]:
+        """
+        Нормы для множества пользователей за один проход
+
+        Args:
+            settings: Столбцы настроек по именам SETTINGS_FIELDS — словарь
+                массивов, структурированный массив NumPy или DataFrame
+            ratios: Доли калорий БЖУ (по умолчанию MACRO_RATIOS)
+
+        Returns:
+            Словарь массивов 'calories', 'proteins', 'fats', 'carbs'
+        """
+        calories = cls.calculate_daily_calories_batch(*(settings[field] for field in SETTINGS_FIELDS))
+        return {"calories": calories, **cls.get_macronutrients_batch(calories, ratios)}
+
+
+@lru_cache(maxsize=4096)
+def _daily_norms(settings: Tuple, ratios: Tuple) -> Dict[str, float]:
+    calories = CalorieCalculator.calculate_daily_calories(*settings)
+    return {"calories": calories, **CalorieCalculator.get_macronutrients(calories, dict(ratios))}
+
 
 # Пример использования
 if __name__ == "__main__":
@@ -54,4 +174,4 @@ if __name__ == "__main__":
     )
     print(f"Дневная норма калорий: {calories:.0f} ккал")
     macros = calculator.get_macronutrients(calories)
-    print(f"Белки: {macros['proteins']}г, Жиры: {macros['fats']}г, Углеводы: {macros['carbs']}г")
\ No newline at end of file
+    print(f"Белки: {macros['proteins']}г, Жиры: {macros['fats']}г, Углеводы: {macros['carbs']}г")
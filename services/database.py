@@ -1,68 +1,833 @@
 import sqlite3
+import json
 import os
-from typing import Dict, Optional, List, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, List, Tuple, Iterator
 
+from services.storage import StorageBackend, search_terms, EXPORT_CHUNK_SIZE, EXPORT_MIN_DATE, EXPORT_MAX_DATE
+from services.records import Product, DiaryEntry, DailyTotals, UserSettings, row_factory
+from services.metrics import instrument
 
-class Database:
-    def __init__(self, db_name: str = "nutrition.db"):
-        db_path = os.path.join(os.path.dirname(__file__), db_name)
-        self.conn = sqlite3.connect(db_path)
-        self._create_tables()
 
-    def _create_tables(self):
-        """Создаёт нормализованную структуру таблиц"""
-        cursor = self.conn.cursor()
+# Настройки, применяемые к каждому соединению
+SQLITE_PRAGMAS = {
+    "synchronous": "NORMAL",   # В режиме WAL этого достаточно для сохранности данных
+    "cache_size": -20000,      # ~20 МБ страничного кэша на соединение
+    "mmap_size": 268435456,    # 256 МБ отображаемой в память БД
+    "temp_store": "MEMORY",
+}
+BUSY_TIMEOUT = 5.0  # Секунды ожидания блокировки записи
 
-        # Таблица продуктов
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            barcode TEXT UNIQUE,
-            name TEXT NOT NULL,
-            calories_per_100g REAL,
-            proteins_per_100g REAL,
-            fats_per_100g REAL,
-            carbs_per_100g REAL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
 
-        # Таблица записей потребления
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS consumption (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_id INTEGER NOT NULL,
-            date DATE NOT NULL DEFAULT CURRENT_DATE,
-            grams REAL NOT NULL,
-            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
-        )
+def _create_base_schema(cursor):
+    """Создаёт нормализованную структуру таблиц"""
+    # Таблица пользователей
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        weight REAL NOT NULL,
+        height REAL NOT NULL,
+        age INTEGER NOT NULL,
+        gender TEXT NOT NULL,
+        activity_level REAL NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Таблица продуктов
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        barcode TEXT UNIQUE,
+        name TEXT NOT NULL,
+        calories_per_100g REAL,
+        proteins_per_100g REAL,
+        fats_per_100g REAL,
+        carbs_per_100g REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Таблица записей потребления
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS consumption (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        date DATE NOT NULL DEFAULT CURRENT_DATE,
+        grams REAL NOT NULL,
+        FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+    )
+    """)
+
+    # Удаляем старое представление, если оно существует
+    cursor.execute("DROP VIEW IF EXISTS food_diary")
+
+    # Создаем новое представление
+    cursor.execute("""
+    CREATE VIEW IF NOT EXISTS food_diary AS
+    SELECT 
+        c.id,
+        p.name,
+        p.barcode,
+        c.date,
+        c.grams,
+        ROUND(p.calories_per_100g * c.grams / 100, 1) AS calories,
+        ROUND(p.proteins_per_100g * c.grams / 100, 1) AS proteins,
+        ROUND(p.fats_per_100g * c.grams / 100, 1) AS fats,
+        ROUND(p.carbs_per_100g * c.grams / 100, 1) AS carbs
+    FROM consumption c
+    JOIN products p ON c.product_id = p.id
+    ORDER BY c.date DESC, c.id DESC
+    """)
+
+    # Версия каталога в самой БД: её видят и другие процессы
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS products_version_{event.lower()}
+        AFTER {event} ON products
+        BEGIN
+            UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+        END
         """)
 
-        # Представление для дневника питания
-        cursor.execute("""
-        CREATE VIEW IF NOT EXISTS food_diary AS
-        SELECT 
-            c.id,
-            p.name,
-            p.barcode,
-            c.date,
-            c.grams,
-            ROUND(p.calories_per_100g * c.grams / 100, 1) AS calories,
-            ROUND(p.proteins_per_100g * c.grams / 100, 1) AS proteins,
-            ROUND(p.fats_per_100g * c.grams / 100, 1) AS fats,
-            ROUND(p.carbs_per_100g * c.grams / 100, 1) AS carbs
-        FROM consumption c
-        JOIN products p ON c.product_id = p.id
-        ORDER BY c.date DESC, c.id DESC
+
+NUTRIENT_COLUMNS = ("calories", "proteins", "fats", "carbs")
+
+# Ключ таблицы daily_totals в текущей схеме
+DAILY_TOTALS_KEY = ("user_id", "date")
+
+
+def _portion(product: str, grams: str, nutrient: str) -> str:
+    """SQL-выражение нутриента порции с тем же округлением, что и в food_diary"""
+    return f"COALESCE(ROUND({product}.{nutrient}_per_100g * {grams} / 100, 1), 0)"
+
+
+def rebuild_daily_totals_sql(key: Tuple[str, ...] = DAILY_TOTALS_KEY) -> str:
+    """Пересчёт дневных итогов из исходных записей (используется и для сверки)"""
+    columns = ", ".join(key)
+    return f"""
+    INSERT INTO daily_totals ({columns}, calories, proteins, fats, carbs, entries)
+    SELECT
+        {", ".join("c." + column for column in key)},
+        {", ".join(f"COALESCE(SUM(ROUND(p.{n}_per_100g * c.grams / 100, 1)), 0)" for n in NUTRIENT_COLUMNS)},
+        COUNT(*)
+    FROM consumption c
+    JOIN products p ON c.product_id = p.id
+    GROUP BY {", ".join("c." + column for column in key)}
+    """
+
+
+def _create_totals_table(cursor, key: Tuple[str, ...]):
+    """Создаёт таблицу дневных итогов с ключом key и поддерживающие её триггеры"""
+    key_columns = ",\n        ".join(
+        f"{column} {'DATE' if column == 'date' else 'INTEGER'} NOT NULL" for column in key
+    )
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS daily_totals (
+        {key_columns},
+        calories REAL NOT NULL DEFAULT 0,
+        proteins REAL NOT NULL DEFAULT 0,
+        fats REAL NOT NULL DEFAULT 0,
+        carbs REAL NOT NULL DEFAULT 0,
+        entries INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY ({", ".join(key)})
+    ) WITHOUT ROWID
+    """)
+
+    columns = ", ".join(key)
+
+    # Добавление и удаление записей потребления (sign = +1 / -1)
+    def apply_row(row: str, sign: str) -> str:
+        return f"""
+            INSERT INTO daily_totals ({columns}, calories, proteins, fats, carbs, entries)
+            SELECT {", ".join(f"{row}.{column}" for column in key)},
+                   {", ".join(_portion('p', row + '.grams', n) for n in NUTRIENT_COLUMNS)}, 1
+            FROM products p
+            WHERE p.id = {row}.product_id
+            ON CONFLICT({columns}) DO UPDATE SET
+                calories = calories {sign} excluded.calories,
+                proteins = proteins {sign} excluded.proteins,
+                fats = fats {sign} excluded.fats,
+                carbs = carbs {sign} excluded.carbs,
+                entries = entries {sign} 1;
+        """
+
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS consumption_totals_insert
+    AFTER INSERT ON consumption
+    BEGIN
+        {apply_row('NEW', '+')}
+    END
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS consumption_totals_delete
+    AFTER DELETE ON consumption
+    BEGIN
+        {apply_row('OLD', '-')}
+    END
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS consumption_totals_update
+    AFTER UPDATE OF {columns}, product_id, grams ON consumption
+    BEGIN
+        {apply_row('OLD', '-')}
+        {apply_row('NEW', '+')}
+    END
+    """)
+
+    # Изменение КБЖУ продукта: корректируем все дни, где он был съеден
+    group_by = ", ".join("c." + column for column in key)
+    match = " AND ".join(f"daily_totals.{column} = d.{column}" for column in key)
+    deltas = ", ".join(
+        f"SUM({_portion('NEW', 'c.grams', n)} - {_portion('OLD', 'c.grams', n)}) AS {n}"
+        for n in NUTRIENT_COLUMNS
+    )
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS products_totals_update
+    AFTER UPDATE OF calories_per_100g, proteins_per_100g, fats_per_100g, carbs_per_100g ON products
+    WHEN OLD.calories_per_100g IS NOT NEW.calories_per_100g
+      OR OLD.proteins_per_100g IS NOT NEW.proteins_per_100g
+      OR OLD.fats_per_100g IS NOT NEW.fats_per_100g
+      OR OLD.carbs_per_100g IS NOT NEW.carbs_per_100g
+    BEGIN
+        UPDATE daily_totals SET
+            calories = daily_totals.calories + d.calories,
+            proteins = daily_totals.proteins + d.proteins,
+            fats = daily_totals.fats + d.fats,
+            carbs = daily_totals.carbs + d.carbs
+        FROM (
+            SELECT {group_by}, {deltas}
+            FROM consumption c
+            WHERE c.product_id = NEW.id
+            GROUP BY {group_by}
+        ) AS d
+        WHERE {match};
+    END
+    """)
+
+    # Удаление продукта убирает его записи из food_diary, а значит и из итогов
+    removed = ", ".join(f"SUM({_portion('OLD', 'c.grams', n)}) AS {n}" for n in NUTRIENT_COLUMNS)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS products_totals_delete
+    AFTER DELETE ON products
+    BEGIN
+        UPDATE daily_totals SET
+            calories = daily_totals.calories - d.calories,
+            proteins = daily_totals.proteins - d.proteins,
+            fats = daily_totals.fats - d.fats,
+            carbs = daily_totals.carbs - d.carbs,
+            entries = daily_totals.entries - d.entries
+        FROM (
+            SELECT {group_by}, {removed}, COUNT(*) AS entries
+            FROM consumption c
+            WHERE c.product_id = OLD.id
+            GROUP BY {group_by}
+        ) AS d
+        WHERE {match};
+    END
+    """)
+
+    cursor.execute("DELETE FROM daily_totals")
+    cursor.execute(rebuild_daily_totals_sql(key))
+
+
+def _create_daily_totals(cursor):
+    """Создаёт таблицу дневных итогов, поддерживаемую триггерами"""
+    _create_totals_table(cursor, ("date",))
+
+
+def _add_diary_indexes(cursor):
+    """Добавляет покрывающие индексы и убирает сортировку из food_diary"""
+    # (date, id) задаёт порядок дневника, product_id и grams делают индекс покрывающим
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_consumption_date_id
+    ON consumption (date, id, product_id, grams)
+    """)
+    # Нужен триггерам пересчёта итогов при изменении продукта
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_consumption_product ON consumption (product_id)")
+
+    # Сортировка теперь задаётся в запросах, которым она нужна
+    cursor.execute("DROP VIEW IF EXISTS food_diary")
+    cursor.execute("""
+    CREATE VIEW food_diary AS
+    SELECT
+        c.id,
+        p.name,
+        p.barcode,
+        c.date,
+        c.grams,
+        ROUND(p.calories_per_100g * c.grams / 100, 1) AS calories,
+        ROUND(p.proteins_per_100g * c.grams / 100, 1) AS proteins,
+        ROUND(p.fats_per_100g * c.grams / 100, 1) AS fats,
+        ROUND(p.carbs_per_100g * c.grams / 100, 1) AS carbs
+    FROM consumption c
+    JOIN products p ON c.product_id = p.id
+    """)
+
+
+def _create_barcode_cache(cursor):
+    """Создаёт таблицу кэша ответов OpenFoodFacts (product IS NULL — продукт не найден)"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS barcode_cache (
+        barcode TEXT PRIMARY KEY,
+        product TEXT,
+        fetched_at REAL NOT NULL
+    )
+    """)
+
+
+def _add_user_tenancy(cursor):
+    """Разделяет данные по пользователям: user_id в дневнике и итогах"""
+    # Настройки становятся необязательными: пользователь появляется при первом
+    # визите, а параметры заполняет позже. Прежний единственный пользователь
+    # получает id = 1 вместе со всем существующим дневником.
+    cursor.execute("""
+    CREATE TABLE users_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        weight REAL,
+        height REAL,
+        age INTEGER,
+        gender TEXT,
+        activity_level REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("""
+    INSERT INTO users_new (id, weight, height, age, gender, activity_level, created_at, updated_at)
+    SELECT 1, weight, height, age, gender, activity_level, created_at, updated_at
+    FROM users ORDER BY id DESC LIMIT 1
+    """)
+    cursor.execute("INSERT OR IGNORE INTO users_new (id) VALUES (1)")
+    cursor.execute("DROP TABLE users")
+    cursor.execute("ALTER TABLE users_new RENAME TO users")
+
+    cursor.execute("ALTER TABLE consumption ADD COLUMN user_id INTEGER NOT NULL DEFAULT 1")
+
+    # Индекс дневника теперь начинается с user_id
+    cursor.execute("DROP INDEX IF EXISTS idx_consumption_date_id")
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_consumption_user_date
+    ON consumption (user_id, date, id, product_id, grams)
+    """)
+
+    cursor.execute("DROP VIEW IF EXISTS food_diary")
+    cursor.execute("""
+    CREATE VIEW food_diary AS
+    SELECT
+        c.id,
+        p.name,
+        p.barcode,
+        c.date,
+        c.grams,
+        ROUND(p.calories_per_100g * c.grams / 100, 1) AS calories,
+        ROUND(p.proteins_per_100g * c.grams / 100, 1) AS proteins,
+        ROUND(p.fats_per_100g * c.grams / 100, 1) AS fats,
+        ROUND(p.carbs_per_100g * c.grams / 100, 1) AS carbs,
+        c.user_id
+    FROM consumption c
+    JOIN products p ON c.product_id = p.id
+    """)
+
+    # Итоги пересоздаются с ключом (user_id, date)
+    for trigger in ("consumption_totals_insert", "consumption_totals_delete", "consumption_totals_update",
+                    "products_totals_update", "products_totals_delete"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute("DROP TABLE IF EXISTS daily_totals")
+    _create_totals_table(cursor, ("user_id", "date"))
+
+
+def _create_product_search(cursor):
+    """Полнотекстовый индекс названий продуктов (FTS5) для поиска при наборе"""
+    # Внешнее содержимое: текст хранится только в products, индекс — в
+    # products_fts. Префиксные индексы на 1-3 символа делают запросы
+    # вида "мол*" при наборе такими же быстрыми, как поиск целого слова.
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name,
+        content = 'products',
+        content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '1 2 3'
+    )
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_fts_insert
+    AFTER INSERT ON products
+    BEGIN
+        INSERT INTO products_fts (rowid, name) VALUES (NEW.id, NEW.name);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_fts_delete
+    AFTER DELETE ON products
+    BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+    END
+    """)
+    # Обновление продукта по штрих-коду перезаписывает и название: индекс
+    # трогаем, только если оно действительно изменилось
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS products_fts_update
+    AFTER UPDATE OF name ON products
+    WHEN OLD.name IS NOT NEW.name
+    BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+        INSERT INTO products_fts (rowid, name) VALUES (NEW.id, NEW.name);
+    END
+    """)
+    cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+
+def _create_import_state(cursor):
+    """Создаёт таблицу состояния импорта выгрузок каталога (для докачки и дельт)"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS import_state (
+        source TEXT PRIMARY KEY,
+        file TEXT,
+        file_offset INTEGER NOT NULL DEFAULT 0,
+        watermark INTEGER NOT NULL DEFAULT 0,
+        file_watermark INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    )
+    """)
+
+
+def _add_diary_version(cursor):
+    """Версия дневника пользователя для кэша фрагментов страницы"""
+    cursor.execute("ALTER TABLE users ADD COLUMN diary_version INTEGER NOT NULL DEFAULT 0")
+    for event, row in (("INSERT", "NEW"), ("DELETE", "OLD")):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS consumption_version_{event.lower()}
+        AFTER {event} ON consumption
+        BEGIN
+            UPDATE users SET diary_version = diary_version + 1 WHERE id = {row}.user_id;
+        END
         """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS consumption_version_update
+    AFTER UPDATE ON consumption
+    BEGIN
+        UPDATE users SET diary_version = diary_version + 1 WHERE id IN (OLD.user_id, NEW.user_id);
+    END
+    """)
 
-        self.conn.commit()
+
+def _add_product_source(cursor):
+    """Источник продукта: выгрузки не перезаписывают продукты, добавленные локально"""
+    # NULL — продукт добавлен или исправлен в приложении, иначе имя выгрузки
+    cursor.execute("ALTER TABLE products ADD COLUMN source TEXT")
+
+
+def _add_user_claims(cursor):
+    """Данные до разделения по пользователям достаются первой новой сессии"""
+    # _add_user_tenancy перенесла прежний дневник и настройки пользователю 1,
+    # но сессии всегда создавали новых пользователей, и до этих данных было
+    # не добраться. Пользователь 1 с данными помечается как ничей: create_user
+    # отдаёт его первой сессии, а не создаёт нового
+    cursor.execute("ALTER TABLE users ADD COLUMN claimed INTEGER NOT NULL DEFAULT 1")
+    cursor.execute("""
+    UPDATE users SET claimed = 0
+    WHERE id = 1 AND (weight IS NOT NULL OR EXISTS (SELECT 1 FROM consumption WHERE user_id = 1))
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_unclaimed ON users (id) WHERE claimed = 0")
+
+
+# Миграции схемы по порядку: миграция с индексом i переводит БД на версию i + 1.
+# Текущая версия хранится в PRAGMA user_version.
+MIGRATIONS = [
+    _create_base_schema,
+    _create_daily_totals,
+    _add_diary_indexes,
+    _create_barcode_cache,
+    _add_user_tenancy,
+    _create_product_search,
+    _create_import_state,
+    _add_diary_version,
+    _add_product_source,
+    _add_user_claims,
+]
+
+# Таблицы и представления, удаляемые при полном сбросе БД
+# (catalog_version сохраняется, чтобы версия каталога только росла)
+RESET_OBJECTS = [
+    ("VIEW", "food_diary"),
+    ("TABLE", "import_state"),
+    ("TABLE", "products_fts"),
+    ("TABLE", "daily_totals"),
+    ("TABLE", "consumption"),
+    ("TABLE", "products"),
+    ("TABLE", "users"),
+]
+
+
+# Локальная запись делает продукт выгрузки локальным (source = NULL), только
+# если меняет название или КБЖУ: продукт, записанный в дневник как есть,
+# остаётся обновляемым следующими выгрузками
+LOCAL_SOURCE_SQL = "source = CASE WHEN " + " OR ".join(
+    f"products.{column} IS NOT excluded.{column}"
+    for column in ("name", *(f"{n}_per_100g" for n in NUTRIENT_COLUMNS))
+) + " THEN NULL ELSE products.source END"
+
+# Каталог целиком читается только при загрузке в кэш
+CATALOG_SQL = """
+SELECT id, name, barcode,
+       calories_per_100g, proteins_per_100g,
+       fats_per_100g, carbs_per_100g
+FROM products
+ORDER BY id
+"""
+
+PRODUCT_BY_BARCODE_SQL = """
+SELECT id, name, barcode,
+       calories_per_100g, proteins_per_100g,
+       fats_per_100g, carbs_per_100g
+FROM products
+WHERE barcode = ?
+"""
+
+# Версия каталога — скалярным подзапросом: в соединении со статистикой
+# ANALYZE планировщик выбирает полный просмотр однострочной catalog_version
+DATA_VERSION_SQL = """
+SELECT u.diary_version, (SELECT v.version FROM catalog_version v WHERE v.id = 1)
+FROM users u
+WHERE u.id = ?
+"""
+
+SAVE_IMPORT_STATE_SQL = """
+INSERT INTO import_state (source, file, file_offset, watermark, file_watermark, updated_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(source) DO UPDATE SET
+    file = excluded.file,
+    file_offset = excluded.file_offset,
+    watermark = excluded.watermark,
+    file_watermark = excluded.file_watermark,
+    updated_at = excluded.updated_at
+"""
+
+# Поиск при наборе: берутся первые SEARCH_CANDIDATES совпадений (в порядке
+# id), выше — более короткие названия, в которых запрос занимает большую
+# часть. bm25 здесь не подходит: для весов слов он обходит все документы
+# каждого префикса, а короткий префикс вроде "м" совпадает с сотнями тысяч
+# названий — это десятки миллисекунд на нажатие клавиши.
+SEARCH_CANDIDATES = 500
+SEARCH_PRODUCTS_SQL = """
+SELECT p.id, p.name, p.barcode,
+       p.calories_per_100g, p.proteins_per_100g,
+       p.fats_per_100g, p.carbs_per_100g
+FROM (
+    SELECT rowid FROM products_fts
+    WHERE products_fts MATCH ?
+    LIMIT ?
+) AS f
+JOIN products p ON p.id = f.rowid
+ORDER BY length(p.name), p.id
+LIMIT ?
+"""
+
+# Строки запросов сразу собираются в типы services.records
+PRODUCT_ROW = row_factory(Product)
+DIARY_ROW = row_factory(DiaryEntry)
+TOTALS_ROW = row_factory(DailyTotals)
+SETTINGS_ROW = row_factory(UserSettings)
+
+USER_SETTINGS_SQL = """
+SELECT weight, height, age, gender, activity_level
+FROM users
+WHERE id = ?
+"""
+
+# Запросы горячего пути. Все они должны обходиться индексами:
+# check_query_plans проверяет это по EXPLAIN QUERY PLAN.
+FOOD_DIARY_SQL = """
+SELECT * FROM food_diary
+WHERE user_id = ? AND date >= date('now', ?)
+ORDER BY date DESC, id DESC
+"""
+
+# Страница дневника по ключу (date, id): следующая страница начинается
+# строго после последней строки предыдущей
+FOOD_DIARY_PAGE_SQL = """
+SELECT * FROM food_diary
+WHERE user_id = ? AND date >= date('now', ?)
+  AND (date, id) < (?, ?)
+ORDER BY date DESC, id DESC
+LIMIT ?
+"""
+
+# Выгрузка дневника идёт по индексу (user_id, date, id) без сортировки
+FOOD_DIARY_EXPORT_SQL = """
+SELECT * FROM food_diary
+WHERE user_id = ? AND date BETWEEN ? AND ?
+ORDER BY date, id
+"""
+
+ALL_DIARIES_EXPORT_SQL = """
+SELECT * FROM food_diary
+WHERE date BETWEEN ? AND ?
+ORDER BY user_id, date, id
+"""
+
+DAILY_TOTALS_SQL = """
+SELECT date, calories, proteins, fats, carbs, entries
+FROM daily_totals
+WHERE user_id = ? AND date = ?
+"""
+
+# Итоги за диапазон дат — основа аналитики (services/analytics.py)
+DAILY_TOTALS_RANGE_SQL = """
+SELECT date, calories, proteins, fats, carbs, entries
+FROM daily_totals
+WHERE user_id = ? AND date BETWEEN ? AND ? AND entries > 0
+ORDER BY date
+"""
+
+# Ничей пользователь (см. _add_user_claims); частичный индекс делает поиск
+# бесплатным, хотя пользователей столько же, сколько сессий
+UNCLAIMED_USER_SQL = "SELECT id FROM users WHERE claimed = 0 ORDER BY id LIMIT 1"
+CLAIM_USER_SQL = f"UPDATE users SET claimed = 1 WHERE id = ({UNCLAIMED_USER_SQL}) RETURNING id"
+
+QUERY_PLAN_CHECKS = {
+    "get_food_diary": (FOOD_DIARY_SQL, (1, "-30 days")),
+    "get_food_diary_page": (FOOD_DIARY_PAGE_SQL, (1, "-30 days", "9999-12-31", 0, 50)),
+    "get_today_nutrition": (DAILY_TOTALS_SQL, (1, "2000-01-01")),
+    "export_food_diary": (FOOD_DIARY_EXPORT_SQL, (1, "2000-01-01", "2000-12-31")),
+    "export_food_diary.all": (ALL_DIARIES_EXPORT_SQL, ("2000-01-01", "2000-12-31")),
+    "get_daily_totals": (DAILY_TOTALS_RANGE_SQL, (1, "2000-01-01", "2000-12-31")),
+    "get_user_settings": (USER_SETTINGS_SQL, (1,)),
+    "create_user": (UNCLAIMED_USER_SQL, ()),
+    "clear_food_diary": ("SELECT id FROM consumption WHERE user_id = ?", (1,)),
+    "add_or_update_product": ("SELECT id FROM products WHERE barcode = ?", ("0",)),
+    "get_product_by_barcode": (PRODUCT_BY_BARCODE_SQL, ("0",)),
+    "get_data_version": (DATA_VERSION_SQL, (1,)),
+    "get_barcode_cache_entry": ("SELECT product, fetched_at FROM barcode_cache WHERE barcode = ?", ("0",)),
+    "products_totals_update": ("SELECT date, grams FROM consumption WHERE product_id = ?", (0,)),
+}
+
+
+def check_query_plans(conn: sqlite3.Connection) -> List[str]:
+    """Возвращает описания запросов, план которых содержит полный просмотр или сортировку"""
+    problems = []
+    for name, (sql, params) in QUERY_PLAN_CHECKS.items():
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        for detail in plan:
+            full_scan = detail.startswith("SCAN") and "USING" not in detail
+            if full_scan or "TEMP B-TREE" in detail:
+                problems.append(f"{name}: {detail}")
+    return problems
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Применяет недостающие миграции, возвращает версию схемы"""
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+            continue
+
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Проверяем ещё раз под блокировкой: миграцию мог применить другой процесс
+            if cursor.execute("PRAGMA user_version").fetchone()[0] < version:
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(MIGRATIONS)
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений: у каждого потока своё соединение"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._schema_ready = False
+        self._watcher = None
+
+    def connect(self) -> sqlite3.Connection:
+        """Открывает новое соединение с настроенными PRAGMA"""
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        for name, value in SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def ensure_schema(self):
+        """Один раз на процесс включает WAL и применяет миграции"""
+        with self._lock:
+            if self._schema_ready:
+                return
+            conn = self.connect()
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+                migrate(conn)
+            finally:
+                conn.close()
+            self._schema_ready = True
+
+    def acquire(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока, открывая его при необходимости"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.ensure_schema()
+            conn = self._local.conn = self.connect()
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def data_version(self) -> int:
+        """PRAGMA data_version отдельного соединения-наблюдателя
+
+        Значение сравнимо только в пределах одного соединения и меняется,
+        когда транзакцию фиксирует любое другое соединение с этой БД.
+        """
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = self.connect()
+            return self._watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    def release(self, conn: sqlite3.Connection):
+        """Возвращает соединение в пул, откатывая незавершённую транзакцию"""
+        if conn.in_transaction:
+            conn.rollback()
+
+    def close_all(self):
+        """Закрывает все соединения пула"""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+            self._local = threading.local()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """Возвращает пул соединений для файла БД (один на процесс)"""
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+    return pool
+
+
+def init_database(db_name: str = "nutrition.db") -> ConnectionPool:
+    """Подготавливает БД при старте приложения: WAL, миграции схемы"""
+    pool = get_pool(os.path.join(os.path.dirname(__file__), db_name))
+    pool.ensure_schema()
+    return pool
+
+
+@instrument("db")
+class Database(StorageBackend):
+    """Хранилище в файле SQLite (по умолчанию services/nutrition.db)"""
+
+    def __init__(self, db_name: str = "nutrition.db"):
+        self.db_path = os.path.join(os.path.dirname(__file__), db_name)
+        self.location = self.db_path
+        self.pool = get_pool(self.db_path)
+        self.conn = self.pool.acquire()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Курсор в транзакции записи: фиксация при успехе, откат при ошибке
+
+        Внутри apply_batch фиксирует пакет, а откат операции делает её
+        точка сохранения.
+        """
+        if self._in_batch:
+            yield self.conn.cursor()
+            return
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            yield cursor
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @contextmanager
+    def _batch_transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @contextmanager
+    def _savepoint(self):
+        self.conn.execute("SAVEPOINT write")
+        try:
+            yield
+        except Exception:
+            self.conn.execute("ROLLBACK TO write")
+            raise
+        finally:
+            self.conn.execute("RELEASE write")
 
     def add_or_update_product(self, product_data: Dict) -> int:
         """Добавляет или обновляет продукт, возвращает ID"""
+        # Версии каталога до и после записи в одной транзакции: кэш каталога
+        # обновится на месте, если между ними не было чужих записей
+        with self._transaction() as cursor:
+            cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+            version_before = cursor.fetchone()[0]
+            cursor.execute(f"""
+            INSERT INTO products
+            (barcode, name, calories_per_100g, proteins_per_100g, fats_per_100g, carbs_per_100g)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(barcode) DO UPDATE SET
+                name = excluded.name,
+                calories_per_100g = excluded.calories_per_100g,
+                proteins_per_100g = excluded.proteins_per_100g,
+                fats_per_100g = excluded.fats_per_100g,
+                carbs_per_100g = excluded.carbs_per_100g,
+                {LOCAL_SOURCE_SQL}
+            RETURNING id, name, barcode,
+                      calories_per_100g, proteins_per_100g,
+                      fats_per_100g, carbs_per_100g
+            """, (
+                product_data.get("barcode"),
+                product_data["name"],
+                product_data["calories"],
+                product_data["proteins"],
+                product_data["fats"],
+                product_data["carbs"]
+            ))
+            row = cursor.fetchone()
+            cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+            version_after = cursor.fetchone()[0]
+        self._after_commit(lambda: self._product_written(row, version_before, version_after))
+        self._after_commit(self.bump_catalog_generation)
+        return row[0]
+
+    def add_or_update_products(self, products: List[Dict]) -> int:
+        """Добавляет или обновляет продукты одной транзакцией, возвращает их число"""
         cursor = self.conn.cursor()
-        cursor.execute("""
-        INSERT INTO products 
+        cursor.executemany(f"""
+        INSERT INTO products
         (barcode, name, calories_per_100g, proteins_per_100g, fats_per_100g, carbs_per_100g)
         VALUES (?, ?, ?, ?, ?, ?)
         ON CONFLICT(barcode) DO UPDATE SET
@@ -70,218 +835,362 @@ class Database:
             calories_per_100g = excluded.calories_per_100g,
             proteins_per_100g = excluded.proteins_per_100g,
             fats_per_100g = excluded.fats_per_100g,
-            carbs_per_100g = excluded.carbs_per_100g
-        RETURNING id
-        """, (
-            product_data.get("barcode"),
-            product_data["name"],
-            product_data["calories"],
-            product_data["proteins"],
-            product_data["fats"],
-            product_data["carbs"]
-        ))
-        product_id = cursor.fetchone()[0]
+            carbs_per_100g = excluded.carbs_per_100g,
+            {LOCAL_SOURCE_SQL}
+        """, [
+            (
+                product.get("barcode"),
+                product["name"],
+                product["calories"],
+                product["proteins"],
+                product["fats"],
+                product["carbs"]
+            )
+            for product in products
+        ])
         self.conn.commit()
-        return product_id
+        if products:
+            self.bump_catalog_generation()
+        return len(products)
+
+    def get_product_by_barcode(self, barcode: str) -> Optional[Product]:
+        """Строка каталога (как в iter_catalog_rows) по штрих-коду или None"""
+        cursor = self.conn.cursor()
+        cursor.row_factory = PRODUCT_ROW
+        cursor.execute(PRODUCT_BY_BARCODE_SQL, (barcode,))
+        return cursor.fetchone()
+
+    def iter_catalog_rows(self) -> Iterator[Product]:
+        """Отдаёт строки (id, name, barcode, calories, proteins, fats, carbs) всего каталога"""
+        cursor = self.conn.cursor()
+        cursor.row_factory = PRODUCT_ROW
+        cursor.execute(CATALOG_SQL)
+        yield from cursor
+
+    def catalog_token(self) -> int:
+        """PRAGMA data_version: меняется после каждой записи другим соединением"""
+        return self.pool.data_version()
+
+    def catalog_version(self) -> int:
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+        return cursor.fetchone()[0]
+
+    def search_products(self, query: str, limit: int = 10) -> List[Product]:
+        terms = search_terms(query)
+        if not terms:
+            return []
+        # Слова запроса состоят из букв и цифр, кавычки в них не встречаются
+        match = " ".join(f'"{term}"*' for term in terms)
+        cursor = self.conn.cursor()
+        cursor.row_factory = PRODUCT_ROW
+        cursor.execute(SEARCH_PRODUCTS_SQL, (match, SEARCH_CANDIDATES, limit))
+        return cursor.fetchall()
 
-    def add_consumption(self, product_id: int, grams: float) -> bool:
+    def add_consumption(self, user_id: int, product_id: int, grams: float) -> bool:
         """Добавляет запись о потреблении"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-            INSERT INTO consumption (product_id, grams)
-            VALUES (?, ?)
-            """, (product_id, grams))
-            self.conn.commit()
+            with self._transaction() as cursor:
+                cursor.execute("""
+                INSERT INTO consumption (user_id, product_id, grams)
+                VALUES (?, ?, ?)
+                """, (user_id, product_id, grams))
             return True
         except Exception as e:
             print(f"Ошибка добавления потребления: {e}")
             return False
 
-    def get_food_diary(self, days: int = 30) -> List[Tuple]:
+    def add_consumptions(self, entries: List[Tuple[int, int, Optional[str], float]]) -> int:
+        """Добавляет записи (user_id, product_id, date, grams) одной транзакцией"""
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.executemany("""
+            INSERT INTO consumption (user_id, product_id, date, grams)
+            VALUES (?, ?, COALESCE(?, CURRENT_DATE), ?)
+            """, entries)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return len(entries)
+
+    def import_diary_chunk(self, user_id: int, products: List[Dict],
+                           entries: List[Tuple[str, Optional[str], float]]):
+        """Записывает пачку импорта одной транзакцией"""
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.executemany(f"""
+            INSERT INTO products
+            (barcode, name, calories_per_100g, proteins_per_100g, fats_per_100g, carbs_per_100g)
+            VALUES (:barcode, :name, :calories, :proteins, :fats, :carbs)
+            ON CONFLICT(barcode) DO UPDATE SET
+                name = excluded.name,
+                calories_per_100g = excluded.calories_per_100g,
+                proteins_per_100g = excluded.proteins_per_100g,
+                fats_per_100g = excluded.fats_per_100g,
+                carbs_per_100g = excluded.carbs_per_100g,
+                {LOCAL_SOURCE_SQL}
+            """, products)
+
+            cursor.execute("""
+            SELECT barcode, id FROM products
+            WHERE barcode IN (SELECT value FROM json_each(?))
+            """, (json.dumps([product["barcode"] for product in products]),))
+            product_ids = dict(cursor.fetchall())
+
+            cursor.executemany("""
+            INSERT INTO consumption (user_id, product_id, date, grams)
+            VALUES (?, ?, COALESCE(?, CURRENT_DATE), ?)
+            """, [
+                (user_id, product_ids[barcode], entry_date, grams)
+                for barcode, entry_date, grams in entries
+            ])
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.bump_catalog_generation()
+
+    def get_food_diary(self, user_id: int, days: int = 30) -> List[DiaryEntry]:
         """Возвращает дневник питания"""
         cursor = self.conn.cursor()
-        cursor.execute("""
-        SELECT * FROM food_diary
-        WHERE date >= date('now', ?)
-        """, (f"-{days} days",))
+        cursor.row_factory = DIARY_ROW
+        cursor.execute(FOOD_DIARY_SQL, (user_id, f"-{days} days"))
         return cursor.fetchall()
 
-    def reset_database(self) -> bool:
-        """Полностью очищает базу данных"""
+    def get_food_diary_page(self, user_id: int, days: int = 30, limit: int = 50,
+                            after: Optional[Tuple[str, int]] = None) -> Tuple[List[DiaryEntry], Optional[Tuple[str, int]]]:
+        """Возвращает страницу дневника и курсор (date, id) следующей страницы"""
+        cursor = self.conn.cursor()
+        cursor.row_factory = DIARY_ROW
+        if after is None:
+            cursor.execute(FOOD_DIARY_SQL + " LIMIT ?", (user_id, f"-{days} days", limit))
+        else:
+            cursor.execute(FOOD_DIARY_PAGE_SQL, (user_id, f"-{days} days", after[0], after[1], limit))
+        rows = cursor.fetchall()
+
+        # Курсор указывает на последнюю строку, только если страница заполнена целиком
+        next_cursor = (rows[-1].date, rows[-1].id) if len(rows) == limit else None
+        return rows, next_cursor
+
+    def export_food_diary(self, user_id: Optional[int], start: Optional[str] = None, end: Optional[str] = None,
+                          chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[DiaryEntry]]:
+        dates = (start or EXPORT_MIN_DATE, end or EXPORT_MAX_DATE)
+        cursor = self.conn.cursor()
+        cursor.row_factory = DIARY_ROW
+        if user_id is None:
+            cursor.execute(ALL_DIARIES_EXPORT_SQL, dates)
+        else:
+            cursor.execute(FOOD_DIARY_EXPORT_SQL, (user_id, *dates))
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("DROP TABLE IF EXISTS consumption")
-            cursor.execute("DROP TABLE IF EXISTS products")
-            cursor.execute("DROP VIEW IF EXISTS food_diary")
-            self.conn.commit()
-            self._create_tables()  # Воссоздаём структуру
-            return True
-        except Exception as e:
-            print(f"Ошибка сброса БД: {e}")
-            return False
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            cursor.close()
 
-    def get_today_nutrition(self, date: str) -> dict:
+    def get_today_nutrition(self, user_id: int, date: str) -> DailyTotals:
         """Возвращает сумму КБЖУ за указанную дату"""
         cursor = self.conn.cursor()
-        cursor.execute("""
-        SELECT 
-            COALESCE(SUM(calories), 0) as total_calories,
-            COALESCE(SUM(proteins), 0) as total_proteins,
-            COALESCE(SUM(fats), 0) as total_fats,
-            COALESCE(SUM(carbs), 0) as total_carbs
-        FROM food_diary
-        WHERE date = ?
-        """, (date,))
-
-        result = cursor.fetchone()
-        return {
-            "total_calories": result[0],
-            "total_proteins": result[1],
-            "total_fats": result[2],
-            "total_carbs": result[3]
-        }
-
-    def _create_tables(self):
-        """Создаёт нормализованную структуру таблиц"""
+        cursor.row_factory = TOTALS_ROW
+        cursor.execute(DAILY_TOTALS_SQL, (user_id, date))
+        return cursor.fetchone() or DailyTotals(date, 0, 0, 0, 0, 0)
+
+    def get_data_version(self, user_id: int) -> Optional[Tuple[int, int]]:
         cursor = self.conn.cursor()
+        cursor.execute(DATA_VERSION_SQL, (user_id,))
+        return cursor.fetchone()
 
-        # Таблица пользователей
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            weight REAL NOT NULL,
-            height REAL NOT NULL,
-            age INTEGER NOT NULL,
-            gender TEXT NOT NULL,
-            activity_level REAL NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
+    def get_daily_totals(self, user_id: int, start: str, end: str) -> List[DailyTotals]:
+        cursor = self.conn.cursor()
+        cursor.row_factory = TOTALS_ROW
+        cursor.execute(DAILY_TOTALS_RANGE_SQL, (user_id, start, end))
+        return cursor.fetchall()
 
-        # Таблица продуктов
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            barcode TEXT UNIQUE,
-            name TEXT NOT NULL,
-            calories_per_100g REAL,
-            proteins_per_100g REAL,
-            fats_per_100g REAL,
-            carbs_per_100g REAL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
+    def rebuild_daily_totals(self) -> int:
+        """Пересчитывает дневные итоги по исходным записям, возвращает число строк"""
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("DELETE FROM daily_totals")
+            cursor.execute(rebuild_daily_totals_sql())
+            days = cursor.rowcount
+            self.conn.commit()
+            return days
+        except Exception:
+            self.conn.rollback()
+            raise
 
-        # Таблица записей потребления
+    def get_import_state(self, source: str) -> Optional[Tuple[Optional[str], int, int, int]]:
+        """Состояние импорта источника: (file, offset, watermark, file_watermark) или None"""
+        cursor = self.conn.cursor()
         cursor.execute("""
-        CREATE TABLE IF NOT EXISTS consumption (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_id INTEGER NOT NULL,
-            date DATE NOT NULL DEFAULT CURRENT_DATE,
-            grams REAL NOT NULL,
-            FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
-        )
-        """)
+        SELECT file, file_offset, watermark, file_watermark FROM import_state WHERE source = ?
+        """, (source,))
+        return cursor.fetchone()
 
-        # Удаляем старое представление, если оно существует
-        cursor.execute("DROP VIEW IF EXISTS food_diary")
+    def save_import_state(self, source: str, state: Tuple[Optional[str], int, int, int]):
+        """Сохраняет состояние импорта источника"""
+        self.conn.execute(SAVE_IMPORT_STATE_SQL, (source, *state, time.time()))
+        self.conn.commit()
 
-        # Создаем новое представление
-        cursor.execute("""
-        CREATE VIEW IF NOT EXISTS food_diary AS
-        SELECT 
-            c.id,
-            p.name,
-            p.barcode,
-            c.date,
-            c.grams,
-            ROUND(p.calories_per_100g * c.grams / 100, 1) AS calories,
-            ROUND(p.proteins_per_100g * c.grams / 100, 1) AS proteins,
-            ROUND(p.fats_per_100g * c.grams / 100, 1) AS fats,
-            ROUND(p.carbs_per_100g * c.grams / 100, 1) AS carbs
-        FROM consumption c
-        JOIN products p ON c.product_id = p.id
-        ORDER BY c.date DESC, c.id DESC
-        """)
+    def import_products_chunk(self, products: List[Dict], source: str,
+                              state: Tuple[Optional[str], int, int, int]):
+        """Записывает пачку продуктов и состояние импорта одной транзакцией"""
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Продукты, добавленные или исправленные локально, выгрузка не трогает
+            cursor.executemany("""
+            INSERT INTO products
+            (barcode, name, calories_per_100g, proteins_per_100g, fats_per_100g, carbs_per_100g, source)
+            VALUES (:barcode, :name, :calories, :proteins, :fats, :carbs, :source)
+            ON CONFLICT(barcode) DO UPDATE SET
+                name = excluded.name,
+                calories_per_100g = excluded.calories_per_100g,
+                proteins_per_100g = excluded.proteins_per_100g,
+                fats_per_100g = excluded.fats_per_100g,
+                carbs_per_100g = excluded.carbs_per_100g
+            WHERE products.source = excluded.source
+            """, [{**product, "source": source} for product in products])
+            cursor.execute(SAVE_IMPORT_STATE_SQL, (source, *state, time.time()))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        if products:
+            self.bump_catalog_generation()
 
+    def get_barcode_cache_entry(self, barcode: str) -> Optional[Tuple[Optional[str], float]]:
+        """Возвращает закэшированный ответ по штрих-коду: (JSON продукта или None, время загрузки)"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT product, fetched_at FROM barcode_cache WHERE barcode = ?", (barcode,))
+        return cursor.fetchone()
+
+    def save_barcode_cache_entry(self, barcode: str, product: Optional[str], fetched_at: float):
+        """Сохраняет ответ по штрих-коду в кэш"""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+        INSERT INTO barcode_cache (barcode, product, fetched_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(barcode) DO UPDATE SET
+            product = excluded.product,
+            fetched_at = excluded.fetched_at
+        """, (barcode, product, fetched_at))
         self.conn.commit()
 
-    def save_user_settings(self, user_data: Dict) -> bool:
+    def create_user(self) -> int:
+        """Создаёт нового пользователя без настроек, возвращает его ID"""
+        with self._transaction() as cursor:
+            # Сначала — ничей пользователь с данными прежней схемы (_add_user_claims)
+            cursor.execute(CLAIM_USER_SQL)
+            row = cursor.fetchone()
+            if row is not None:
+                return row[0]
+            cursor.execute("INSERT INTO users DEFAULT VALUES")
+            return cursor.lastrowid
+
+    def user_exists(self, user_id: int) -> bool:
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM users WHERE id = ?", (user_id,))
+        return cursor.fetchone() is not None
+
+    def save_user_settings(self, user_id: int, user_data: Dict) -> bool:
         """Сохраняет настройки пользователя в базу данных"""
         try:
-            cursor = self.conn.cursor()
-            # Удаляем старые записи (если они есть) и сохраняем новые
-            cursor.execute("DELETE FROM users")
-            cursor.execute("""
-            INSERT INTO users 
-            (weight, height, age, gender, activity_level)
-            VALUES (?, ?, ?, ?, ?)
-            """, (
-                user_data['weight'],
-                user_data['height'],
-                user_data['age'],
-                user_data['gender'],
-                user_data['activity_level']
-            ))
-            self.conn.commit()
-            return True
+            with self._transaction() as cursor:
+                cursor.execute("""
+                UPDATE users SET
+                    weight = ?,
+                    height = ?,
+                    age = ?,
+                    gender = ?,
+                    activity_level = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """, (
+                    user_data['weight'],
+                    user_data['height'],
+                    user_data['age'],
+                    user_data['gender'],
+                    user_data['activity_level'],
+                    user_id
+                ))
+            return cursor.rowcount == 1
         except Exception as e:
             print(f"Ошибка сохранения настроек пользователя: {e}")
             return False
 
-    def get_user_settings(self) -> Optional[Dict]:
-        """Получает последние сохранённые настройки пользователя"""
+    def get_user_settings(self, user_id: int) -> Optional[UserSettings]:
+        """Получает сохранённые настройки пользователя"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute("SELECT * FROM users ORDER BY id DESC LIMIT 1")
+            cursor.row_factory = SETTINGS_ROW
+            cursor.execute(USER_SETTINGS_SQL, (user_id,))
             result = cursor.fetchone()
-            if result:
-                return {
-                    'weight': result[1],
-                    'height': result[2],
-                    'age': result[3],
-                    'gender': result[4],
-                    'activity_level': result[5]
-                }
+            if result and result.weight is not None:
+                return result
             return None
         except Exception as e:
             print(f"Ошибка получения настроек пользователя: {e}")
             return None
 
+    def clear_food_diary(self, user_id: int) -> bool:
+        """Удаляет все записи дневника пользователя"""
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("DELETE FROM consumption WHERE user_id = ?", (user_id,))
+            return True
+        except Exception as e:
+            print(f"Ошибка очистки дневника: {e}")
+            return False
+
     def reset_database(self) -> bool:
         """Полностью очищает базу данных"""
         try:
             cursor = self.conn.cursor()
             # Удаляем все таблицы и представления
-            cursor.execute("DROP TABLE IF EXISTS consumption")
-            cursor.execute("DROP TABLE IF EXISTS products")
-            cursor.execute("DROP TABLE IF EXISTS users")
-            cursor.execute("DROP VIEW IF EXISTS food_diary")
+            for object_type, name in RESET_OBJECTS:
+                cursor.execute(f"DROP {object_type} IF EXISTS {name}")
+            cursor.execute("PRAGMA user_version = 0")
             self.conn.commit()
 
             # Воссоздаём структуру
-            self._create_tables()
+            migrate(self.conn)
+            cursor.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+            self.conn.commit()
+            self.bump_catalog_generation()
             return True
         except Exception as e:
             print(f"Ошибка сброса БД: {e}")
             return False
 
-    def clear_user_settings(self) -> bool:
-        """Очищает все пользовательские данные"""
+    def clear_user_settings(self, user_id: int) -> bool:
+        """Очищает параметры пользователя (дневник сохраняется)"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("DELETE FROM users")
-            self.conn.commit()
+            with self._transaction() as cursor:
+                cursor.execute("""
+                UPDATE users SET
+                    weight = NULL,
+                    height = NULL,
+                    age = NULL,
+                    gender = NULL,
+                    activity_level = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                """, (user_id,))
             return True
         except Exception as e:
             print(f"Ошибка очистки пользовательских данных: {e}")
             return False
 
-
-
+    def check_query_plans(self) -> List[str]:
+        return check_query_plans(self.conn)
 
     def close(self):
-        """Закрывает соединение с БД"""
-        self.conn.close()
\ No newline at end of file
+        """Возвращает соединение в пул"""
+        self.pool.release(self.conn)
@@ -0,0 +1,69 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from services.storage import StorageBackend, create_storage
+
+
+# Потоков для блокирующей работы с БД из асинхронного кода. Пул ограничен,
+# чтобы всплеск запросов не открыл больше соединений, чем выдержит БД.
+DB_WORKERS = int(os.environ.get("DB_WORKERS", 8))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+T = TypeVar("T")
+
+
+async def run_blocking(func: Callable[..., T], *args) -> T:
+    """
+    Выполняет блокирующую функцию в пуле потоков БД, не занимая цикл событий
+
+    Функция видит контекстные переменные вызывающего (трассировку запроса).
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(db_executor, context.run, func, *args)
+
+
+async def run_db(func: Callable[..., T], *args) -> T:
+    """
+    Выполняет func(storage, *args) в пуле потоков БД
+
+    Хранилище открывается в потоке пула и закрывается после вызова: объект
+    хранилища запроса (flask.g) привязан к своему потоку и сюда не передаётся.
+    """
+    def call() -> T:
+        db: StorageBackend = create_storage()
+        try:
+            return func(db, *args)
+        finally:
+            db.close()
+
+    return await run_blocking(call)
+
+
+def warm_db_pool(timeout: float = 30) -> int:
+    """
+    Открывает соединение с БД в каждом потоке пула заранее
+
+    Потоки пула создаются по мере надобности, а соединение SQLite у каждого
+    потока своё, поэтому без прогрева их открывают первые запросы. Задачи
+    ждут друг друга на барьере: так каждая занимает отдельный поток, а в
+    PostgreSQL одновременно открывается DB_WORKERS соединений общего пула.
+    Возвращает число прогретых потоков.
+    """
+    barrier = threading.Barrier(DB_WORKERS)
+
+    def open_connection():
+        db: StorageBackend = create_storage()
+        try:
+            barrier.wait(timeout)
+        finally:
+            db.close()
+
+    futures = [db_executor.submit(open_connection) for _ in range(DB_WORKERS)]
+    for future in futures:
+        future.result()
+    return len(futures)
@@ -0,0 +1,185 @@
+import csv
+import io
+import json
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+from services.records import DiaryEntry
+from services.storage import StorageBackend, EXPORT_CHUNK_SIZE
+
+
+# Столбцы выгрузки: запись дневника без user_id; КБЖУ — на массу порции
+EXPORT_COLUMNS = DiaryEntry._fields[:9]
+
+
+class ExportStats:
+    """Счётчики выгрузки"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.records = 0
+        self.bytes = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.records / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            "records": self.records,
+            "bytes": self.bytes,
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_sec": round(self.rows_per_sec, 1)
+        }
+
+
+class _StreamSink(io.RawIOBase):
+    """
+    Файл для ParquetWriter, который копит записанные байты до drain()
+
+    tell() считает все записанные байты: по нему писатель вычисляет
+    смещения групп строк в подвале файла.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def parquet_supported() -> bool:
+    """Установлен ли pyarrow (нужен только для выгрузки в Parquet)"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class DiaryExporter:
+    """
+    Потоковая выгрузка дневника в CSV, JSON Lines или Parquet
+
+    Записи читаются из хранилища пачками по chunk_size строк одним курсором
+    и сразу превращаются в байты выходного формата, поэтому память не
+    зависит от длины истории. В Parquet каждая пачка — отдельная группа
+    строк. user_id None — дневники всех пользователей (столбец user_id
+    тогда добавляется в выгрузку).
+    """
+
+    FORMATS = ("csv", "jsonl", "parquet")
+    MIMETYPES = {
+        "csv": "text/csv; charset=utf-8",
+        "jsonl": "application/x-ndjson",
+        "parquet": "application/vnd.apache.parquet"
+    }
+
+    def __init__(self, db: StorageBackend, user_id: Optional[int], start: Optional[str] = None,
+                 end: Optional[str] = None, chunk_size: int = EXPORT_CHUNK_SIZE,
+                 progress: Optional[Callable[[ExportStats], None]] = None):
+        self.db = db
+        self.user_id = user_id
+        self.start = start
+        self.end = end
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.columns = DiaryEntry._fields if user_id is None else EXPORT_COLUMNS
+        self.stats = ExportStats()
+
+    def _chunks(self) -> Iterator[List[DiaryEntry]]:
+        for rows in self.db.export_food_diary(self.user_id, self.start, self.end, self.chunk_size):
+            self.stats.records += len(rows)
+            yield rows
+
+    def stream(self, fmt: str) -> Iterator[bytes]:
+        """Лениво отдаёт выгрузку в формате fmt кусками байт"""
+        if fmt == "csv":
+            chunks = self._csv()
+        elif fmt == "jsonl":
+            chunks = self._jsonl()
+        elif fmt == "parquet":
+            chunks = self._parquet()
+        else:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+        self.stats = ExportStats()
+        for data in chunks:
+            if data:
+                self.stats.bytes += len(data)
+                yield data
+                if self.progress is not None:
+                    self.progress(self.stats)
+
+    def export_file(self, path: str, fmt: str) -> ExportStats:
+        with open(path, "wb") as output:
+            for data in self.stream(fmt):
+                output.write(data)
+        return self.stats
+
+    def _csv(self) -> Iterator[bytes]:
+        width = len(self.columns)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.columns)
+        for rows in self._chunks():
+            writer.writerows(row[:width] for row in rows)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode("utf-8")
+
+    def _jsonl(self) -> Iterator[bytes]:
+        columns = self.columns
+        for rows in self._chunks():
+            yield "".join(
+                json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows
+            ).encode("utf-8")
+
+    def _parquet(self) -> Iterator[bytes]:
+        # pyarrow нужен только для Parquet
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        fields = [
+            pa.field("id", pa.int64()), pa.field("name", pa.string()), pa.field("barcode", pa.string()),
+            pa.field("date", pa.date32()), pa.field("grams", pa.float64()),
+            pa.field("calories", pa.float64()), pa.field("proteins", pa.float64()),
+            pa.field("fats", pa.float64()), pa.field("carbs", pa.float64()),
+            pa.field("user_id", pa.int64())
+        ][:len(self.columns)]
+        schema = pa.schema(fields)
+        sink = _StreamSink()
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        try:
+            for rows in self._chunks():
+                # Пачка транспонируется в столбцы; дата приходит строкой 'YYYY-MM-DD'
+                columns = list(zip(*rows))
+                arrays = [
+                    pa.array(values, pa.string()).cast(pa.date32()) if field.name == "date"
+                    else pa.array(values, field.type)
+                    for field, values in zip(fields, columns)
+                ]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
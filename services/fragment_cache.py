@@ -0,0 +1,67 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+
+class FragmentCache:
+    """
+    LRU-кэш отрендеренных фрагментов страниц (HTML частичных шаблонов)
+
+    Ключ фрагмента включает версии всех данных, из которых он построен,
+    поэтому записи не инвалидируются: устаревшие просто перестают
+    запрашиваться и вытесняются. Размер ограничен и числом записей, и
+    суммарной длиной HTML.
+    """
+
+    def __init__(self, max_entries: int = 4096, max_chars: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries = OrderedDict()  # key -> html
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key: Hashable, html: str):
+        if self.max_entries <= 0 or len(html) > self.max_chars:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._chars -= len(previous)
+            self._entries[key] = html
+            self._chars += len(html)
+            while len(self._entries) > self.max_entries or self._chars > self.max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._chars = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'chars': self._chars
+        }
+
+
+# Общий кэш процесса; FRAGMENT_CACHE_SIZE=0 отключает кэширование
+fragment_cache = FragmentCache(max_entries=int(os.environ.get("FRAGMENT_CACHE_SIZE", 4096)))
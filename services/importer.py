@@ -0,0 +1,372 @@
+import csv
+import gzip
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Optional, Callable, TextIO, List, Tuple, BinaryIO
+
+from services.api_client import NUTRIMENT_FIELDS, UNKNOWN_PRODUCT_NAME
+from services.storage import StorageBackend
+
+
+class ImportStats:
+    """Счётчики импорта"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.records = 0
+        self.products = 0
+        self.skipped = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.records / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            "records": self.records,
+            "products": self.products,
+            "skipped": self.skipped,
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_sec": round(self.rows_per_sec, 1)
+        }
+
+
+class DiaryImporter:
+    """
+    Потоковый импорт дневника из CSV или JSON Lines
+
+    Каждая запись — один приём пищи пользователя user_id: barcode, name,
+    calories, proteins, fats, carbs (на 100 г), grams и необязательная date
+    (YYYY-MM-DD). Записи читаются построчно и пишутся пачками по chunk_size
+    строк: одна транзакция на пачку, поэтому размер файла не ограничен объёмом
+    памяти. Дневные итоги обновляются триггерами в той же транзакции.
+    """
+
+    FORMATS = ("csv", "jsonl")
+
+    def __init__(self, db: StorageBackend, user_id: int, chunk_size: int = 5000,
+                 progress: Optional[Callable[[ImportStats], None]] = None):
+        self.db = db
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+    @staticmethod
+    def read_records(stream: TextIO, fmt: str) -> Iterator[Optional[Dict]]:
+        """Лениво читает записи из текстового потока (None — строка не разобрана)"""
+        if fmt == "csv":
+            yield from csv.DictReader(stream)
+        elif fmt == "jsonl":
+            for line in stream:
+                line = line.strip()
+                if line:
+                    # Неразборчивая строка пропускается, как и некорректная запись:
+                    # пачки до неё уже записаны, импорт продолжается
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        yield None
+        else:
+            raise ValueError(f"Неизвестный формат импорта: {fmt}")
+
+    def import_stream(self, stream: TextIO, fmt: str, stats: Optional[ImportStats] = None) -> ImportStats:
+        return self.import_records(self.read_records(stream, fmt), stats)
+
+    def import_records(self, records: Iterable[Optional[Dict]], stats: Optional[ImportStats] = None) -> ImportStats:
+        """
+        Импортирует записи пачками
+
+        stats — счётчики, которые нужно пополнять (по умолчанию новые): если
+        импорт прервётся ошибкой, по ним видно, сколько записей уже записано.
+        """
+        stats = stats if stats is not None else ImportStats()
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                break
+            self._import_chunk(chunk, stats)
+            if self.progress is not None:
+                self.progress(stats)
+        return stats
+
+    @staticmethod
+    def _parse_record(record: Optional[Dict]) -> Optional[tuple]:
+        """Возвращает (продукт, дата, граммы) или None для некорректной записи"""
+        # Строка JSON может быть и не объектом: 5, [], "текст"
+        if not isinstance(record, dict):
+            return None
+        try:
+            barcode = str(record.get("barcode") or "").strip()
+            if not barcode or not record.get("name"):
+                return None
+            product = {
+                "barcode": barcode,
+                "name": record["name"],
+                "calories": float(record["calories"]),
+                "proteins": float(record["proteins"]),
+                "fats": float(record["fats"]),
+                "carbs": float(record["carbs"])
+            }
+            entry_date = record.get("date")
+            if entry_date:
+                entry_date = date.fromisoformat(str(entry_date)[:10]).isoformat()
+            return product, entry_date or None, float(record.get("grams", 100))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _import_chunk(self, chunk: List[Dict], stats: ImportStats):
+        parsed = []
+        for record in chunk:
+            row = self._parse_record(record)
+            if row is None:
+                stats.skipped += 1
+            else:
+                parsed.append(row)
+        if not parsed:
+            return
+
+        # Последнее значение КБЖУ продукта в пачке побеждает
+        products = {product["barcode"]: product for product, _, _ in parsed}
+
+        self.db.import_diary_chunk(self.user_id, list(products.values()), [
+            (product["barcode"], entry_date, grams) for product, entry_date, grams in parsed
+        ])
+        stats.records += len(parsed)
+        stats.products += len(products)
+
+
+# Выгрузки OpenFoodFacts (https://world.openfoodfacts.org/data): JSON Lines
+# (openfoodfacts-products.jsonl.gz, а также ежедневные дельты) и CSV с
+# табуляцией (en.openfoodfacts.org.products.csv.gz). Одна строка — один продукт.
+OFF_SOURCE = "openfoodfacts"
+OFF_CSV_COLUMNS = ("code", "product_name", "last_modified_t") + tuple(NUTRIMENT_FIELDS.values())
+
+
+class DumpImportStats(ImportStats):
+    """Счётчики импорта выгрузки: records — прочитанные строки файла"""
+
+    def __init__(self):
+        super().__init__()
+        self.unchanged = 0  # Не изменились с прошлого импорта
+        self.offset = 0
+
+    def as_dict(self) -> Dict:
+        return {**super().as_dict(), "unchanged": self.unchanged, "offset": self.offset}
+
+
+def _number(value) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _timestamp(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_dump_record(record, fmt: str, columns: Optional[Dict[str, int]]) -> Tuple:
+    """(штрих-код, название, питательность, время изменения) из строки выгрузки"""
+    if fmt == "csv":
+        def field(name):
+            index = columns.get(name)
+            return record[index] if index is not None and index < len(record) else None
+
+        nutriments = {key: field(key) for key in NUTRIMENT_FIELDS.values()}
+        return field("code"), field("product_name"), nutriments, field("last_modified_t")
+
+    product = json.loads(record)
+    return (product.get("code"), product.get("product_name"),
+            product.get("nutriments") or {}, product.get("last_modified_t"))
+
+
+def parse_dump_chunk(fmt: str, data: bytes, watermark: int = 0, columns: Optional[Dict[str, int]] = None,
+                     delimiter: str = "\t") -> Tuple[List[Dict], int, int, int]:
+    """
+    Разбирает пачку строк выгрузки (выполняется в процессах-обработчиках)
+
+    Args:
+        fmt: 'jsonl' или 'csv'
+        data: Целые строки файла
+        watermark: Продукты, изменённые не позже этого времени, пропускаются
+        columns: Номера столбцов CSV по именам OFF_CSV_COLUMNS
+        delimiter: Разделитель столбцов CSV
+
+    Returns:
+        (продукты, пропущено некорректных, пропущено неизменившихся,
+        наибольшее время изменения в пачке)
+    """
+    products = []
+    skipped = unchanged = latest = 0
+    lines = data.decode("utf-8", errors="replace").splitlines()
+    if fmt == "csv":
+        records = csv.reader(lines, delimiter=delimiter, quoting=csv.QUOTE_NONE)
+    else:
+        records = (line for line in lines if line.strip())
+
+    for record in records:
+        if not record:
+            continue
+        try:
+            barcode, name, nutriments, modified = _read_dump_record(record, fmt, columns)
+            modified = _timestamp(modified)
+            values = {field: _number(nutriments.get(key)) for field, key in NUTRIMENT_FIELDS.items()}
+        except (ValueError, AttributeError):
+            skipped += 1
+            continue
+
+        if modified is not None:
+            latest = max(latest, modified)
+            if modified <= watermark:
+                unchanged += 1
+                continue
+        barcode = str(barcode or "").strip()
+        # Продукты без КБЖУ бесполезны для дневника и рекомендаций
+        if not barcode or all(value is None for value in values.values()):
+            skipped += 1
+            continue
+        products.append({"barcode": barcode, "name": name or UNKNOWN_PRODUCT_NAME, **values})
+    return products, skipped, unchanged, latest
+
+
+class ProductDumpImporter:
+    """
+    Импорт выгрузки OpenFoodFacts в локальный каталог products
+
+    Файл (в том числе .gz) читается потоком пачками по chunk_size строк,
+    пачки разбираются в workers процессах, а записываются в БД по порядку,
+    одна транзакция на пачку. Вместе с пачкой сохраняется позиция в файле:
+    прерванный импорт того же файла продолжается с неё. Время последнего
+    изменения продукта (last_modified_t) запоминается, и следующий импорт
+    (полная выгрузка или дельта) записывает только изменившиеся продукты.
+    Продукты, добавленные или исправленные в приложении, выгрузка не
+    перезаписывает: их штрих-коды пропускаются.
+    """
+
+    FORMATS = ("csv", "jsonl")
+
+    def __init__(self, db: StorageBackend, workers: Optional[int] = None, chunk_size: int = 20000,
+                 source: str = OFF_SOURCE, progress: Optional[Callable[[DumpImportStats], None]] = None):
+        self.db = db
+        # Один процесс остаётся главному: он читает файл и пишет в БД
+        self.workers = workers if workers is not None else max((os.cpu_count() or 1) - 1, 1)
+        self.chunk_size = chunk_size
+        self.source = source
+        self.progress = progress
+
+    @staticmethod
+    def detect_format(path: str) -> str:
+        name = path.lower()
+        if name.endswith(".gz"):
+            name = name[:-3]
+        return "csv" if name.endswith((".csv", ".tsv")) else "jsonl"
+
+    @staticmethod
+    def _open(path: str) -> BinaryIO:
+        return gzip.open(path, "rb") if path.lower().endswith(".gz") else open(path, "rb")
+
+    @staticmethod
+    def file_id(path: str) -> str:
+        """Признак файла для докачки: имя, размер и время изменения"""
+        info = os.stat(path)
+        return f"{os.path.basename(path)}:{info.st_size}:{int(info.st_mtime)}"
+
+    def import_file(self, path: str, fmt: Optional[str] = None, incremental: bool = True,
+                    resume: bool = True) -> DumpImportStats:
+        """
+        Импортирует выгрузку
+
+        Args:
+            path: Путь к файлу JSONL или CSV (можно .gz)
+            fmt: Формат (по умолчанию по расширению)
+            incremental: Пропускать продукты, не изменившиеся с прошлого импорта
+            resume: Продолжить прерванный импорт этого же файла
+        """
+        fmt = fmt or self.detect_format(path)
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+        file_id = self.file_id(path)
+        state_file, offset, watermark, file_watermark = self.db.get_import_state(self.source) or (None, 0, 0, 0)
+        if not (resume and state_file == file_id):
+            offset, file_watermark = 0, watermark
+        skip_before = watermark if incremental else 0
+
+        stats = DumpImportStats()
+        with self._open(path) as stream:
+            columns, delimiter = self._read_header(stream) if fmt == "csv" else (None, "\t")
+            if offset > stream.tell():
+                # У .gz это распаковка до позиции, но без разбора строк
+                stream.seek(offset)
+            stats.offset = stream.tell()
+
+            chunks = self._read_chunks(stream)
+            for offset, (products, skipped, unchanged, latest) in self._parse(
+                    chunks, fmt, skip_before, columns, delimiter):
+                file_watermark = max(file_watermark, latest)
+                self.db.import_products_chunk(products, self.source, (file_id, offset, watermark, file_watermark))
+                stats.records += len(products) + skipped + unchanged
+                stats.products += len(products)
+                stats.skipped += skipped
+                stats.unchanged += unchanged
+                stats.offset = offset
+                if self.progress is not None:
+                    self.progress(stats)
+
+        self.db.save_import_state(self.source, (None, 0, max(watermark, file_watermark), 0))
+        return stats
+
+    @staticmethod
+    def _read_header(stream: BinaryIO) -> Tuple[Dict[str, int], str]:
+        """Номера нужных столбцов CSV и разделитель (в выгрузке OpenFoodFacts — табуляция)"""
+        header = stream.readline().decode("utf-8").rstrip("\r\n")
+        delimiter = "\t" if "\t" in header else ","
+        names = next(csv.reader([header], delimiter=delimiter))
+        if "code" not in names:
+            raise ValueError("В CSV нет столбца code")
+        return {name: names.index(name) for name in OFF_CSV_COLUMNS if name in names}, delimiter
+
+    def _read_chunks(self, stream: BinaryIO) -> Iterator[Tuple[int, bytes]]:
+        """Отдаёт (позиция после пачки, строки пачки)"""
+        while True:
+            lines = list(islice(stream, self.chunk_size))
+            if not lines:
+                return
+            yield stream.tell(), b"".join(lines)
+
+    def _parse(self, chunks: Iterator[Tuple[int, bytes]], fmt: str, watermark: int,
+               columns: Optional[Dict[str, int]], delimiter: str) -> Iterator[Tuple[int, Tuple]]:
+        """Разбирает пачки parse_dump_chunk в процессах, отдавая результаты в порядке файла"""
+        args = (watermark, columns, delimiter)
+        if self.workers <= 1:
+            for offset, data in chunks:
+                yield offset, parse_dump_chunk(fmt, data, *args)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            # Читаем не больше чем на две пачки вперёд на процесс: файл не
+            # должен оказаться в очереди задач целиком
+            pending = deque()
+            for offset, data in chunks:
+                pending.append((offset, executor.submit(parse_dump_chunk, fmt, data, *args)))
+                if len(pending) >= 2 * self.workers:
+                    offset, future = pending.popleft()
+                    yield offset, future.result()
+            while pending:
+                offset, future = pending.popleft()
+                yield offset, future.result()
@@ -0,0 +1,133 @@
+from typing import Dict
+from services.product_catalog import ProductCatalog, NUTRIENTS
+from services.records import DailyTotals, Recommendation
+import numpy as np
+
+
+class MealPlanner:
+    """
+    Подбирает небольшую корзину продуктов и их массу, закрывающую дефицит КБЖУ
+
+    Задача — ограниченный метод наименьших квадратов по матрице каталога:
+    минимизировать || W (A x - d) ||² при 0 <= x <= max_mass / 100, где A — КБЖУ
+    на 100 г, d — остаток дневной нормы (0 для уже перебранных нутриентов),
+    W — нормировка на дневную норму. Корзина строится жадно: на каждом шаге
+    добавляется продукт, сильнее всего уменьшающий невязку. Перед этим каталог
+    сокращается до небольшого числа кандидатов, поэтому время решения почти
+    не зависит от размера каталога.
+    """
+
+    def __init__(self, max_items: int = 4, max_mass: float = 500.0, min_mass: float = 10.0,
+                 n_candidates: int = 48, n_per_nutrient: int = 8, iterations: int = 60):
+        self.max_items = max_items
+        self.max_mass = max_mass
+        self.min_mass = min_mass
+        self.n_candidates = n_candidates
+        self.n_per_nutrient = n_per_nutrient
+        self.iterations = iterations
+
+    def plan(self, catalog: ProductCatalog, daily_norms: Dict, today_stats: DailyTotals) -> Dict:
+        """
+        Возвращает план: продукты с массой, итог плана и остаток нормы после него
+
+        Returns:
+            {'items': [...], 'totals': {...}, 'remaining': {...}}
+        """
+        norms = np.array([daily_norms[n] for n in NUTRIENTS], dtype=np.float64)
+        eaten = np.array([getattr(today_stats, n) for n in NUTRIENTS], dtype=np.float64)
+        deficit = np.maximum(norms - eaten, 0.0)
+        weights = 1.0 / np.maximum(norms, 1.0)
+
+        plan = {'items': [], 'totals': dict.fromkeys(NUTRIENTS, 0.0),
+                'remaining': {n: round(float(v), 1) for n, v in zip(NUTRIENTS, deficit)}}
+        if not len(catalog) or not deficit.any():
+            return plan
+
+        scaled = catalog.values * weights  # (n, 4)
+        target = deficit * weights          # (4,)
+
+        candidates = self._prune(scaled, target)
+        if not len(candidates):
+            return plan
+
+        basket, amounts = self._select(scaled[candidates], target)
+        totals = np.zeros(len(NUTRIENTS))
+        for position, amount in zip(basket, amounts):
+            mass = round(float(amount) * 100)
+            if mass < self.min_mass:
+                continue
+            index = int(candidates[position])
+            totals += catalog.values[index] * mass / 100
+            plan['items'].append(Recommendation(catalog.product(index), float(mass)))
+
+        plan['totals'] = {n: round(float(v), 1) for n, v in zip(NUTRIENTS, totals)}
+        plan['remaining'] = {n: round(float(v), 1) for n, v in zip(NUTRIENTS, norms - eaten - totals)}
+        return plan
+
+    def _prune(self, scaled: np.ndarray, target: np.ndarray) -> np.ndarray:
+        """Оставляет продукты, направление КБЖУ которых ближе всего к дефициту"""
+        lengths = np.linalg.norm(scaled, axis=1)
+        useful = lengths > 0
+        projection = np.where(useful, scaled @ target / np.where(useful, lengths, 1.0), -np.inf)
+
+        picked = [self._top(projection, self.n_candidates)]
+        # Лучшие источники каждого недостающего нутриента отдельно, чтобы
+        # «чистые» продукты (например, почти один белок) не терялись
+        for j in np.flatnonzero(target > 0):
+            purity = np.where(useful, scaled[:, j] / np.where(useful, lengths, 1.0), -np.inf)
+            picked.append(self._top(purity, self.n_per_nutrient))
+
+        candidates = np.unique(np.concatenate(picked))
+        return candidates[projection[candidates] > 0]
+
+    @staticmethod
+    def _top(values: np.ndarray, k: int) -> np.ndarray:
+        if k >= len(values):
+            return np.arange(len(values))
+        return np.argpartition(-values, k - 1)[:k]
+
+    def _select(self, scaled: np.ndarray, target: np.ndarray):
+        """Жадно набирает корзину, решая задачу для всех кандидатов сразу"""
+        basket = []
+        amounts = np.zeros(0)
+        objective = float(target @ target)
+
+        for _ in range(min(self.max_items, len(scaled))):
+            rest = np.setdiff1d(np.arange(len(scaled)), basket)
+            # Для каждого кандидата: столбцы корзины + его собственный, shape (m, 4, k)
+            columns = np.concatenate([
+                np.broadcast_to(scaled[basket].T, (len(rest), scaled.shape[1], len(basket))),
+                scaled[rest][:, :, None]
+            ], axis=2)
+            start = np.concatenate([np.broadcast_to(amounts, (len(rest), len(basket))),
+                                    np.zeros((len(rest), 1))], axis=1)
+            solutions, residuals = self._bounded_lstsq(columns, target, start)
+
+            best = int(np.argmin(residuals))
+            if residuals[best] >= objective * 0.99:  # Новый продукт почти не помогает
+                break
+            basket.append(int(rest[best]))
+            amounts = solutions[best]
+            objective = float(residuals[best])
+
+        return basket, amounts
+
+    def _bounded_lstsq(self, columns: np.ndarray, target: np.ndarray, start: np.ndarray):
+        """
+        Пакетный покоординатный спуск для min ||A x - t||², 0 <= x <= upper
+
+        columns: (m, 4, k) — m независимых задач, start: (m, k) — начальное приближение
+        """
+        upper = self.max_mass / 100
+        x = start.copy()
+        residual = target - np.einsum('mnk,mk->mn', columns, x)
+        squared = np.maximum(np.einsum('mnk,mnk->mk', columns, columns), 1e-12)
+
+        for _ in range(self.iterations):
+            for j in range(columns.shape[2]):
+                column = columns[:, :, j]
+                updated = np.clip(x[:, j] + np.einsum('mn,mn->m', column, residual) / squared[:, j], 0.0, upper)
+                residual -= column * (updated - x[:, j])[:, None]
+                x[:, j] = updated
+
+        return x, np.einsum('mn,mn->m', residual, residual)
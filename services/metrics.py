@@ -0,0 +1,288 @@
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# Границы корзин гистограмм времени, секунды
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Число запросов к БД за один HTTP-запрос
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Гистограмма с одной меткой в формате Prometheus"""
+
+    def __init__(self, name: str, help: str, label: str, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._series: Dict[str, List] = {}  # значение метки -> [счётчики корзин..., сумма]
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(value) for key, value in self._series.items()}
+        for label_value, counts in sorted(series.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            cumulative += counts[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {_format(counts[-1])}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Счётчик с одной меткой в формате Prometheus"""
+
+    def __init__(self, name: str, help: str, label: str):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value: str, amount: float = 1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_value, value in sorted(values.items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(label_value)}"}} {_format(value)}')
+        return lines
+
+
+class RequestTrace:
+    """Промежутки одного HTTP-запроса: суммарное время и число вызовов по имени"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List] = {}  # имя -> [вызовы, секунды]
+        self.rows = 0
+        self._lock = threading.Lock()  # Промежутки приходят и из пула потоков БД
+
+    def add(self, name: str, elapsed: float, rows: Optional[int]):
+        with self._lock:
+            span = self.spans.get(name)
+            if span is None:
+                span = self.spans[name] = [0, 0.0]
+            span[0] += 1
+            span[1] += elapsed
+            if rows:
+                self.rows += rows
+
+    @property
+    def queries(self) -> int:
+        with self._lock:
+            return sum(count for name, (count, _) in self.spans.items() if name.startswith("db."))
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing (длительности в миллисекундах)"""
+        with self._lock:
+            spans = sorted(self.spans.items(), key=lambda item: -item[1][1])
+        parts = [f'{name};dur={seconds * 1000:.2f};desc="{count}x"' for name, (count, seconds) in spans]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+class Metrics:
+    """
+    Метрики процесса: гистограммы промежутков, счётчики и сборщики статистики
+
+    Выключенные метрики (enabled = False) сводят обёртки timed к одной
+    проверке флага, а запросы не трассируются.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.span_seconds = Histogram("nutrition_span_seconds", "Время выполнения промежутков", "span")
+        self.span_rows = Counter("nutrition_rows_fetched_total", "Строк прочитано из хранилища", "span")
+        self.span_errors = Counter("nutrition_span_errors_total", "Промежутки, завершившиеся исключением", "span")
+        self.request_seconds = Histogram("nutrition_request_seconds", "Время обработки HTTP-запросов", "endpoint")
+        self.request_queries = Histogram("nutrition_request_db_queries", "Запросов к хранилищу за HTTP-запрос",
+                                         "endpoint", QUERY_COUNT_BUCKETS)
+        self._collectors: List[Tuple[str, str, Callable[[], Dict]]] = []
+
+    def record(self, name: str, elapsed: float, rows: Optional[int] = None):
+        self.span_seconds.observe(name, elapsed)
+        if rows:
+            self.span_rows.inc(name, rows)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, elapsed, rows)
+
+    def start_request(self) -> Optional[contextvars.Token]:
+        """Начинает трассировку HTTP-запроса в текущем контексте"""
+        if not self.enabled:
+            return None
+        return _current_trace.set(RequestTrace())
+
+    def current_trace(self) -> Optional[RequestTrace]:
+        return _current_trace.get()
+
+    def finish_request(self, endpoint: str, token: Optional[contextvars.Token]):
+        """Записывает итог запроса и завершает трассировку"""
+        if token is None:
+            return
+        trace = _current_trace.get()
+        _current_trace.reset(token)
+        if trace is not None:
+            self.request_seconds.observe(endpoint, time.perf_counter() - trace.started)
+            self.request_queries.observe(endpoint, trace.queries)
+
+    def register_collector(self, name: str, help: str, collect: Callable[[], Dict]):
+        """Добавляет статистику, снимаемую при каждом чтении /metrics (словарь стат -> число)"""
+        self._collectors.append((name, help, collect))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in (self.span_seconds, self.span_rows, self.span_errors,
+                       self.request_seconds, self.request_queries):
+            lines.extend(metric.render())
+        for name, help, collect in self._collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Ошибка сбора метрики {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for stat, value in sorted(values.items()):
+                lines.append(f'{name}{{stat="{_escape(stat)}"}} {_format(value)}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(enabled=os.environ.get("METRICS_ENABLED", "1") != "0")
+
+
+def _count_rows(result) -> Optional[int]:
+    """Число строк в результате: список строк или (строки, курсор) для страниц"""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return None
+
+
+def timed(name: str, rows: bool = False):
+    """
+    Декоратор: время вызова функции попадает в промежуток name
+
+    При rows=True результат (список строк или элементы генератора)
+    учитывается в счётчике прочитанных строк.
+    """
+    count_rows = _count_rows if rows else (lambda result: None)
+
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not metrics.enabled:
+                    return await func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException:
+                    metrics.span_errors.inc(name)
+                    raise
+                finally:
+                    elapsed = time.perf_counter() - started
+                metrics.record(name, elapsed, count_rows(result))
+                return result
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            # Для генераторов время — вся выдача, а строки — число элементов
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                if not metrics.enabled:
+                    yield from func(*args, **kwargs)
+                    return
+                fetched = 0
+                elapsed = 0.0
+                iterator = func(*args, **kwargs)
+                try:
+                    while True:
+                        started = time.perf_counter()
+                        try:
+                            row = next(iterator)
+                        except StopIteration:
+                            break
+                        finally:
+                            elapsed += time.perf_counter() - started
+                        fetched += 1
+                        yield row
+                finally:
+                    iterator.close()
+                    metrics.record(name, elapsed, fetched if rows else None)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                metrics.span_errors.inc(name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+            metrics.record(name, elapsed, count_rows(result))
+            return result
+        return wrapper
+    return decorate
+
+
+def instrument(prefix: str):
+    """
+    Декоратор класса хранилища: timed для всех публичных методов, включая
+    унаследованные, с подсчётом прочитанных строк
+
+    Конструктор попадает в промежуток {prefix}.open.
+    """
+    def decorate(cls):
+        for attr in ["__init__"] + [attr for attr in dir(cls) if not attr.startswith("_")]:
+            value = inspect.getattr_static(cls, attr)
+            if not inspect.isfunction(value):
+                continue  # Свойства, атрибуты, статические и классовые методы
+            span = f"{prefix}.{'open' if attr == '__init__' else attr}"
+            setattr(cls, attr, timed(span, rows=True)(value))
+        return cls
+    return decorate
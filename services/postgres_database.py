@@ -0,0 +1,893 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+from typing import Dict, Optional, List, Tuple, Iterator
+
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from services.storage import StorageBackend, search_terms, EXPORT_CHUNK_SIZE, EXPORT_MIN_DATE, EXPORT_MAX_DATE
+from services.records import Product, DiaryEntry, DailyTotals, UserSettings
+from services.metrics import instrument
+from services.database import NUTRIENT_COLUMNS
+
+
+POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 10))  # Соединений на процесс
+FETCH_SIZE = 2000  # Строк за одно обращение серверного курсора
+MIGRATION_LOCK = 0x4E757472  # Ключ advisory-блокировки на время миграций
+
+
+def _portion(product: str, grams: str, nutrient: str) -> str:
+    """SQL-выражение нутриента порции с тем же округлением, что и в food_diary"""
+    return f"ROUND(({product}.{nutrient}_per_100g * {grams} / 100)::numeric, 1)::float8"
+
+
+def _create_schema(cursor):
+    """Создаёт схему, равную по содержанию текущей схеме SQLite"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        weight DOUBLE PRECISION,
+        height DOUBLE PRECISION,
+        age INTEGER,
+        gender TEXT,
+        activity_level DOUBLE PRECISION,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        barcode TEXT UNIQUE,
+        name TEXT NOT NULL,
+        calories_per_100g DOUBLE PRECISION,
+        proteins_per_100g DOUBLE PRECISION,
+        fats_per_100g DOUBLE PRECISION,
+        carbs_per_100g DOUBLE PRECISION,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS consumption (
+        id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+        date DATE NOT NULL DEFAULT CURRENT_DATE,
+        grams DOUBLE PRECISION NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_consumption_user_date
+    ON consumption (user_id, date, id) INCLUDE (product_id, grams)
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_consumption_product ON consumption (product_id)")
+
+    cursor.execute(f"""
+    CREATE OR REPLACE VIEW food_diary AS
+    SELECT
+        c.id,
+        p.name,
+        p.barcode,
+        c.date,
+        c.grams,
+        {", ".join(f"{_portion('p', 'c.grams', n)} AS {n}" for n in NUTRIENT_COLUMNS)},
+        c.user_id
+    FROM consumption c
+    JOIN products p ON c.product_id = p.id
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS barcode_cache (
+        barcode TEXT PRIMARY KEY,
+        product TEXT,
+        fetched_at DOUBLE PRECISION NOT NULL
+    )
+    """)
+
+    # Версия каталога: один счётчик на оператор, а не на каждую строку
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version BIGINT NOT NULL
+    )
+    """)
+    cursor.execute("INSERT INTO catalog_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING")
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    cursor.execute("""
+    CREATE TRIGGER products_version
+    AFTER INSERT OR UPDATE OR DELETE ON products
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version()
+    """)
+
+    _create_daily_totals(cursor)
+
+
+def _create_daily_totals(cursor):
+    """Дневные итоги (user_id, date), поддерживаемые триггерами, как в SQLite"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS daily_totals (
+        user_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        calories DOUBLE PRECISION NOT NULL DEFAULT 0,
+        proteins DOUBLE PRECISION NOT NULL DEFAULT 0,
+        fats DOUBLE PRECISION NOT NULL DEFAULT 0,
+        carbs DOUBLE PRECISION NOT NULL DEFAULT 0,
+        entries INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, date)
+    )
+    """)
+
+    # Добавление и удаление записи потребления (sign = + / -)
+    def apply_row(row: str, sign: str) -> str:
+        return f"""
+            INSERT INTO daily_totals AS t (user_id, date, calories, proteins, fats, carbs, entries)
+            SELECT {row}.user_id, {row}.date,
+                   {", ".join(f"{sign}COALESCE({_portion('p', row + '.grams', n)}, 0)" for n in NUTRIENT_COLUMNS)},
+                   {sign}1
+            FROM products p
+            WHERE p.id = {row}.product_id
+            ON CONFLICT (user_id, date) DO UPDATE SET
+                calories = t.calories + excluded.calories,
+                proteins = t.proteins + excluded.proteins,
+                fats = t.fats + excluded.fats,
+                carbs = t.carbs + excluded.carbs,
+                entries = t.entries + excluded.entries;
+        """
+
+    cursor.execute(f"""
+    CREATE OR REPLACE FUNCTION consumption_totals() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            {apply_row('OLD', '-')}
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            {apply_row('NEW', '+')}
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    cursor.execute("""
+    CREATE TRIGGER consumption_totals_insert_delete
+    AFTER INSERT OR DELETE ON consumption
+    FOR EACH ROW EXECUTE FUNCTION consumption_totals()
+    """)
+    cursor.execute("""
+    CREATE TRIGGER consumption_totals_update
+    AFTER UPDATE OF user_id, date, product_id, grams ON consumption
+    FOR EACH ROW EXECUTE FUNCTION consumption_totals()
+    """)
+
+    # Изменение КБЖУ продукта корректирует все дни, где он был съеден.
+    # Удаление обрабатывается до каскадного удаления записей потребления:
+    # после него триггер consumption_totals уже не найдёт продукт.
+    changed = ", ".join(
+        f"SUM(COALESCE({_portion('NEW', 'c.grams', n)}, 0) - COALESCE({_portion('OLD', 'c.grams', n)}, 0)) AS {n}"
+        for n in NUTRIENT_COLUMNS
+    ) + ", 0 AS entries"
+    removed = ", ".join(
+        f"-SUM(COALESCE({_portion('OLD', 'c.grams', n)}, 0)) AS {n}" for n in NUTRIENT_COLUMNS
+    ) + ", COUNT(*) AS entries"
+
+    def apply_delta(row: str, delta: str) -> str:
+        return f"""
+            UPDATE daily_totals t SET
+                calories = t.calories + d.calories,
+                proteins = t.proteins + d.proteins,
+                fats = t.fats + d.fats,
+                carbs = t.carbs + d.carbs,
+                entries = t.entries - d.entries
+            FROM (
+                SELECT c.user_id, c.date, {delta}
+                FROM consumption c
+                WHERE c.product_id = {row}.id
+                GROUP BY c.user_id, c.date
+            ) AS d
+            WHERE t.user_id = d.user_id AND t.date = d.date;
+        """
+
+    cursor.execute(f"""
+    CREATE OR REPLACE FUNCTION products_totals() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            {apply_delta('OLD', removed)}
+            RETURN OLD;
+        END IF;
+        {apply_delta('NEW', changed)}
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    cursor.execute("""
+    CREATE TRIGGER products_totals_update
+    AFTER UPDATE OF calories_per_100g, proteins_per_100g, fats_per_100g, carbs_per_100g ON products
+    FOR EACH ROW
+    WHEN (OLD.calories_per_100g IS DISTINCT FROM NEW.calories_per_100g
+       OR OLD.proteins_per_100g IS DISTINCT FROM NEW.proteins_per_100g
+       OR OLD.fats_per_100g IS DISTINCT FROM NEW.fats_per_100g
+       OR OLD.carbs_per_100g IS DISTINCT FROM NEW.carbs_per_100g)
+    EXECUTE FUNCTION products_totals()
+    """)
+    cursor.execute("""
+    CREATE TRIGGER products_totals_delete
+    BEFORE DELETE ON products
+    FOR EACH ROW EXECUTE FUNCTION products_totals()
+    """)
+
+
+def _create_product_search(cursor):
+    """Полнотекстовый индекс названий продуктов для поиска при наборе"""
+    # Индекс по выражению обновляется вместе с таблицей, триггеры не нужны
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_products_name_search
+    ON products USING GIN (to_tsvector('simple', name))
+    """)
+
+
+def _create_import_state(cursor):
+    """Создаёт таблицу состояния импорта выгрузок каталога (для докачки и дельт)"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS import_state (
+        source TEXT PRIMARY KEY,
+        file TEXT,
+        file_offset BIGINT NOT NULL DEFAULT 0,
+        watermark BIGINT NOT NULL DEFAULT 0,
+        file_watermark BIGINT NOT NULL DEFAULT 0,
+        updated_at DOUBLE PRECISION NOT NULL
+    )
+    """)
+
+
+def _add_diary_version(cursor):
+    """Версия дневника пользователя для кэша фрагментов страницы"""
+    cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS diary_version BIGINT NOT NULL DEFAULT 0")
+    # Как и версия каталога — одно увеличение на оператор и пользователя
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION bump_diary_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE users SET diary_version = diary_version + 1
+        WHERE id IN (SELECT user_id FROM changed_rows);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """)
+    for event, table in (("INSERT", "NEW"), ("DELETE", "OLD"), ("UPDATE", "NEW")):
+        cursor.execute(f"""
+        CREATE TRIGGER consumption_version_{event.lower()}
+        AFTER {event} ON consumption
+        REFERENCING {table} TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_diary_version()
+        """)
+
+
+def _add_product_source(cursor):
+    """Источник продукта: выгрузки не перезаписывают продукты, добавленные локально"""
+    # NULL — продукт добавлен или исправлен в приложении, иначе имя выгрузки
+    cursor.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS source TEXT")
+
+
+# Миграции схемы по порядку; версия хранится в таблице schema_version
+MIGRATIONS = [
+    _create_schema,
+    _create_product_search,
+    _create_import_state,
+    _add_diary_version,
+    _add_product_source,
+]
+
+RESET_OBJECTS = [
+    ("VIEW", "food_diary"),
+    ("TABLE", "import_state"),
+    ("TABLE", "daily_totals"),
+    ("TABLE", "consumption"),
+    ("TABLE", "products"),
+    ("TABLE", "users"),
+]
+
+
+REBUILD_DAILY_TOTALS_SQL = f"""
+INSERT INTO daily_totals (user_id, date, calories, proteins, fats, carbs, entries)
+SELECT
+    c.user_id, c.date,
+    {", ".join(f"COALESCE(SUM({_portion('p', 'c.grams', n)}), 0)" for n in NUTRIENT_COLUMNS)},
+    COUNT(*)
+FROM consumption c
+JOIN products p ON c.product_id = p.id
+GROUP BY c.user_id, c.date
+"""
+
+# Локальная запись снимает с продукта выгрузки source, только если меняет
+# его название или КБЖУ (см. LOCAL_SOURCE_SQL в services/database.py)
+LOCAL_SOURCE_SQL = "source = CASE WHEN " + " OR ".join(
+    f"products.{column} IS DISTINCT FROM excluded.{column}"
+    for column in ("name", *(f"{n}_per_100g" for n in NUTRIENT_COLUMNS))
+) + " THEN NULL ELSE products.source END"
+
+CATALOG_SQL = """
+SELECT id, name, barcode,
+       calories_per_100g, proteins_per_100g,
+       fats_per_100g, carbs_per_100g
+FROM products
+ORDER BY id
+"""
+
+PRODUCT_BY_BARCODE_SQL = """
+SELECT id, name, barcode,
+       calories_per_100g, proteins_per_100g,
+       fats_per_100g, carbs_per_100g
+FROM products
+WHERE barcode = %s
+"""
+
+DATA_VERSION_SQL = """
+SELECT u.diary_version, v.version
+FROM users u, catalog_version v
+WHERE u.id = %s AND v.id = 1
+"""
+
+SAVE_IMPORT_STATE_SQL = """
+INSERT INTO import_state (source, file, file_offset, watermark, file_watermark, updated_at)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON CONFLICT (source) DO UPDATE SET
+    file = excluded.file,
+    file_offset = excluded.file_offset,
+    watermark = excluded.watermark,
+    file_watermark = excluded.file_watermark,
+    updated_at = excluded.updated_at
+"""
+
+# Дата отдаётся строкой 'YYYY-MM-DD', как в SQLite: на ней строятся курсоры страниц
+FOOD_DIARY_SQL = """
+SELECT id, name, barcode, to_char(date, 'YYYY-MM-DD'), grams,
+       calories, proteins, fats, carbs, user_id
+FROM food_diary
+WHERE user_id = %s AND date >= CURRENT_DATE - %s
+"""
+
+FOOD_DIARY_ORDER = " ORDER BY date DESC, id DESC"
+
+FOOD_DIARY_PAGE_SQL = FOOD_DIARY_SQL + " AND (date, id) < (%s::date, %s)" + FOOD_DIARY_ORDER + " LIMIT %s"
+
+# Выгрузка дневника: тот же индекс (user_id, date, id), без сортировки
+DIARY_EXPORT_COLUMNS = """
+SELECT id, name, barcode, to_char(date, 'YYYY-MM-DD'), grams,
+       calories, proteins, fats, carbs, user_id
+FROM food_diary
+"""
+FOOD_DIARY_EXPORT_SQL = DIARY_EXPORT_COLUMNS + "WHERE user_id = %s AND date BETWEEN %s AND %s ORDER BY date, id"
+ALL_DIARIES_EXPORT_SQL = DIARY_EXPORT_COLUMNS + "WHERE date BETWEEN %s AND %s ORDER BY user_id, date, id"
+
+DAILY_TOTALS_SQL = """
+SELECT to_char(date, 'YYYY-MM-DD'), calories, proteins, fats, carbs, entries
+FROM daily_totals
+WHERE user_id = %s AND date = %s
+"""
+
+DAILY_TOTALS_RANGE_SQL = """
+SELECT to_char(date, 'YYYY-MM-DD'), calories, proteins, fats, carbs, entries
+FROM daily_totals
+WHERE user_id = %s AND date BETWEEN %s AND %s AND entries > 0
+ORDER BY date
+"""
+
+# Как и в SQLite: первые SEARCH_CANDIDATES совпадений, короткие названия выше
+SEARCH_CANDIDATES = 500
+SEARCH_PRODUCTS_SQL = """
+SELECT id, name, barcode,
+       calories_per_100g, proteins_per_100g,
+       fats_per_100g, carbs_per_100g
+FROM (
+    SELECT * FROM products
+    WHERE to_tsvector('simple', name) @@ to_tsquery('simple', %s)
+    LIMIT %s
+) AS matches
+ORDER BY length(name), id
+LIMIT %s
+"""
+
+QUERY_PLAN_CHECKS = {
+    "get_food_diary": (FOOD_DIARY_SQL + FOOD_DIARY_ORDER, (1, 30)),
+    "get_food_diary_page": (FOOD_DIARY_PAGE_SQL, (1, 30, "9999-12-31", 0, 50)),
+    "get_today_nutrition": (DAILY_TOTALS_SQL, (1, "2000-01-01")),
+    "export_food_diary": (FOOD_DIARY_EXPORT_SQL, (1, "2000-01-01", "2000-12-31")),
+    "get_daily_totals": (DAILY_TOTALS_RANGE_SQL, (1, "2000-01-01", "2000-12-31")),
+    "get_user_settings": ("SELECT * FROM users WHERE id = %s", (1,)),
+    "clear_food_diary": ("SELECT id FROM consumption WHERE user_id = %s", (1,)),
+    "add_or_update_product": ("SELECT id FROM products WHERE barcode = %s", ("0",)),
+    "get_product_by_barcode": (PRODUCT_BY_BARCODE_SQL, ("0",)),
+    "get_data_version": (DATA_VERSION_SQL, (1,)),
+    "get_barcode_cache_entry": ("SELECT product, fetched_at FROM barcode_cache WHERE barcode = %s", ("0",)),
+    "products_totals_update": ("SELECT date, grams FROM consumption WHERE product_id = %s", (0,)),
+}
+
+
+def migrate(conn) -> int:
+    """Применяет недостающие миграции одной транзакцией, возвращает версию схемы"""
+    with conn, conn.cursor() as cursor:
+        # Несколько процессов могут стартовать одновременно
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK,))
+        cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        cursor.execute("SELECT version FROM schema_version")
+        row = cursor.fetchone()
+        current = row[0] if row else 0
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            if current < version:
+                migration(cursor)
+        cursor.execute("DELETE FROM schema_version")
+        cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (len(MIGRATIONS),))
+    return len(MIGRATIONS)
+
+
+class PostgresPool:
+    """
+    Пул соединений с PostgreSQL, общий для потоков процесса
+
+    В отличие от ThreadedConnectionPool, при исчерпании пула поток ждёт
+    свободного соединения, а не получает ошибку.
+    """
+
+    def __init__(self, dsn: str, size: int = POOL_SIZE):
+        self.dsn = dsn
+        self._pool = ThreadedConnectionPool(1, size, dsn)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def ensure_schema(self):
+        """Один раз на процесс применяет миграции"""
+        with self._lock:
+            if self._schema_ready:
+                return
+            conn = self._pool.getconn()
+            try:
+                migrate(conn)
+            finally:
+                self._pool.putconn(conn)
+            self._schema_ready = True
+
+    def acquire(self):
+        self.ensure_schema()
+        self._slots.acquire()
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        """Возвращает соединение в пул, откатывая незавершённую транзакцию"""
+        try:
+            if not conn.closed:
+                conn.rollback()
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        self._pool.closeall()
+
+
+_pools: Dict[str, PostgresPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn: str) -> PostgresPool:
+    """Возвращает пул соединений для DSN (один на процесс)"""
+    with _pools_lock:
+        pool = _pools.get(dsn)
+        if pool is None:
+            pool = _pools[dsn] = PostgresPool(dsn)
+    return pool
+
+
+@instrument("db")
+class PostgresDatabase(StorageBackend):
+    """
+    Хранилище в PostgreSQL
+
+    Соединения берутся из общего пула процесса. Полные просмотры дневника
+    и каталога идут через серверные (именованные) курсоры: строки приходят
+    пачками по FETCH_SIZE, а не целиком в память процесса.
+    """
+
+    def __init__(self, dsn: str):
+        self.location = dsn
+        self.pool = get_pool(dsn)
+        self.conn = self.pool.acquire()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Курсор в транзакции: фиксация при успехе, откат при ошибке
+
+        Внутри apply_batch фиксирует пакет, а откат операции делает её
+        точка сохранения.
+        """
+        if self._in_batch:
+            with self.conn.cursor() as cursor:
+                yield cursor
+            return
+        with self.conn, self.conn.cursor() as cursor:
+            yield cursor
+
+    @contextmanager
+    def _batch_transaction(self):
+        with self.conn:
+            yield
+
+    @contextmanager
+    def _savepoint(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SAVEPOINT write")
+            try:
+                yield
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT write")
+                cursor.execute("RELEASE SAVEPOINT write")
+                raise
+            # Методы, которые сами ловят ошибки (add_consumption и др.),
+            # оставляют транзакцию прерванной — откатываем только операцию
+            if self.conn.get_transaction_status() == TRANSACTION_STATUS_INERROR:
+                cursor.execute("ROLLBACK TO SAVEPOINT write")
+            cursor.execute("RELEASE SAVEPOINT write")
+
+    def _scan(self, name: str, sql: str, params: tuple = ()) -> Iterator[Tuple]:
+        """Читает результат запроса через серверный курсор"""
+        with self.conn, self.conn.cursor(name=name) as cursor:
+            cursor.itersize = FETCH_SIZE
+            cursor.execute(sql, params)
+            yield from cursor
+
+    def add_or_update_product(self, product_data: Dict) -> int:
+        with self._transaction() as cursor:
+            # FOR UPDATE: чужие записи в каталог ждут до конца транзакции,
+            # поэтому версии до и после относятся только к этой записи
+            cursor.execute("SELECT version FROM catalog_version WHERE id = 1 FOR UPDATE")
+            version_before = cursor.fetchone()[0]
+            cursor.execute(f"""
+            INSERT INTO products
+            (barcode, name, calories_per_100g, proteins_per_100g, fats_per_100g, carbs_per_100g)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (barcode) DO UPDATE SET
+                name = excluded.name,
+                calories_per_100g = excluded.calories_per_100g,
+                proteins_per_100g = excluded.proteins_per_100g,
+                fats_per_100g = excluded.fats_per_100g,
+                carbs_per_100g = excluded.carbs_per_100g,
+                {LOCAL_SOURCE_SQL}
+            RETURNING id, name, barcode,
+                      calories_per_100g, proteins_per_100g,
+                      fats_per_100g, carbs_per_100g
+            """, (
+                product_data.get("barcode"),
+                product_data["name"],
+                product_data["calories"],
+                product_data["proteins"],
+                product_data["fats"],
+                product_data["carbs"]
+            ))
+            row = cursor.fetchone()
+            cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+            version_after = cursor.fetchone()[0]
+        self._after_commit(lambda: self._product_written(row, version_before, version_after))
+        self._after_commit(self.bump_catalog_generation)
+        return row[0]
+
+    def add_or_update_products(self, products: List[Dict]) -> int:
+        # Повтор штрих-кода в одном INSERT ... ON CONFLICT — ошибка в PostgreSQL
+        unique = list({product.get("barcode"): product for product in products}.values())
+        with self._transaction() as cursor:
+            self._upsert_products(cursor, unique)
+        if products:
+            self.bump_catalog_generation()
+        return len(products)
+
+    @staticmethod
+    def _upsert_products(cursor, products: List[Dict], returning: bool = False, source: Optional[str] = None):
+        # source None — локальная запись: продукт становится локальным, если
+        # она его меняет. Запись выгрузки не трогает локальные продукты и
+        # продукты других выгрузок
+        return execute_values(cursor, """
+        INSERT INTO products
+        (barcode, name, calories_per_100g, proteins_per_100g, fats_per_100g, carbs_per_100g, source)
+        VALUES %s
+        ON CONFLICT (barcode) DO UPDATE SET
+            name = excluded.name,
+            calories_per_100g = excluded.calories_per_100g,
+            proteins_per_100g = excluded.proteins_per_100g,
+            fats_per_100g = excluded.fats_per_100g,
+            carbs_per_100g = excluded.carbs_per_100g,
+        """ + (LOCAL_SOURCE_SQL if source is None else
+               "source = excluded.source WHERE products.source = excluded.source")
+            + (" RETURNING barcode, id" if returning else ""), [
+            (
+                product.get("barcode"),
+                product["name"],
+                product["calories"],
+                product["proteins"],
+                product["fats"],
+                product["carbs"],
+                source
+            )
+            for product in products
+        ], page_size=1000, fetch=returning)
+
+    def get_product_by_barcode(self, barcode: str) -> Optional[Product]:
+        with self._transaction() as cursor:
+            cursor.execute(PRODUCT_BY_BARCODE_SQL, (barcode,))
+            row = cursor.fetchone()
+        return Product._make(row) if row else None
+
+    def iter_catalog_rows(self) -> Iterator[Product]:
+        return map(Product._make, self._scan("catalog_scan", CATALOG_SQL))
+
+    def catalog_token(self) -> int:
+        # Отдельного дешёвого признака нет: версия каталога — одна строка по ключу
+        return self.catalog_version()
+
+    def catalog_version(self) -> int:
+        with self._transaction() as cursor:
+            cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+            return cursor.fetchone()[0]
+
+    def search_products(self, query: str, limit: int = 10) -> List[Product]:
+        terms = search_terms(query)
+        if not terms:
+            return []
+        with self._transaction() as cursor:
+            cursor.execute(SEARCH_PRODUCTS_SQL, (" & ".join(f"{term}:*" for term in terms), SEARCH_CANDIDATES, limit))
+            return list(map(Product._make, cursor))
+
+    def add_consumption(self, user_id: int, product_id: int, grams: float) -> bool:
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                INSERT INTO consumption (user_id, product_id, grams)
+                VALUES (%s, %s, %s)
+                """, (user_id, product_id, grams))
+            return True
+        except Exception as e:
+            print(f"Ошибка добавления потребления: {e}")
+            return False
+
+    def add_consumptions(self, entries: List[Tuple[int, int, Optional[str], float]]) -> int:
+        with self._transaction() as cursor:
+            self._insert_consumption(cursor, entries)
+        return len(entries)
+
+    @staticmethod
+    def _insert_consumption(cursor, entries: List[Tuple[int, int, Optional[str], float]]):
+        execute_values(cursor, """
+        INSERT INTO consumption (user_id, product_id, date, grams)
+        SELECT v.user_id, v.product_id, COALESCE(v.date::date, CURRENT_DATE), v.grams
+        FROM (VALUES %s) AS v (user_id, product_id, date, grams)
+        """, entries, page_size=1000)
+
+    def import_diary_chunk(self, user_id: int, products: List[Dict],
+                           entries: List[Tuple[str, Optional[str], float]]):
+        with self._transaction() as cursor:
+            product_ids = dict(self._upsert_products(cursor, products, returning=True))
+            self._insert_consumption(cursor, [
+                (user_id, product_ids[barcode], entry_date, grams)
+                for barcode, entry_date, grams in entries
+            ])
+        self.bump_catalog_generation()
+
+    def get_food_diary(self, user_id: int, days: int = 30) -> List[DiaryEntry]:
+        return list(self.iter_food_diary(user_id, days))
+
+    def get_food_diary_page(self, user_id: int, days: int = 30, limit: int = 50,
+                            after: Optional[Tuple[str, int]] = None) -> Tuple[List[DiaryEntry], Optional[Tuple[str, int]]]:
+        with self._transaction() as cursor:
+            if after is None:
+                cursor.execute(FOOD_DIARY_SQL + FOOD_DIARY_ORDER + " LIMIT %s", (user_id, days, limit))
+            else:
+                cursor.execute(FOOD_DIARY_PAGE_SQL, (user_id, days, after[0], after[1], limit))
+            rows = list(map(DiaryEntry._make, cursor))
+
+        next_cursor = (rows[-1].date, rows[-1].id) if len(rows) == limit else None
+        return rows, next_cursor
+
+    def iter_food_diary(self, user_id: int, days: int = 30, page_size: int = FETCH_SIZE) -> Iterator[DiaryEntry]:
+        """Отдаёт весь дневник за период одним серверным курсором"""
+        return map(DiaryEntry._make, self._scan("diary_scan", FOOD_DIARY_SQL + FOOD_DIARY_ORDER, (user_id, days)))
+
+    def export_food_diary(self, user_id: Optional[int], start: Optional[str] = None, end: Optional[str] = None,
+                          chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[DiaryEntry]]:
+        dates = (start or EXPORT_MIN_DATE, end or EXPORT_MAX_DATE)
+        if user_id is None:
+            rows = self._scan("diary_export", ALL_DIARIES_EXPORT_SQL, dates)
+        else:
+            rows = self._scan("diary_export", FOOD_DIARY_EXPORT_SQL, (user_id, *dates))
+        rows = map(DiaryEntry._make, rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def get_today_nutrition(self, user_id: int, date: str) -> DailyTotals:
+        with self._transaction() as cursor:
+            cursor.execute(DAILY_TOTALS_SQL, (user_id, date))
+            row = cursor.fetchone()
+        return DailyTotals._make(row) if row else DailyTotals(date, 0, 0, 0, 0, 0)
+
+    def get_data_version(self, user_id: int) -> Optional[Tuple[int, int]]:
+        with self._transaction() as cursor:
+            cursor.execute(DATA_VERSION_SQL, (user_id,))
+            return cursor.fetchone()
+
+    def get_daily_totals(self, user_id: int, start: str, end: str) -> List[DailyTotals]:
+        with self._transaction() as cursor:
+            cursor.execute(DAILY_TOTALS_RANGE_SQL, (user_id, start, end))
+            return list(map(DailyTotals._make, cursor))
+
+    def rebuild_daily_totals(self) -> int:
+        with self._transaction() as cursor:
+            cursor.execute("LOCK TABLE consumption IN SHARE MODE")
+            cursor.execute("DELETE FROM daily_totals")
+            cursor.execute(REBUILD_DAILY_TOTALS_SQL)
+            return cursor.rowcount
+
+    def clear_food_diary(self, user_id: int) -> bool:
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("DELETE FROM consumption WHERE user_id = %s", (user_id,))
+            return True
+        except Exception as e:
+            print(f"Ошибка очистки дневника: {e}")
+            return False
+
+    def get_import_state(self, source: str) -> Optional[Tuple[Optional[str], int, int, int]]:
+        with self._transaction() as cursor:
+            cursor.execute("""
+            SELECT file, file_offset, watermark, file_watermark FROM import_state WHERE source = %s
+            """, (source,))
+            return cursor.fetchone()
+
+    def save_import_state(self, source: str, state: Tuple[Optional[str], int, int, int]):
+        with self._transaction() as cursor:
+            cursor.execute(SAVE_IMPORT_STATE_SQL, (source, *state, time.time()))
+
+    def import_products_chunk(self, products: List[Dict], source: str,
+                              state: Tuple[Optional[str], int, int, int]):
+        # Повтор штрих-кода в одном INSERT ... ON CONFLICT — ошибка в PostgreSQL
+        unique = list({product["barcode"]: product for product in products}.values())
+        with self._transaction() as cursor:
+            if unique:
+                self._upsert_products(cursor, unique, source=source)
+            cursor.execute(SAVE_IMPORT_STATE_SQL, (source, *state, time.time()))
+        if products:
+            self.bump_catalog_generation()
+
+    def get_barcode_cache_entry(self, barcode: str) -> Optional[Tuple[Optional[str], float]]:
+        with self._transaction() as cursor:
+            cursor.execute("SELECT product, fetched_at FROM barcode_cache WHERE barcode = %s", (barcode,))
+            return cursor.fetchone()
+
+    def save_barcode_cache_entry(self, barcode: str, product: Optional[str], fetched_at: float):
+        with self._transaction() as cursor:
+            cursor.execute("""
+            INSERT INTO barcode_cache (barcode, product, fetched_at)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (barcode) DO UPDATE SET
+                product = excluded.product,
+                fetched_at = excluded.fetched_at
+            """, (barcode, product, fetched_at))
+
+    def create_user(self) -> int:
+        with self._transaction() as cursor:
+            cursor.execute("INSERT INTO users DEFAULT VALUES RETURNING id")
+            return cursor.fetchone()[0]
+
+    def user_exists(self, user_id: int) -> bool:
+        with self._transaction() as cursor:
+            cursor.execute("SELECT 1 FROM users WHERE id = %s", (user_id,))
+            return cursor.fetchone() is not None
+
+    def save_user_settings(self, user_id: int, user_data: Dict) -> bool:
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                UPDATE users SET
+                    weight = %s,
+                    height = %s,
+                    age = %s,
+                    gender = %s,
+                    activity_level = %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                """, (
+                    user_data['weight'],
+                    user_data['height'],
+                    user_data['age'],
+                    user_data['gender'],
+                    user_data['activity_level'],
+                    user_id
+                ))
+                return cursor.rowcount == 1
+        except Exception as e:
+            print(f"Ошибка сохранения настроек пользователя: {e}")
+            return False
+
+    def get_user_settings(self, user_id: int) -> Optional[UserSettings]:
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                SELECT weight, height, age, gender, activity_level
+                FROM users WHERE id = %s
+                """, (user_id,))
+                result = cursor.fetchone()
+            if result and result[0] is not None:
+                return UserSettings._make(result)
+            return None
+        except Exception as e:
+            print(f"Ошибка получения настроек пользователя: {e}")
+            return None
+
+    def clear_user_settings(self, user_id: int) -> bool:
+        try:
+            with self._transaction() as cursor:
+                cursor.execute("""
+                UPDATE users SET
+                    weight = NULL,
+                    height = NULL,
+                    age = NULL,
+                    gender = NULL,
+                    activity_level = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                """, (user_id,))
+            return True
+        except Exception as e:
+            print(f"Ошибка очистки пользовательских данных: {e}")
+            return False
+
+    def reset_database(self) -> bool:
+        try:
+            with self._transaction() as cursor:
+                for object_type, name in RESET_OBJECTS:
+                    cursor.execute(f"DROP {object_type} IF EXISTS {name} CASCADE")
+                cursor.execute("DELETE FROM schema_version")
+            migrate(self.conn)
+            with self._transaction() as cursor:
+                cursor.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+            self.bump_catalog_generation()
+            return True
+        except Exception as e:
+            print(f"Ошибка сброса БД: {e}")
+            return False
+
+    def check_query_plans(self) -> List[str]:
+        """Ищет в планах полные просмотры таблиц и сортировки"""
+        problems = []
+        with self._transaction() as cursor:
+            # На маленьких таблицах планировщик честно выбирает Seq Scan или
+            # Bitmap Scan с сортировкой; запрещаем их, чтобы проверять, есть ли
+            # индекс, отдающий строки сразу в нужном порядке
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_bitmapscan = off")
+            for name, (sql, params) in QUERY_PLAN_CHECKS.items():
+                cursor.execute(f"EXPLAIN {sql}", params)
+                for (detail,) in cursor.fetchall():
+                    step = detail.strip().lstrip("-> ").strip()
+                    if step.startswith(("Seq Scan", "Sort")):
+                        problems.append(f"{name}: {step}")
+        return problems
+
+    def close(self):
+        self.pool.release(self.conn)
+
@@ -0,0 +1,226 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+from services.storage import StorageBackend
+from services.records import Product
+import numpy as np
+
+
+# Порядок столбцов матрицы нутриентов (значения на 100 г)
+NUTRIENTS = ('calories', 'proteins', 'fats', 'carbs')
+
+
+class NutrientIndex:
+    """Позиции продуктов каталога, упорядоченные по возрастанию каждого нутриента.
+
+    Нужен для отбора кандидатов в рекомендациях: продукты с наибольшим
+    (или наименьшим) содержанием нутриента берутся с конца (или начала)
+    столбца без просмотра всего каталога.
+    """
+
+    def __init__(self, order: np.ndarray, sorted_values: np.ndarray):
+        self.order = order                  # shape (4, n): позиции в каталоге
+        self.sorted_values = sorted_values  # shape (4, n): значения в том же порядке
+
+    @classmethod
+    def build(cls, values: np.ndarray) -> 'NutrientIndex':
+        order = np.argsort(values, axis=0, kind='stable').T
+        return cls(np.ascontiguousarray(order), np.take_along_axis(values.T, order, axis=1))
+
+    def __len__(self) -> int:
+        return self.order.shape[1]
+
+    def head(self, column: int, direction: int, depth: int) -> np.ndarray:
+        """Первые depth позиций столбца: по убыванию (direction > 0) или по возрастанию."""
+        return self.order[column, -depth:] if direction > 0 else self.order[column, :depth]
+
+    def frontier(self, directions: np.ndarray, depth: int) -> np.ndarray:
+        """Граница просмотренного: лучшее значение каждого нутриента среди непросмотренных."""
+        row = np.zeros(len(directions))
+        for column, direction in enumerate(directions):
+            if direction > 0:
+                row[column] = self.sorted_values[column, -depth - 1]
+            elif direction < 0:
+                row[column] = self.sorted_values[column, depth]
+        return row
+
+    def replace(self, position: int, values: np.ndarray) -> 'NutrientIndex':
+        """Новый индекс с изменёнными значениями продукта на позиции position."""
+        order, sorted_values = [], []
+        for column, value in enumerate(values):
+            at = np.flatnonzero(self.order[column] == position)[0]
+            column_order = np.delete(self.order[column], at)
+            column_values = np.delete(self.sorted_values[column], at)
+            at = np.searchsorted(column_values, value, side='right')
+            order.append(np.insert(column_order, at, position))
+            sorted_values.append(np.insert(column_values, at, value))
+        return NutrientIndex(np.array(order), np.array(sorted_values))
+
+    def insert(self, position: int, values: np.ndarray) -> 'NutrientIndex':
+        """Новый индекс с продуктом, вставленным в каталог на позицию position."""
+        shifted = self.order + (self.order >= position)
+        order, sorted_values = [], []
+        for column, value in enumerate(values):
+            at = np.searchsorted(self.sorted_values[column], value, side='right')
+            order.append(np.insert(shifted[column], at, position))
+            sorted_values.append(np.insert(self.sorted_values[column], at, value))
+        return NutrientIndex(np.array(order, dtype=np.int64), np.array(sorted_values))
+
+
+class ProductCatalog:
+    """Каталог продуктов в столбцовом виде: нутриенты хранятся в матрице NumPy."""
+
+    def __init__(self, ids: np.ndarray, names: List[str], barcodes: List[Optional[str]], values: np.ndarray):
+        self.ids = ids
+        self.names = names
+        self.barcodes = barcodes
+        self.values = values  # shape (n, 4), столбцы в порядке NUTRIENTS
+        self._index: Optional[NutrientIndex] = None
+
+    @classmethod
+    def from_rows(cls, rows: List[tuple]) -> 'ProductCatalog':
+        """Строит каталог из строк (id, name, barcode, calories, proteins, fats, carbs)."""
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        names = [row[1] for row in rows]
+        barcodes = [row[2] for row in rows]
+        values = np.array([row[3:7] for row in rows], dtype=np.float64).reshape(len(rows), len(NUTRIENTS))
+        # Отсутствующие значения (NULL) считаем нулевыми
+        np.nan_to_num(values, copy=False, nan=0.0)
+        return cls(ids, names, barcodes, values)
+
+    def with_product(self, row: tuple) -> 'ProductCatalog':
+        """Возвращает копию каталога с добавленным или изменённым продуктом.
+
+        row — строка как в from_rows; каталог упорядочен по id. Сам каталог
+        не меняется: его могут читать другие потоки.
+        """
+        product_id = row[0]
+        values = np.nan_to_num(np.array(row[3:7], dtype=np.float64), nan=0.0)
+        position = int(np.searchsorted(self.ids, product_id))
+        names, barcodes = list(self.names), list(self.barcodes)
+
+        if position < len(self) and self.ids[position] == product_id:
+            ids = self.ids
+            names[position], barcodes[position] = row[1], row[2]
+            matrix = self.values.copy()
+            matrix[position] = values
+            index = self._index.replace(position, values) if self._index is not None else None
+        else:
+            ids = np.insert(self.ids, position, product_id)
+            names.insert(position, row[1])
+            barcodes.insert(position, row[2])
+            matrix = np.insert(self.values, position, values, axis=0)
+            index = self._index.insert(position, values) if self._index is not None else None
+
+        catalog = ProductCatalog(ids, names, barcodes, matrix)
+        catalog._index = index
+        return catalog
+
+    @classmethod
+    def load(cls, db: StorageBackend) -> 'ProductCatalog':
+        """Загружает весь каталог из хранилища."""
+        return cls.from_rows(list(db.iter_catalog_rows()))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def index(self) -> NutrientIndex:
+        """Индекс по нутриентам; строится при первом обращении."""
+        if self._index is None:
+            self._index = NutrientIndex.build(self.values)
+        return self._index
+
+    def column(self, nutrient: str) -> np.ndarray:
+        """Возвращает столбец нутриента (вид на матрицу, без копирования)."""
+        return self.values[:, NUTRIENTS.index(nutrient)]
+
+    def product(self, index: int) -> Product:
+        """Возвращает строку каталога по позиции."""
+        return Product(int(self.ids[index]), self.names[index], self.barcodes[index], *self.values[index].tolist())
+
+
+class CatalogCache:
+    """Кэш каталога продуктов на уровне процесса.
+
+    Каталог перечитывается только при его изменении: записи через хранилище
+    в этом процессе увеличивают StorageBackend.catalog_generation, а записи
+    из других процессов видны по catalog_token() (в SQLite — PRAGMA
+    data_version) и версии в таблице catalog_version. Запись одного
+    продукта (add_or_update_product) применяется к каталогу на месте через
+    apply(), без перечитывания.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.updates = 0
+
+    def get(self, db: StorageBackend) -> ProductCatalog:
+        """Возвращает актуальный каталог для хранилища db."""
+        with self._lock:
+            entry = self._entries.get(db.location)
+            if entry is None:
+                entry = self._entries[db.location] = {
+                    'catalog': None, 'generation': None, 'token': None, 'version': None
+                }
+
+            generation = StorageBackend.catalog_generation
+            token = db.catalog_token()
+            if (entry['catalog'] is not None and entry['generation'] == generation
+                    and entry['token'] == token):
+                self.hits += 1
+                return entry['catalog']
+
+            # Что-то записано в БД, но каталог мог и не измениться
+            version = db.catalog_version()
+            entry['generation'] = generation
+            entry['token'] = token
+            if entry['catalog'] is not None and entry['version'] == version:
+                self.hits += 1
+                return entry['catalog']
+
+            if entry['catalog'] is None:
+                self.misses += 1
+            else:
+                self.reloads += 1
+            entry['catalog'] = ProductCatalog.load(db)
+            entry['version'] = version
+            return entry['catalog']
+
+    def apply(self, location: str, row: Tuple, version_before: int, version_after: int):
+        """Обновляет каталог на месте после записи одного продукта.
+
+        Если каталог загружен не на версии version_before (были и другие
+        записи), ничего не делает: его перечитает следующий get().
+        """
+        with self._lock:
+            entry = self._entries.get(location)
+            if entry is None or entry['catalog'] is None or entry['version'] != version_before:
+                return
+            entry['catalog'] = entry['catalog'].with_product(row)
+            entry['version'] = version_after
+            self.updates += 1
+
+    def invalidate(self):
+        """Сбрасывает все закэшированные каталоги."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает счётчики попаданий, промахов, перезагрузок и обновлений на месте."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'updates': self.updates,
+                'size': sum(len(entry['catalog']) for entry in self._entries.values() if entry['catalog'] is not None)
+            }
+
+
+# Общий кэш каталога для всего процесса
+catalog_cache = CatalogCache()
+StorageBackend.product_listeners.append(catalog_cache.apply)
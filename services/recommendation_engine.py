@@ -1,37 +1,35 @@
-from typing import List, Dict
-from services.database import Database
+from typing import List, Dict, Optional
+from services.storage import StorageBackend, create_storage
+from services.records import DailyTotals, Recommendation
+from services.product_catalog import ProductCatalog, NUTRIENTS, catalog_cache
+from services.meal_planner import MealPlanner
+from services.metrics import timed
 import numpy as np
 
 
+# Каталоги меньше этого размера оцениваются целиком: индекс не окупается
+INDEX_MIN_CATALOG = 2048
+# Начальная глубина просмотра индекса на одну рекомендацию
+INDEX_DEPTH_PER_ITEM = 64
+
+
 class RecommendationEngine:
-    def __init__(self, db_path: str = "nutrition.db"):
-        self.db = Database(db_path)
-
-    def _get_all_products(self) -> List[Dict]:
-        """Получает все продукты из базы данных."""
-        cursor = self.db.conn.cursor()
-        cursor.execute("""
-            SELECT id, name, barcode, 
-                   calories_per_100g, proteins_per_100g, 
-                   fats_per_100g, carbs_per_100g 
-            FROM products
-        """)
-        return [
-            {
-                'id': row[0], 'name': row[1], 'barcode': row[2],
-                'calories': row[3], 'proteins': row[4],
-                'fats': row[5], 'carbs': row[6]
-            }
-            for row in cursor.fetchall()
-        ]
-
-    def _calculate_nutrient_balance(self, daily_norms: Dict, today_stats: Dict) -> Dict:
+    def __init__(self, db: Optional[StorageBackend] = None):
+        # Хранилище запроса переиспользуется; своё закрывается в close()
+        self._owns_db = db is None
+        self.db = db if db is not None else create_storage()
+
+    def _get_catalog(self) -> ProductCatalog:
+        """Получает каталог продуктов в столбцовом виде из кэша процесса."""
+        return catalog_cache.get(self.db)
+
+    def _calculate_nutrient_balance(self, daily_norms: Dict, today_stats: DailyTotals) -> Dict:
         """Рассчитывает баланс нутриентов в абсолютных и процентных значениях."""
         balance = {
-            'proteins': daily_norms['proteins'] - today_stats.get('total_proteins', 0),
-            'fats': daily_norms['fats'] - today_stats.get('total_fats', 0),
-            'carbs': daily_norms['carbs'] - today_stats.get('total_carbs', 0),
-            'calories': daily_norms['calories'] - today_stats.get('total_calories', 0)
+            'proteins': daily_norms['proteins'] - today_stats.proteins,
+            'fats': daily_norms['fats'] - today_stats.fats,
+            'carbs': daily_norms['carbs'] - today_stats.carbs,
+            'calories': daily_norms['calories'] - today_stats.calories
         }
         percent_balance = {
             'proteins': balance['proteins'] / daily_norms['proteins'] * 100 if daily_norms['proteins'] > 0 else 0,
@@ -41,99 +39,166 @@ class RecommendationEngine:
         }
         return {'absolute': balance, 'percent': percent_balance}
 
-    def _calculate_recommended_mass(self, product: Dict, daily_norms: Dict, abs_balance: Dict) -> float:
-        """Рассчитывает рекомендуемую массу продукта в граммах для нормализации баланса."""
+    def _calculate_recommended_masses(self, values: np.ndarray, daily_norms: Dict, abs_balance: Dict) -> np.ndarray:
+        """Рассчитывает рекомендуемую массу (г) для каждой строки матрицы нутриентов."""
         max_mass = 500.0  # Максимальная масса порции
         min_mass = 10.0   # Минимальная масса порции
-        nutrient_masses = []
+        masses = np.full(len(values), np.inf)
+        has_mass = np.zeros(len(values), dtype=bool)
 
         for nutrient in ['proteins', 'fats', 'carbs', 'calories']:
-            nutrient_value = product.get(nutrient, 0)
-            if nutrient_value <= 0:  # Избегаем деления на ноль
-                continue
+            nutrient_values = values[:, NUTRIENTS.index(nutrient)]
+            positive = nutrient_values > 0  # Избегаем деления на ноль
 
             # Если есть дефицит, рассчитываем массу для его закрытия
             if abs_balance[nutrient] > 0:
-                mass = (abs_balance[nutrient] / nutrient_value) * 100
-                nutrient_masses.append(mass)
+                target = abs_balance[nutrient]
             elif abs_balance[nutrient] < -10:  # Если переизбыток, ограничиваем добавление
-                max_nutrient_addition = daily_norms[nutrient] * 0.05  # Допускаем 5% от нормы
-                mass = (max_nutrient_addition / nutrient_value) * 100
-                nutrient_masses.append(mass)
+                target = daily_norms[nutrient] * 0.05  # Допускаем 5% от нормы
             else:
                 # Нейтральный случай: допускаем максимальную массу
-                nutrient_masses.append(max_mass)
+                target = None
+
+            if target is None:
+                nutrient_masses = np.full(len(values), max_mass)
+            else:
+                nutrient_masses = np.divide(target, nutrient_values, out=np.full(len(values), np.inf),
+                                            where=positive) * 100
+            masses = np.where(positive, np.minimum(masses, nutrient_masses), masses)
+            has_mass |= positive
 
         # Берём минимальную массу, чтобы не превысить нормы
-        if nutrient_masses:
-            recommended_mass = min(nutrient_masses)
-            return max(min_mass, min(max_mass, recommended_mass))
-        return min_mass  # Значение по умолчанию
+        return np.where(has_mass, np.clip(masses, min_mass, max_mass), min_mass)
+
+    def _score_products(self, values: np.ndarray, daily_norms: Dict, abs_balance: Dict) -> np.ndarray:
+        """Вычисляет оценку соответствия для всех продуктов каталога одним проходом."""
+        # Определяем веса для нутриентов на основе их дефицита
+        priorities = {
+            'proteins': max(0.1, abs_balance['proteins'] / daily_norms['proteins']) if abs_balance['proteins'] > 0 and daily_norms['proteins'] > 0 else 0.1,
+            'fats': max(0.1, abs_balance['fats'] / daily_norms['fats']) if abs_balance['fats'] > 0 and daily_norms['fats'] > 0 else 0.1,
+            'carbs': max(0.1, abs_balance['carbs'] / daily_norms['carbs']) if abs_balance['carbs'] > 0 and daily_norms['carbs'] > 0 else 0.1
+        }
+
+        # Нормализуем веса
+        total_priority = sum(priorities.values())
+        if total_priority > 0:
+            priorities = {k: v / total_priority for k, v in priorities.items()}
+
+        scores = np.zeros(len(values))
 
-    def recommend_products(self, daily_norms: Dict, today_stats: Dict, n_recommendations: int = 5) -> List[Dict]:
+        # Рассчитываем вклад каждого нутриента
+        for nutrient in ['proteins', 'fats', 'carbs']:
+            nutrient_values = values[:, NUTRIENTS.index(nutrient)]
+            norm = daily_norms.get(nutrient, 1)
+            if norm <= 0:
+                norm = 1  # Избегаем деления на ноль
+
+            if abs_balance[nutrient] > 0:
+                scores += priorities[nutrient] * ((nutrient_values / norm) * 100)
+            elif abs_balance[nutrient] < -10:
+                scores -= (nutrient_values / norm) * 100 * 0.75
+
+        # Учитываем калории
+        with np.errstate(divide='ignore', invalid='ignore'):
+            calorie_contribution = (values[:, NUTRIENTS.index('calories')] / daily_norms.get('calories', 1)) * 100
+        if abs_balance['calories'] > 0:
+            scores += calorie_contribution * 0.1
+        else:
+            scores -= calorie_contribution * 0.2
+
+        return scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Возвращает индексы k лучших положительных оценок по убыванию.
+
+        При равных оценках порядок совпадает со стабильной сортировкой:
+        раньше идёт продукт с меньшим индексом в каталоге.
+        """
+        candidates = np.flatnonzero(scores > 0)
+        if k <= 0 or len(candidates) == 0:
+            return candidates[:0]
+
+        if k < len(candidates):
+            candidate_scores = scores[candidates]
+            kth = candidate_scores[np.argpartition(-candidate_scores, k - 1)[k - 1]]
+            above = candidates[candidate_scores > kth]
+            ties = candidates[candidate_scores == kth][:k - len(above)]
+            candidates = np.concatenate([above, ties])
+
+        return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+    def _score_directions(self, daily_norms: Dict, abs_balance: Dict) -> np.ndarray:
+        """Знак влияния каждого нутриента на оценку: 1, -1 или 0 (не влияет).
+
+        Оценка линейна по нутриентам, поэтому знак определяется пробными
+        продуктами с единичным содержанием одного нутриента.
+        """
+        probes = np.vstack([np.zeros(len(NUTRIENTS)), np.eye(len(NUTRIENTS))])
+        scores = self._score_products(probes, daily_norms, abs_balance)
+        return np.sign(scores[1:] - scores[0])
+
+    def _select_top(self, catalog: ProductCatalog, daily_norms: Dict, abs_balance: Dict, k: int):
+        """Возвращает позиции k лучших продуктов каталога и их оценки.
+
+        Алгоритм порогов (Fagin): кандидаты — продукты из голов столбцов
+        индекса по нужным нутриентам. Оценка продукта, не попавшего в
+        кандидаты, не больше оценки «граничного» продукта из лучших
+        непросмотренных значений, так что если k-я оценка кандидатов строго
+        выше границы, результат совпадает с полным перебором (включая
+        порядок равных оценок). Иначе глубина растёт, в худшем случае до
+        полного перебора.
+        """
+        directions = self._score_directions(daily_norms, abs_balance)
+        if len(catalog) >= INDEX_MIN_CATALOG and k > 0 and directions.any():
+            index = catalog.index
+            active = np.flatnonzero(directions)
+            depth = k * INDEX_DEPTH_PER_ITEM
+            while depth < len(catalog):
+                candidates = np.unique(np.concatenate([
+                    index.head(column, directions[column], depth) for column in active
+                ]))
+                bound = self._score_products(index.frontier(directions, depth)[None, :], daily_norms, abs_balance)[0]
+                if not np.isfinite(bound):
+                    break
+                scores = self._score_products(catalog.values[candidates], daily_norms, abs_balance)
+                top = self._top_k(scores, k)
+                if bound <= 0 or (len(top) == k and scores[top[-1]] > bound):
+                    return candidates[top], scores[top]
+                depth *= 4
+
+        scores = self._score_products(catalog.values, daily_norms, abs_balance)
+        top = self._top_k(scores, k)
+        return top, scores[top]
+
+    @timed("recommendation.recommend_products")
+    def recommend_products(self, daily_norms: Dict, today_stats: DailyTotals,
+                           n_recommendations: int = 5) -> List[Recommendation]:
         """Рекомендует продукты с процентом соответствия (0-100%) и массой в граммах."""
         try:
-            products = self._get_all_products()
-            if not products:
+            catalog = self._get_catalog()
+            if not len(catalog):
                 return []
 
             # Получаем баланс нутриентов
             balance = self._calculate_nutrient_balance(daily_norms, today_stats)
             abs_balance = balance['absolute']
-            percent_balance = balance['percent']
-
-            # Определяем веса для нутриентов на основе их дефицита
-            priorities = {
-                'proteins': max(0.1, abs_balance['proteins'] / daily_norms['proteins']) if abs_balance['proteins'] > 0 and daily_norms['proteins'] > 0 else 0.1,
-                'fats': max(0.1, abs_balance['fats'] / daily_norms['fats']) if abs_balance['fats'] > 0 and daily_norms['fats'] > 0 else 0.1,
-                'carbs': max(0.1, abs_balance['carbs'] / daily_norms['carbs']) if abs_balance['carbs'] > 0 and daily_norms['carbs'] > 0 else 0.1
-            }
-
-            # Нормализуем веса
-            total_priority = sum(priorities.values())
-            if total_priority > 0:
-                priorities = {k: v / total_priority for k, v in priorities.items()}
-
-            scored_products = []
-            for product in products:
-                match_score = 0.0
-
-                # Рассчитываем вклад каждого нутриента
-                for nutrient in ['proteins', 'fats', 'carbs']:
-                    nutrient_value = product.get(nutrient, 0)
-                    norm = daily_norms.get(nutrient, 1)
-                    if norm <= 0:
-                        norm = 1  # Избегаем деления на ноль
-
-                    if abs_balance[nutrient] > 0:
-                        nutrient_contribution = (nutrient_value / norm) * 100
-                        match_score += priorities[nutrient] * nutrient_contribution
-                    elif abs_balance[nutrient] < -10:
-                        penalty = (nutrient_value / norm) * 100 * 0.75
-                        match_score -= penalty
-
-                # Учитываем калории
-                calorie_contribution = (product.get('calories', 0) / daily_norms.get('calories', 1)) * 100
-                if abs_balance['calories'] > 0:
-                    match_score += calorie_contribution * 0.1
-                else:
-                    match_score -= calorie_contribution * 0.2
-
-                if match_score > 0:
-                    scored_products.append((match_score, product))
-
-            # Сортируем продукты по убыванию оценки
-            scored_products.sort(reverse=True, key=lambda x: x[0])
+
+            top, scores = self._select_top(catalog, daily_norms, abs_balance, n_recommendations)
+            if not len(top):
+                return []
+
+            masses = self._calculate_recommended_masses(catalog.values[top], daily_norms, abs_balance)
 
             # Нормализуем оценки в диапазон 0-100%
-            max_score = scored_products[0][0] if scored_products else 1
+            max_score = float(scores[0])
             recommendations = [
-                {
-                    **product,
-                    'match_score': min(100.0, max(0.0, score / max(1.0, max_score) * 100)),
-                    'recommended_mass': round(self._calculate_recommended_mass(product, daily_norms, abs_balance), 1)
-                }
-                for score, product in scored_products[:n_recommendations]
+                Recommendation(
+                    catalog.product(index),
+                    round(float(mass), 1),
+                    min(100.0, max(0.0, float(score) / max(1.0, max_score) * 100))
+                )
+                for index, score, mass in zip(top, scores, masses)
             ]
 
             return recommendations
@@ -142,5 +207,15 @@ class RecommendationEngine:
             print(f"Ошибка в рекомендациях: {e}")
             return []
 
+    @timed("recommendation.plan_meal")
+    def plan_meal(self, daily_norms: Dict, today_stats: DailyTotals, max_items: int = 4) -> Optional[Dict]:
+        """Подбирает сочетание продуктов и их массу, закрывающее остаток дневной нормы."""
+        try:
+            return MealPlanner(max_items=max_items).plan(self._get_catalog(), daily_norms, today_stats)
+        except Exception as e:
+            print(f"Ошибка в подборе рациона: {e}")
+            return None
+
     def close(self):
-        self.db.close()
\ No newline at end of file
+        if self._owns_db:
+            self.db.close()
@@ -0,0 +1,63 @@
+from typing import NamedTuple, Optional
+
+
+# Типы строк, которые хранилище отдаёт приложению. Именованные кортежи не
+# заводят словарь на каждую строку, а доступ по позиции (row[0]) остаётся
+# для кода, который работает со строками как с кортежами.
+
+
+class Product(NamedTuple):
+    """Продукт каталога, КБЖУ на 100 г"""
+    id: int
+    name: str
+    barcode: Optional[str]
+    calories: float
+    proteins: float
+    fats: float
+    carbs: float
+
+
+class DiaryEntry(NamedTuple):
+    """Запись дневника: продукт, дата 'YYYY-MM-DD', масса и КБЖУ на эту массу"""
+    id: int
+    name: str
+    barcode: Optional[str]
+    date: str
+    grams: float
+    calories: float
+    proteins: float
+    fats: float
+    carbs: float
+    user_id: int
+
+
+class DailyTotals(NamedTuple):
+    """Итог КБЖУ пользователя за день и число записей в нём"""
+    date: str
+    calories: float
+    proteins: float
+    fats: float
+    carbs: float
+    entries: int
+
+
+class UserSettings(NamedTuple):
+    """Параметры пользователя для расчёта дневной нормы"""
+    weight: float
+    height: float
+    age: int
+    gender: str
+    activity_level: float
+
+
+class Recommendation(NamedTuple):
+    """Рекомендованный продукт: сама строка каталога, масса порции (г) и оценка соответствия"""
+    product: Product
+    recommended_mass: float
+    match_score: Optional[float] = None
+
+
+def row_factory(record_type):
+    """row_factory курсора sqlite3, собирающая строки сразу в record_type"""
+    make = record_type._make
+    return lambda cursor, row: make(row)
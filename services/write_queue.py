@@ -0,0 +1,151 @@
+import asyncio
+import atexit
+import contextvars
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, TypeVar
+
+from services.storage import StorageBackend, create_storage
+
+
+# Пакет записи: не больше стольких операций и не дольше стольких
+# миллисекунд ожидания после первой операции пакета. По умолчанию не ждём:
+# пока фиксируется один пакет, в очереди копится следующий
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", 64))
+WRITE_BATCH_DELAY_MS = float(os.environ.get("WRITE_BATCH_DELAY_MS", 0))
+
+T = TypeVar("T")
+
+# Сигнал потоку записи завершиться
+_STOP = object()
+
+
+class WriteQueue:
+    """
+    Очередь записей в БД с единственным потоком-писателем
+
+    Запросы не открывают свои транзакции записи, а ставят операции
+    func(storage, *args) в очередь. Поток-писатель собирает их в пакеты
+    (ограниченные числом операций и временем ожидания) и фиксирует каждый
+    пакет одной транзакцией через StorageBackend.apply_batch. Так запись
+    в SQLite не упирается в блокировку БД и busy timeout, а каждый
+    вызывающий получает через Future результат своей операции или её
+    исключение. Ошибка одной операции откатывает только её.
+    """
+
+    def __init__(self, storage_url: Optional[str] = None,
+                 max_batch: int = WRITE_BATCH_SIZE, max_delay: float = WRITE_BATCH_DELAY_MS / 1000):
+        self.storage_url = storage_url
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.writes = 0
+        self.errors = 0
+        self.max_batch_seen = 0
+
+    def submit(self, func: Callable[..., T], *args) -> "Future[T]":
+        """
+        Ставит операцию func(storage, *args) в очередь записи
+
+        Операция видит контекстные переменные вызывающего (трассировку запроса).
+        """
+        self._ensure_started()
+        future = Future()
+        context = contextvars.copy_context()
+        self._queue.put((future, context, func, args))
+        return future
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """Ставит операцию в очередь и ждёт её результата, не занимая цикл событий"""
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    def close(self, timeout: Optional[float] = None):
+        """Дописывает очередь и останавливает поток-писатель"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'batches': self.batches,
+            'writes': self.writes,
+            'errors': self.errors,
+            'max_batch': self.max_batch_seen,
+            'queued': self._queue.qsize()
+        }
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                # Уже ждущие операции забираем сразу, новые — до дедлайна
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        # Отменённые до записи операции не выполняем
+        batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        operations = [
+            (lambda db, context=context, func=func, args=args: context.run(func, db, *args), ())
+            for _, context, func, args in batch
+        ]
+        try:
+            db: StorageBackend = create_storage(self.storage_url)
+            try:
+                results = db.apply_batch(operations)
+            finally:
+                db.close()
+        except Exception as e:
+            # Не удалась сама фиксация: не записалась ни одна операция пакета
+            print(f"Ошибка пакетной записи: {e}")
+            self.errors += len(batch)
+            for future, *_ in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        for (future, *_), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                self.errors += 1
+                future.set_exception(value)
+
+
+# Общая очередь процесса (хранилище по DATABASE_URL)
+write_queue = WriteQueue()
+atexit.register(write_queue.close)
@@ -0,0 +1,183 @@
+import itertools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit
+
+import pytest
+
+from services import database
+from services.database import Database, get_pool
+from services.storage import DATABASE_URL_ENV, SQLITE_SCHEME, create_storage
+
+# Сервер PostgreSQL для тестов; без него тесты PostgreSQL пропускаются
+TEST_POSTGRES_URL_ENV = "TEST_POSTGRES_URL"
+
+_test_databases = itertools.count(1)
+
+
+@pytest.fixture(autouse=True)
+def default_storage(tmp_path, monkeypatch):
+    """
+    Хранилище по умолчанию (create_storage() без адреса) — временный файл
+
+    Иначе тест, забывший указать базу, изменил бы services/nutrition.db из репозитория.
+    """
+    path = str(tmp_path / "default.db")
+    monkeypatch.setenv(DATABASE_URL_ENV, SQLITE_SCHEME + path)
+    yield path
+    pool = database._pools.pop(path, None)
+    if pool is not None:
+        pool.close_all()
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    """Хранилище SQLite во временном файле со свежей схемой"""
+    db = Database(str(tmp_path / "nutrition.db"))
+    try:
+        yield db
+    finally:
+        db.close()
+        get_pool(db.db_path).close_all()
+
+
+@pytest.fixture(scope="session")
+def postgres_server(tmp_path_factory):
+    """
+    Адрес сервера PostgreSQL: TEST_POSTGRES_URL или временный локальный сервер
+
+    Временный сервер поднимает testing.postgresql, а если он недоступен
+    (например, initdb не запускается от root) — pgserver. Пользователю
+    сервера нужно право CREATEDB: каждый тест получает свою базу.
+    """
+    pytest.importorskip("psycopg2")
+    url = os.environ.get(TEST_POSTGRES_URL_ENV)
+    if url:
+        yield url
+        return
+
+    try:
+        import testing.postgresql
+        server = testing.postgresql.Postgresql()
+        url, stop = server.url(), server.stop
+    except Exception:
+        try:
+            import pgserver
+            server = pgserver.get_server(str(tmp_path_factory.mktemp("pgdata")), cleanup_mode="stop")
+            url, stop = server.get_uri(), server.cleanup
+        except Exception as e:
+            pytest.skip(f"PostgreSQL недоступен ({e}): задайте {TEST_POSTGRES_URL_ENV}")
+    try:
+        yield url
+    finally:
+        stop()
+
+
+@pytest.fixture
+def postgres_url(postgres_server):
+    """DSN отдельной пустой базы на тестовом сервере, удаляется после теста"""
+    import psycopg2
+    from services import postgres_database
+
+    name = f"nutrition_test_{os.getpid()}_{next(_test_databases)}"
+    parts = urlsplit(postgres_server)
+    url = urlunsplit(parts._replace(path=f"/{name}"))
+
+    admin = psycopg2.connect(postgres_server)
+    admin.autocommit = True
+    try:
+        admin.cursor().execute(f"CREATE DATABASE {name}")
+        try:
+            yield url
+        finally:
+            pool = postgres_database._pools.pop(url, None)
+            if pool is not None:
+                pool.close_all()
+            admin.cursor().execute(f"DROP DATABASE IF EXISTS {name}")
+    finally:
+        admin.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def storage(request, tmp_path):
+    """Хранилище каждого вида со свежей схемой (через create_storage)"""
+    if request.param == "sqlite":
+        url = SQLITE_SCHEME + str(tmp_path / "nutrition.db")
+    else:
+        url = request.getfixturevalue("postgres_url")
+    db = create_storage(url)
+    try:
+        yield db
+    finally:
+        db.close()
+        if request.param == "sqlite":
+            get_pool(db.db_path).close_all()
+
+
+class StubOpenFoodFacts:
+    """
+    Заглушка API OpenFoodFacts на http.server
+
+    Ответ на штрих-код задаётся в responses: (статус, тело); тело — словарь
+    (отдаётся как JSON) или байты как есть. Незаданные штрих-коды — 404.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.calls = {}
+        self.delay = 0.0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/v2"
+
+    def product(self, barcode: str, name: str, calories: float = 250):
+        """Отвечать на barcode найденным продуктом"""
+        self.responses[barcode] = (200, {"status": 1, "product": {
+            "product_name": name,
+            "nutriments": {"energy-kcal_100g": calories, "proteins_100g": 12,
+                           "fat_100g": 9, "carbohydrates_100g": 30}
+        }})
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                barcode = self.path.rsplit("/", 1)[-1]
+                with stub._lock:
+                    stub.calls[barcode] = stub.calls.get(barcode, 0) + 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                status, body = stub.responses.get(barcode, (404, {"status": 0}))
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self) -> "StubOpenFoodFacts":
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def stub_api():
+    with StubOpenFoodFacts() as stub:
+        yield stub
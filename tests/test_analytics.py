@@ -0,0 +1,105 @@
+from datetime import date
+
+import pytest
+
+from app import create_app
+from services.analytics import NutritionReport
+from services.calorie_calculator import CalorieCalculator
+
+NORMS = {"calories": 2000.0, "proteins": 100.0, "fats": 50.0, "carbs": 250.0}
+SETTINGS = {"weight": 70, "height": 175, "age": 30, "gender": "male", "activity_level": 1.55}
+
+# Продукты на 100 г: А — 200 ккал, 10/5/30; Б — 100 ккал, 2/1/20
+PRODUCT_A = {"barcode": "1", "name": "А", "calories": 200, "proteins": 10, "fats": 5, "carbs": 30}
+PRODUCT_B = {"barcode": "2", "name": "Б", "calories": 100, "proteins": 2, "fats": 1, "carbs": 20}
+
+# Две недели с понедельника 2024-01-01. День до отчёта попадает только в
+# скользящее среднее. Итоги дней (ккал/Б/Ж/У):
+#   2023-12-30  А 100 г             200 / 10 / 5 / 30
+#   2024-01-01  А 1000 г           2000 / 100 / 50 / 300
+#   2024-01-03  А 500 г + Б 500 г  1500 / 60 / 30 / 250
+#   2024-01-10  Б 1900 г           1900 / 38 / 19 / 380
+DIARY = [("2023-12-30", "A", 100), ("2024-01-01", "A", 1000), ("2024-01-03", "A", 500),
+         ("2024-01-03", "B", 500), ("2024-01-10", "B", 1900)]
+START, END = date(2024, 1, 1), date(2024, 1, 14)
+
+
+def nutrients(calories, proteins, fats, carbs):
+    return {"calories": calories, "proteins": proteins, "fats": fats, "carbs": carbs}
+
+
+EMPTY = nutrients(None, None, None, None)
+
+
+@pytest.fixture
+def diary(storage):
+    user_id = storage.create_user()
+    ids = {"A": storage.add_or_update_product(PRODUCT_A), "B": storage.add_or_update_product(PRODUCT_B)}
+    storage.add_consumptions([(user_id, ids[product], day, grams) for day, product, grams in DIARY])
+    return storage, user_id
+
+
+def test_summary_and_weeks(diary):
+    report = NutritionReport.load(*diary, START, END, NORMS).as_dict("week")
+
+    assert report["summary"] == {
+        "days_logged": 3,
+        "total": nutrients(5400.0, 198.0, 99.0, 930.0),
+        "average": nutrients(1800.0, 66.0, 33.0, 310.0),
+        "adherence": nutrients(90.0, 66.0, 66.0, 124.0),
+        # 2000 и 1900 ккал в пределах 10% нормы, 1500 — нет
+        "on_target_days": 2
+    }
+    assert report["periods"] == [
+        {"start": "2024-01-01", "end": "2024-01-07", "entries": 3, "days_logged": 2,
+         "total": nutrients(3500.0, 160.0, 80.0, 550.0), "average": nutrients(1750.0, 80.0, 40.0, 275.0),
+         "adherence": nutrients(87.5, 80.0, 80.0, 110.0), "on_target_days": 1},
+        {"start": "2024-01-08", "end": "2024-01-14", "entries": 1, "days_logged": 1,
+         "total": nutrients(1900.0, 38.0, 19.0, 380.0), "average": nutrients(1900.0, 38.0, 19.0, 380.0),
+         "adherence": nutrients(95.0, 38.0, 38.0, 152.0), "on_target_days": 1},
+    ]
+
+
+def test_days_and_rolling_average(diary):
+    days = {row["start"]: row for row in NutritionReport.load(*diary, START, END, NORMS, window=7).rollup("day", 7)}
+
+    assert len(days) == 14
+    # Средние по дням с записями в окне; 1 января окно захватывает 30 декабря
+    rolling = {day: days[day]["rolling_average"]["calories"]
+               for day in ("2024-01-01", "2024-01-03", "2024-01-07", "2024-01-08", "2024-01-10", "2024-01-14")}
+    assert rolling == {"2024-01-01": 1100.0, "2024-01-03": 1233.3, "2024-01-07": 1750.0,
+                       "2024-01-08": 1500.0, "2024-01-10": 1900.0, "2024-01-14": 1900.0}
+    assert days["2024-01-03"]["entries"] == 2
+    assert days["2024-01-03"]["total"] == nutrients(1500.0, 60.0, 30.0, 250.0)
+
+    # День без записей — «не заполнено»: без средних и соблюдения нормы
+    empty = days["2024-01-02"]
+    assert (empty["entries"], empty["days_logged"], empty["average"]) == (0, 0, EMPTY)
+    assert (empty["adherence"], empty["on_target_days"]) == (None, None)
+
+
+def test_range_without_data(diary):
+    report = NutritionReport.load(*diary, date(2023, 6, 1), date(2023, 6, 30), NORMS).as_dict("month")
+
+    assert report["summary"] == {"days_logged": 0, "total": nutrients(0.0, 0.0, 0.0, 0.0), "average": EMPTY,
+                                 "adherence": None, "on_target_days": None}
+    assert [(row["start"], row["end"], row["entries"]) for row in report["periods"]] == [
+        ("2023-06-01", "2023-06-30", 0)]
+
+
+def test_analytics_endpoint():
+    client = create_app(warmup=False).test_client()
+    client.post("/save-settings", data=SETTINGS)
+
+    # Пока дневник пуст, отчёт есть, но без средних
+    empty = client.get("/analytics?days=7&window=3").json
+    assert empty["summary"]["days_logged"] == 0 and empty["summary"]["average"] == EMPTY
+    assert empty["norms"] == CalorieCalculator.daily_norms(**SETTINGS)
+    assert len(empty["periods"]) == 7
+
+    client.post("/", data={**PRODUCT_A, "grams": 250, "save_entry": "1"})
+    summary = client.get("/analytics?days=7&window=3").json["summary"]
+    assert (summary["days_logged"], summary["total"]) == (1, nutrients(500.0, 25.0, 12.5, 75.0))
+
+    assert client.get("/analytics?period=year").status_code == 400
+    assert client.get("/analytics?days=много").status_code == 400
@@ -0,0 +1,32 @@
+import asyncio
+
+import httpx
+
+from app import create_app
+from services.database import get_pool
+from services.executor import DB_WORKERS
+
+THREADS = 4
+
+
+async def fetch_all(application, paths):
+    transport = httpx.ASGITransport(app=application)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        client.cookies.set("session", (await client.get("/")).cookies.get("session", ""))
+        return await asyncio.gather(*(client.get(path) for path in paths))
+
+
+def test_requests_reuse_bounded_threads(default_storage):
+    # Модуль создаёт приложение при импорте: импортируем, когда DATABASE_URL
+    # уже указывает на временную БД
+    from asgi import FlaskASGI
+
+    application = FlaskASGI(create_app(warmup=False), threads=THREADS)
+    try:
+        responses = asyncio.run(fetch_all(application, ["/search?q=молоко"] * 50 + ["/"] * 10))
+    finally:
+        application.executor.shutdown()
+
+    assert all(response.status_code == 200 for response in responses)
+    # Соединения открывают только потоки запросов и пула БД, а не каждый запрос
+    assert len(get_pool(default_storage)._connections) <= THREADS + DB_WORKERS
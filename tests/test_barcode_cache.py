@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app import create_app
+from services import api_client
+from services.api_client import BarcodeCache, OpenFoodFactsAPI
+from services.database import get_pool
+from services.storage import DATABASE_URL_ENV, SQLITE_SCHEME
+
+
+TTL, NEGATIVE_TTL, STALE_TTL = 100, 10, 1000
+
+
+class Clock:
+    """Подменяет time в api_client: time() управляется тестом"""
+
+    monotonic = staticmethod(time.monotonic)
+    sleep = staticmethod(time.sleep)
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+def wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "не дождались фонового обновления"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(api_client, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def storage_url(tmp_path):
+    path = str(tmp_path / "nutrition.db")
+    yield SQLITE_SCHEME + path
+    get_pool(path).close_all()
+
+
+@pytest.fixture
+def api(monkeypatch, stub_api, storage_url, clock):
+    """OpenFoodFactsAPI поверх заглушки и кэша во временной БД"""
+    cache = BarcodeCache(ttl=TTL, negative_ttl=NEGATIVE_TTL, stale_ttl=STALE_TTL, storage_url=storage_url)
+    monkeypatch.setattr(OpenFoodFactsAPI, "BASE_URL", stub_api.base_url)
+    monkeypatch.setattr(OpenFoodFactsAPI, "cache", cache)
+    monkeypatch.setattr(OpenFoodFactsAPI, "local_lookup", False)
+    return OpenFoodFactsAPI
+
+
+def test_product_cached_until_ttl(api, stub_api, clock):
+    stub_api.product("111", "Сыр")
+    assert api.get_product_by_barcode("111")["name"] == "Сыр"
+    clock.now += TTL - 1
+    assert api.get_product_by_barcode("111")["name"] == "Сыр"
+    assert stub_api.calls["111"] == 1
+    assert api.cache.hits == 1
+
+    # Старше stale_ttl запись не отдаётся: загрузка заново, синхронно
+    stub_api.product("111", "Сыр 2")
+    clock.now += STALE_TTL
+    assert api.get_product_by_barcode("111")["name"] == "Сыр 2"
+    assert stub_api.calls["111"] == 2
+
+
+def test_cache_survives_restart_in_table(api, stub_api, storage_url):
+    stub_api.product("222", "Хлеб")
+    api.get_product_by_barcode("222")
+    # Новый процесс: память пуста, ответ берётся из таблицы barcode_cache
+    fresh = BarcodeCache(ttl=TTL, negative_ttl=NEGATIVE_TTL, stale_ttl=STALE_TTL, storage_url=storage_url)
+    assert fresh.get("222", lambda barcode: pytest.fail("запрос к API"))["name"] == "Хлеб"
+    assert stub_api.calls["222"] == 1
+
+
+def test_not_found_cached_for_negative_ttl(api, stub_api, clock):
+    assert api.get_product_by_barcode("404") is None
+    clock.now += NEGATIVE_TTL - 1
+    assert api.get_product_by_barcode("404") is None
+    assert stub_api.calls["404"] == 1
+
+    # Ненайденный штрих-код не отдаётся устаревшим: после negative_ttl
+    # он запрашивается снова, и появившийся продукт виден сразу
+    stub_api.product("404", "Новинка")
+    clock.now += 2
+    assert api.get_product_by_barcode("404")["name"] == "Новинка"
+    assert stub_api.calls["404"] == 2
+
+
+def test_stale_while_revalidate(api, stub_api, clock):
+    stub_api.product("333", "Молоко", calories=60)
+    api.get_product_by_barcode("333")
+    stub_api.product("333", "Молоко", calories=64)
+    clock.now += TTL + 1
+
+    # Устаревшая запись отдаётся сразу, обновление идёт в фоне
+    assert api.get_product_by_barcode("333")["calories"] == 60
+    assert api.cache.stale_hits == 1
+    wait_for(lambda: api.cache._entries["333"][0]["calories"] == 64)
+    assert stub_api.calls["333"] == 2
+    assert api.get_product_by_barcode("333")["calories"] == 64
+    assert stub_api.calls["333"] == 2
+
+
+def test_upstream_errors_not_cached(api, stub_api, clock):
+    stub_api.responses["555"] = (500, {"error": "unavailable"})
+    assert api.get_product_by_barcode("555") is None
+    assert api.get_product_by_barcode("555") is None
+    assert stub_api.calls["555"] == 2
+    assert "555" not in api.cache._entries
+
+    # При недоступном API лучше устаревший продукт, чем никакого
+    stub_api.product("555", "Кефир")
+    assert api.get_product_by_barcode("555")["name"] == "Кефир"
+    stub_api.responses["555"] = (503, {"error": "unavailable"})
+    clock.now += STALE_TTL + 1
+    assert api.get_product_by_barcode("555")["name"] == "Кефир"
+
+
+def test_single_flight(api, stub_api):
+    stub_api.product("777", "Йогурт")
+    stub_api.delay = 0.3
+    barrier = threading.Barrier(8)
+    results = []
+
+    def lookup():
+        barrier.wait()
+        results.append(api.get_product_by_barcode("777"))
+
+    threads = [threading.Thread(target=lookup) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stub_api.calls["777"] == 1
+    assert len(results) == 8 and all(product["name"] == "Йогурт" for product in results)
+
+
+def test_bulk_lookup_deduplicates(api, stub_api):
+    stub_api.product("888", "Рис")
+    results = api.get_products_by_barcodes(["888", " 888 ", "0404", "888"], max_workers=4)
+    assert results["888"]["name"] == "Рис" and results["0404"] is None
+    assert stub_api.calls == {"888": 1, "0404": 1}
+
+
+def test_non_json_answer_is_not_found_and_not_cached(api, stub_api):
+    stub_api.responses["555"] = (200, b"<html>Service Unavailable</html>")
+    assert api.get_product_by_barcode("555") is None
+    assert asyncio.run(api.aget_product_by_barcode("555")) is None
+    assert stub_api.calls["555"] == 2
+
+
+def test_search_with_non_json_answer_renders_page(api, stub_api, storage_url, monkeypatch):
+    monkeypatch.setenv(DATABASE_URL_ENV, storage_url)
+    client = create_app(warmup=False).test_client()
+    stub_api.responses["555"] = (200, b"not json")
+
+    response = client.post("/", data={"search_product": "1", "barcode": "555"})
+    assert response.status_code == 200
+    assert stub_api.calls["555"] == 1
+
+    stub_api.product("666", "Печенье")
+    response = client.post("/", data={"search_product": "1", "barcode": "666"})
+    assert response.status_code == 200
+    assert "Печенье" in response.get_data(as_text=True)
+
+
+def test_async_lookup_closes_its_client(api, stub_api, monkeypatch):
+    httpx = pytest.importorskip("httpx")
+    clients = []
+
+    class TrackedClient(httpx.AsyncClient):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            clients.append(self)
+
+    monkeypatch.setattr(httpx, "AsyncClient", TrackedClient)
+    for barcode in ("771", "772", "773"):
+        stub_api.product(barcode, "Сок")
+        # Каждый запрос Flask идёт в своём цикле событий
+        assert asyncio.run(api.aget_product_by_barcode(barcode))["name"] == "Сок"
+    assert len(clients) == 3 and all(client.is_closed for client in clients)
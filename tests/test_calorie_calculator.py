@@ -0,0 +1,52 @@
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from services.calorie_calculator import SETTINGS_FIELDS, CalorieCalculator
+
+GENDERS = ["male", "female", "Male", "FEMALE", "other", ""]
+ACTIVITY_LEVELS = [1.2, 1.375, 1.55, 1.725, 1.9, 1.0, 2.35]
+
+
+def random_settings(count: int, seed: int):
+    rng = random.Random(seed)
+    rows = [(round(rng.uniform(35, 180), 1), round(rng.uniform(140, 210), 1), rng.randint(14, 95),
+             gender, activity_level)
+            for gender, activity_level in itertools.product(GENDERS, ACTIVITY_LEVELS)
+            for _ in range(count)]
+    # Крайние значения: нулевые вес и рост, отрицательный базовый обмен
+    rows += [(0, 0, 0, "male", 1.2), (0, 0, 120, "female", 1.9), (250, 250, 18, "male", 2.35)]
+    return rows
+
+
+@pytest.mark.parametrize("ratios", [None, {"proteins": 0.25, "fats": 0.35, "carbs": 0.4},
+                                    {"proteins": 0.15, "fats": 0.05, "carbs": 0.8}])
+def test_batch_matches_scalar(ratios, monkeypatch):
+    if ratios:
+        monkeypatch.setattr(CalorieCalculator, "MACRO_RATIOS", dict(ratios))
+    rows = random_settings(40, seed=17)
+    columns = {field: [row[i] for row in rows] for i, field in enumerate(SETTINGS_FIELDS)}
+
+    batch = CalorieCalculator.daily_norms_batch(columns)
+    expected = [CalorieCalculator.daily_norms(*row) for row in rows]
+
+    for nutrient in ("calories", "proteins", "fats", "carbs"):
+        assert batch[nutrient].tolist() == [norms[nutrient] for norms in expected], nutrient
+
+
+def test_batch_accepts_structured_array():
+    rows = random_settings(5, seed=3)
+    dtype = [("weight", "f8"), ("height", "f8"), ("age", "i8"), ("gender", "U8"), ("activity_level", "f8")]
+    batch = CalorieCalculator.daily_norms_batch(np.array(rows, dtype=dtype))
+
+    assert batch["calories"].tolist() == [CalorieCalculator.daily_norms(*row)["calories"] for row in rows]
+
+
+def test_batch_rounds_halves_like_round():
+    # Граммы БЖУ на середине между десятыми: 2 ккал дают 0.15 г белка
+    calories = np.array([0.5, 2.0, 6.0, 14.0, 1234.5, 2001.0])
+    batch = CalorieCalculator.get_macronutrients_batch(calories)
+    for nutrient, values in batch.items():
+        assert values.tolist() == [CalorieCalculator.get_macronutrients(c)[nutrient] for c in calories.tolist()]
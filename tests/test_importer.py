@@ -0,0 +1,167 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from app import create_app
+from services.importer import OFF_CSV_COLUMNS, OFF_SOURCE, DiaryImporter, ProductDumpImporter
+
+
+def dump_row(number: int, modified: int, name=None):
+    return {
+        "code": f"46{number:011d}",
+        "product_name": name or f"Продукт {number}",
+        "last_modified_t": modified,
+        "nutriments": {"energy-kcal_100g": 100 + number, "proteins_100g": 5,
+                       "fat_100g": 3, "carbohydrates_100g": 20},
+    }
+
+
+def write_dump(path, rows):
+    """Выгрузка в формате по расширению: .jsonl или .csv (с табуляцией), можно .gz"""
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8", newline="") as stream:
+        if ".csv" in str(path):
+            writer = csv.writer(stream, delimiter="\t", quoting=csv.QUOTE_NONE)
+            writer.writerow(OFF_CSV_COLUMNS)
+            for row in rows:
+                values = {**row, **row["nutriments"]}
+                writer.writerow([values.get(column, "") for column in OFF_CSV_COLUMNS])
+        else:
+            for row in rows:
+                stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return str(path)
+
+
+def catalog(db):
+    return {row.barcode: row.name for row in db.iter_catalog_rows()}
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(db, monkeypatch, chunks: int):
+    """Обрывает импорт на пачке номер chunks + 1: первые chunks записываются"""
+    write = db.import_products_chunk
+    written = []
+
+    def import_products_chunk(products, source, state):
+        if len(written) == chunks:
+            raise Interrupted
+        write(products, source, state)
+        written.append(state)
+
+    monkeypatch.setattr(db, "import_products_chunk", import_products_chunk)
+    return written
+
+
+def test_import_and_watermark(sqlite_db, tmp_path):
+    rows = [dump_row(number, modified=1000 + number) for number in range(10)]
+    rows.append({"code": "", "product_name": "Без штрих-кода", "nutriments": {"proteins_100g": 1}})
+    rows.append({"code": "460", "product_name": "Без КБЖУ", "nutriments": {}})
+    path = write_dump(tmp_path / "products.jsonl", rows)
+
+    stats = ProductDumpImporter(sqlite_db, workers=1, chunk_size=4).import_file(path)
+    assert (stats.records, stats.products, stats.skipped, stats.unchanged) == (12, 10, 2, 0)
+    assert len(catalog(sqlite_db)) == 10
+    assert tuple(sqlite_db.get_import_state(OFF_SOURCE)) == (None, 0, 1009, 0)
+
+    # Дельта: записываются только продукты, изменённые после отметки
+    delta = [dump_row(3, modified=1009, name="Старое"), dump_row(4, modified=1010, name="Новое"),
+             dump_row(20, modified=1500)]
+    stats = ProductDumpImporter(sqlite_db, workers=1).import_file(write_dump(tmp_path / "delta.jsonl", delta))
+    assert (stats.products, stats.unchanged) == (2, 1)
+    names = catalog(sqlite_db)
+    assert (names[dump_row(3, 0)["code"]], names[dump_row(4, 0)["code"]]) == ("Продукт 3", "Новое")
+    assert tuple(sqlite_db.get_import_state(OFF_SOURCE)) == (None, 0, 1500, 0)
+
+    # Полный импорт (--full) отметку не учитывает
+    stats = ProductDumpImporter(sqlite_db, workers=1).import_file(path, incremental=False)
+    assert (stats.products, stats.unchanged) == (10, 0)
+    assert sqlite_db.get_import_state(OFF_SOURCE)[2] == 1500
+
+
+@pytest.mark.parametrize("name", ["products.jsonl", "products.jsonl.gz", "products.csv", "products.csv.gz"])
+def test_resume_from_offset(sqlite_db, tmp_path, monkeypatch, name):
+    rows = [dump_row(number, modified=2000 - number) for number in range(10)]
+    path = write_dump(tmp_path / name, rows)
+    importer = ProductDumpImporter(sqlite_db, workers=1, chunk_size=3)
+
+    written = interrupt_after(sqlite_db, monkeypatch, chunks=2)
+    with pytest.raises(Interrupted):
+        importer.import_file(path)
+    file_id, offset, watermark, file_watermark = sqlite_db.get_import_state(OFF_SOURCE)
+    assert (file_id, offset) == (importer.file_id(path), written[-1][1])
+    # Отметка недогруженного файла копится отдельно и не отсекает его строки
+    assert (watermark, file_watermark) == (0, 2000)
+    assert len(catalog(sqlite_db)) == 6
+
+    monkeypatch.undo()
+    stats = importer.import_file(path)
+    assert stats.records == 4
+    assert len(catalog(sqlite_db)) == 10
+    assert tuple(sqlite_db.get_import_state(OFF_SOURCE)) == (None, 0, 2000, 0)
+
+
+def test_restart_or_changed_file_starts_over(sqlite_db, tmp_path, monkeypatch):
+    rows = [dump_row(number, modified=3000 + number) for number in range(6)]
+    path = write_dump(tmp_path / "products.jsonl", rows)
+    importer = ProductDumpImporter(sqlite_db, workers=1, chunk_size=2)
+
+    interrupt_after(sqlite_db, monkeypatch, chunks=1)
+    with pytest.raises(Interrupted):
+        importer.import_file(path)
+    monkeypatch.undo()
+
+    assert importer.import_file(path, resume=False).records == 6
+
+    interrupt_after(sqlite_db, monkeypatch, chunks=1)
+    with pytest.raises(Interrupted):
+        importer.import_file(path, incremental=False)
+    monkeypatch.undo()
+    # Файл заменён новой выгрузкой: позиция старого к нему не относится
+    write_dump(tmp_path / "products.jsonl", rows + [dump_row(6, modified=4000)])
+    stats = importer.import_file(path)
+    assert (stats.records, stats.products, stats.unchanged) == (7, 1, 6)
+
+
+def test_dump_keeps_local_products(sqlite_db, tmp_path):
+    edited = dump_row(1, modified=5000)
+    sqlite_db.add_or_update_product({"barcode": edited["code"], "name": "Мой рецепт",
+                                     "calories": 180, "proteins": 7, "fats": 4, "carbs": 25})
+    path = write_dump(tmp_path / "products.jsonl", [edited, dump_row(2, modified=5000)])
+
+    ProductDumpImporter(sqlite_db, workers=1).import_file(path)
+    assert catalog(sqlite_db) == {edited["code"]: "Мой рецепт", dump_row(2, 0)["code"]: "Продукт 2"}
+
+
+def diary_line(barcode: str, grams: float = 100) -> str:
+    return json.dumps({"barcode": barcode, "name": f"Продукт {barcode}", "calories": 100, "proteins": 5,
+                       "fats": 3, "carbs": 20, "grams": grams, "date": "2024-01-02"})
+
+
+# Строки, которые не являются записью дневника: не объект, не JSON, без полей
+BAD_LINES = ["5", "[]", '"текст"', "null", "{не json", '{"barcode": "1"}']
+
+
+def test_diary_import_skips_bad_lines(sqlite_db):
+    user_id = sqlite_db.create_user()
+    lines = [diary_line("1"), *BAD_LINES[:3], diary_line("2"), *BAD_LINES[3:], diary_line("3")]
+    stats = DiaryImporter(sqlite_db, user_id, chunk_size=2).import_stream(io.StringIO("\n".join(lines)), "jsonl")
+
+    assert (stats.records, stats.products, stats.skipped) == (3, 3, len(BAD_LINES))
+    rows = [row for chunk in sqlite_db.export_food_diary(user_id) for row in chunk]
+    assert sorted(row.barcode for row in rows) == ["1", "2", "3"]
+
+
+def test_import_endpoint_reports_counts():
+    client = create_app(warmup=False).test_client()
+    body = "\n".join([diary_line("1"), "{обрыв", "[]", diary_line("2", 50)]).encode() + b"\n\xff\xfe\n"
+
+    response = client.post("/import?format=jsonl", data=body)
+    assert response.status_code == 200
+    assert {key: response.json[key] for key in ("records", "products", "skipped")} == {
+        "records": 2, "products": 2, "skipped": 3}
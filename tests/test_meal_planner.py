@@ -0,0 +1,85 @@
+import random
+
+import numpy as np
+import pytest
+
+from app import create_app
+from services.meal_planner import MealPlanner
+from services.product_catalog import NUTRIENTS, ProductCatalog
+from services.records import DailyTotals, Product
+
+NORMS = {'calories': 2200.0, 'proteins': 110.0, 'fats': 70.0, 'carbs': 280.0}
+SETTINGS = {'weight': 70, 'height': 175, 'age': 30, 'gender': 'male', 'activity_level': 1.55}
+
+
+def make_catalog(count: int, seed: int) -> ProductCatalog:
+    rng = random.Random(seed)
+    rows = []
+    for product_id in range(1, count + 1):
+        proteins, fats, carbs = rng.uniform(0, 40), rng.uniform(0, 60), rng.uniform(0, 90)
+        rows.append(Product(product_id, f"Продукт {product_id}", None,
+                            4 * proteins + 9 * fats + 4 * carbs, proteins, fats, carbs))
+    return ProductCatalog.from_rows(rows)
+
+
+def eaten(share: float) -> DailyTotals:
+    return DailyTotals("2024-01-01", *(NORMS[n] * share for n in ('calories', 'proteins', 'fats', 'carbs')), 1)
+
+
+def weighted_gap(values, deficit) -> float:
+    weights = np.array([1 / NORMS[n] for n in NUTRIENTS])
+    return float(np.linalg.norm((np.asarray(values) - np.asarray(deficit)) * weights))
+
+
+@pytest.mark.parametrize("size", [1, 5, 200, 5000])
+@pytest.mark.parametrize("share", [0.0, 0.4, 0.9])
+@pytest.mark.parametrize("planner", [MealPlanner(), MealPlanner(max_items=2, max_mass=150, min_mass=20)],
+                         ids=["default", "tight"])
+def test_plan_masses_in_bounds_and_gap_shrinks(size, share, planner):
+    catalog = make_catalog(size, seed=size)
+    plan = planner.plan(catalog, NORMS, eaten(share))
+    deficit = [NORMS[n] * (1 - share) for n in NUTRIENTS]
+
+    assert len(plan['items']) <= planner.max_items
+    assert all(planner.min_mass <= item.recommended_mass <= planner.max_mass for item in plan['items'])
+    assert len({item.product.id for item in plan['items']}) == len(plan['items'])
+
+    # Итоги и остаток плана сходятся с массами продуктов
+    totals = sum((np.array([getattr(item.product, n) for n in NUTRIENTS]) * item.recommended_mass / 100
+                  for item in plan['items']), np.zeros(len(NUTRIENTS)))
+    assert [plan['totals'][n] for n in NUTRIENTS] == pytest.approx(totals, abs=0.1)
+    assert [plan['remaining'][n] for n in NUTRIENTS] == pytest.approx(np.array(deficit) - totals, abs=0.1)
+
+    if plan['items']:
+        assert weighted_gap(totals, deficit) < weighted_gap(np.zeros(len(NUTRIENTS)), deficit)
+    if size >= 200:
+        assert plan['items']
+
+
+def test_no_deficit_gives_empty_plan():
+    plan = MealPlanner().plan(make_catalog(100, seed=1), NORMS, eaten(1.2))
+    assert plan['items'] == []
+    assert plan['remaining'] == dict.fromkeys(NUTRIENTS, 0.0)
+
+
+def test_empty_catalog_gives_empty_plan():
+    plan = MealPlanner().plan(ProductCatalog.from_rows([]), NORMS, eaten(0.5))
+    assert plan['items'] == []
+    assert plan['totals'] == dict.fromkeys(NUTRIENTS, 0.0)
+    assert plan['remaining'] == {n: round(NORMS[n] * 0.5, 1) for n in NUTRIENTS}
+
+
+def test_degenerate_catalog_gives_empty_plan():
+    # Продукты без КБЖУ ничего не закрывают
+    rows = [Product(product_id, "Вода", None, 0.0, 0.0, 0.0, 0.0) for product_id in range(1, 20)]
+    plan = MealPlanner().plan(ProductCatalog.from_rows(rows), NORMS, eaten(0.5))
+    assert plan['items'] == []
+
+
+def test_plan_endpoint_with_empty_catalog():
+    client = create_app(warmup=False).test_client()
+    client.post("/save-settings", data=SETTINGS)
+
+    response = client.get("/get-recommendations?mode=plan")
+    assert response.status_code == 200
+    assert "Не удалось подобрать рацион" in response.get_data(as_text=True)
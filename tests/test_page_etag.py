@@ -0,0 +1,47 @@
+import pytest
+
+import app as app_module
+from app import create_app
+from services.database import get_pool
+from services.storage import DATABASE_URL_ENV, SQLITE_SCHEME, create_storage
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = str(tmp_path / "nutrition.db")
+    monkeypatch.setenv(DATABASE_URL_ENV, SQLITE_SCHEME + path)
+    yield create_app(warmup=False).test_client()
+    get_pool(path).close_all()
+
+
+def load(client, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.get("/", headers=headers)
+
+
+def test_unchanged_page_is_304(client):
+    etag = load(client).headers["ETag"].strip('"')
+    response = load(client, etag)
+    assert response.status_code == 304
+
+
+def test_catalog_write_invalidates_etag(client):
+    etag = load(client).headers["ETag"].strip('"')
+    db = create_storage()
+    try:
+        db.add_or_update_product({"barcode": "1", "name": "Яблоко", "calories": 52,
+                                  "proteins": 0.3, "fats": 0.2, "carbs": 14})
+    finally:
+        db.close()
+    assert load(client, etag).status_code == 200
+
+
+def test_reset_in_other_session_invalidates_etag(client):
+    etag = load(client).headers["ETag"].strip('"')
+
+    # Вторая сессия того же пользователя: копия cookie сессии
+    other = client.application.test_client()
+    other.set_cookie("session", client.get_cookie("session").value)
+    other.post("/reset-db", data={"token": app_module.RESET_TOKEN})
+
+    assert load(client, etag).status_code == 200
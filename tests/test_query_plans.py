@@ -0,0 +1,52 @@
+import pytest
+
+from services.database import QUERY_PLAN_CHECKS, check_query_plans
+
+
+# Запросы дневника читают записи из индекса, не обращаясь к таблице
+COVERING = {"get_food_diary", "get_food_diary_page", "export_food_diary", "export_food_diary.all",
+            "clear_food_diary"}
+
+
+def query_plan(conn, name):
+    sql, params = QUERY_PLAN_CHECKS[name]
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def fill(db, users=20, products=50, days=60):
+    """Данные и статистика планировщика (ANALYZE), чтобы план был как на живой базе"""
+    product_ids = [
+        db.add_or_update_product({"name": f"Продукт {i}", "barcode": str(1000 + i),
+                                  "calories": 100 + i, "proteins": 5, "fats": 3, "carbs": 20})
+        for i in range(products)
+    ]
+    user_ids = [db.create_user() for _ in range(users)]
+    entries = [
+        (user_id, product_ids[(user + day) % products], f"2024-{1 + day // 28:02d}-{1 + day % 28:02d}", 150.0)
+        for user, user_id in enumerate(user_ids) for day in range(days)
+    ]
+    db.add_consumptions(entries)
+    db.conn.execute("ANALYZE")
+
+
+@pytest.mark.parametrize("analyzed", [False, True], ids=["empty", "analyzed"])
+@pytest.mark.parametrize("name", sorted(QUERY_PLAN_CHECKS))
+def test_query_uses_index(sqlite_db, name, analyzed):
+    if analyzed:
+        fill(sqlite_db)
+    plan = query_plan(sqlite_db.conn, name)
+    for detail in plan:
+        assert not (detail.startswith("SCAN") and "USING" not in detail), plan
+        assert "TEMP B-TREE" not in detail, plan
+    if name in COVERING:
+        assert "COVERING INDEX idx_consumption_user_date" in plan[0], plan
+
+
+def test_all_query_plans_pass(sqlite_db):
+    assert sqlite_db.check_query_plans() == []
+
+
+def test_check_detects_missing_index(sqlite_db):
+    sqlite_db.conn.execute("DROP INDEX idx_consumption_product")
+    problems = check_query_plans(sqlite_db.conn)
+    assert any(problem.startswith("products_totals_update:") for problem in problems)
@@ -0,0 +1,164 @@
+import random
+
+import pytest
+
+from services.product_catalog import NutrientIndex, ProductCatalog
+from services.recommendation_engine import INDEX_DEPTH_PER_ITEM, INDEX_MIN_CATALOG, RecommendationEngine
+from services.records import DailyTotals, Product
+
+
+def make_rows(count: int, seed: int):
+    """Случайный каталог; каждый десятый продукт — копия предыдущего (равные оценки)"""
+    rng = random.Random(seed)
+    rows = []
+    for product_id in range(1, count + 1):
+        if product_id % 10 == 0:
+            values = rows[-1][3:]
+        else:
+            values = (rng.uniform(0, 900), rng.uniform(0, 40), rng.uniform(0, 60), rng.uniform(0, 90))
+            # Нулевые нутриенты проверяют ветки без деления
+            values = tuple(0.0 if rng.random() < 0.1 else value for value in values)
+        rows.append(Product(product_id, f"Продукт {product_id}", None, *values))
+    return rows
+
+
+def make_cases(seed: int, count: int = 40):
+    """Нормы и съеденное за день: дефициты, переизбытки и нейтральные нутриенты"""
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        norms = {
+            'calories': rng.uniform(1500, 3200), 'proteins': rng.uniform(60, 180),
+            'fats': rng.uniform(40, 110), 'carbs': rng.uniform(150, 400)
+        }
+        eaten = {nutrient: norm * rng.choice([0, 0.3, 0.9, 1.0, 1.3, 2.0]) for nutrient, norm in norms.items()}
+        totals = DailyTotals("2024-01-01", eaten['calories'], eaten['proteins'], eaten['fats'], eaten['carbs'], 3)
+        cases.append((norms, totals))
+    return cases
+
+
+def baseline_recommendations(products, daily_norms, today_stats, n_recommendations=5):
+    """Исходная построчная оценка продуктов (до векторизации), для сравнения"""
+    abs_balance = {
+        nutrient: daily_norms[nutrient] - getattr(today_stats, nutrient)
+        for nutrient in ('proteins', 'fats', 'carbs', 'calories')
+    }
+    priorities = {
+        nutrient: max(0.1, abs_balance[nutrient] / daily_norms[nutrient])
+        if abs_balance[nutrient] > 0 and daily_norms[nutrient] > 0 else 0.1
+        for nutrient in ('proteins', 'fats', 'carbs')
+    }
+    total_priority = sum(priorities.values())
+    if total_priority > 0:
+        priorities = {k: v / total_priority for k, v in priorities.items()}
+
+    scored_products = []
+    for product in products:
+        match_score = 0.0
+        for nutrient in ['proteins', 'fats', 'carbs']:
+            nutrient_value = getattr(product, nutrient)
+            norm = daily_norms.get(nutrient, 1)
+            if norm <= 0:
+                norm = 1
+            if abs_balance[nutrient] > 0:
+                match_score += priorities[nutrient] * ((nutrient_value / norm) * 100)
+            elif abs_balance[nutrient] < -10:
+                match_score -= (nutrient_value / norm) * 100 * 0.75
+        calorie_contribution = (product.calories / daily_norms.get('calories', 1)) * 100
+        if abs_balance['calories'] > 0:
+            match_score += calorie_contribution * 0.1
+        else:
+            match_score -= calorie_contribution * 0.2
+        if match_score > 0:
+            scored_products.append((match_score, product))
+
+    scored_products.sort(reverse=True, key=lambda x: x[0])
+    max_score = scored_products[0][0] if scored_products else 1
+    return [
+        (product.id, min(100.0, max(0.0, score / max(1.0, max_score) * 100)),
+         round(baseline_mass(product, daily_norms, abs_balance), 1))
+        for score, product in scored_products[:n_recommendations]
+    ]
+
+
+def baseline_mass(product, daily_norms, abs_balance):
+    max_mass, min_mass = 500.0, 10.0
+    nutrient_masses = []
+    for nutrient in ['proteins', 'fats', 'carbs', 'calories']:
+        nutrient_value = getattr(product, nutrient)
+        if nutrient_value <= 0:
+            continue
+        if abs_balance[nutrient] > 0:
+            nutrient_masses.append((abs_balance[nutrient] / nutrient_value) * 100)
+        elif abs_balance[nutrient] < -10:
+            nutrient_masses.append((daily_norms[nutrient] * 0.05 / nutrient_value) * 100)
+        else:
+            nutrient_masses.append(max_mass)
+    if nutrient_masses:
+        return max(min_mass, min(max_mass, min(nutrient_masses)))
+    return min_mass
+
+
+class CatalogEngine(RecommendationEngine):
+    """Движок рекомендаций над готовым каталогом, без хранилища"""
+
+    def __init__(self, catalog: ProductCatalog):
+        self._owns_db = False
+        self.db = None
+        self.catalog = catalog
+
+    def _get_catalog(self) -> ProductCatalog:
+        return self.catalog
+
+
+@pytest.mark.parametrize("size", [1, 7, 300, 2000])
+@pytest.mark.parametrize("n_recommendations", [1, 5, 20])
+def test_vectorized_top_k_matches_row_scoring(size, n_recommendations):
+    rows = make_rows(size, seed=size)
+    engine = CatalogEngine(ProductCatalog.from_rows(rows))
+
+    for norms, totals in make_cases(seed=size + n_recommendations):
+        expected = baseline_recommendations(rows, norms, totals, n_recommendations)
+        actual = engine.recommend_products(norms, totals, n_recommendations)
+
+        assert [item.product.id for item in actual] == [product_id for product_id, _, _ in expected]
+        assert [item.match_score for item in actual] == pytest.approx([score for _, score, _ in expected])
+        assert [item.recommended_mass for item in actual] == pytest.approx([mass for _, _, mass in expected], abs=0.1)
+        assert all(item.product == rows[item.product.id - 1] for item in actual)
+
+
+def test_empty_catalog():
+    engine = CatalogEngine(ProductCatalog.from_rows([]))
+    norms, totals = make_cases(seed=1, count=1)[0]
+    assert engine.recommend_products(norms, totals) == []
+
+
+def make_flat_rows(count: int, seed: int):
+    """Каталог из нескольких повторяющихся продуктов: много равных оценок у границы индекса"""
+    rng = random.Random(seed)
+    kinds = [(rng.uniform(0, 900), rng.uniform(0, 40), rng.uniform(0, 60), rng.uniform(0, 90)) for _ in range(5)]
+    return [Product(product_id, f"Продукт {product_id}", None, *rng.choice(kinds))
+            for product_id in range(1, count + 1)]
+
+
+@pytest.mark.parametrize("make", [make_rows, make_flat_rows])
+@pytest.mark.parametrize("size", [INDEX_MIN_CATALOG, 5000, 20000])
+@pytest.mark.parametrize("k", [1, 5, 50])
+def test_index_selection_matches_full_scan(make, size, k, monkeypatch):
+    heads = []
+    original_head = NutrientIndex.head
+    monkeypatch.setattr(NutrientIndex, "head", lambda self, *args: heads.append(args) or original_head(self, *args))
+
+    catalog = ProductCatalog.from_rows(make(size, seed=size + k))
+    engine = CatalogEngine(catalog)
+    for norms, totals in make_cases(seed=size * k, count=20):
+        abs_balance = engine._calculate_nutrient_balance(norms, totals)['absolute']
+        top, scores = engine._select_top(catalog, norms, abs_balance, k)
+
+        full_scores = engine._score_products(catalog.values, norms, abs_balance)
+        full_top = engine._top_k(full_scores, k)
+        assert top.tolist() == full_top.tolist()
+        assert scores == pytest.approx(full_scores[full_top])
+
+    # Начальная глубина не меньше каталога — индекс пропускается сразу
+    assert bool(heads) == (k * INDEX_DEPTH_PER_ITEM < size)
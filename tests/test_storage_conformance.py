@@ -0,0 +1,391 @@
+"""
+Контракт StorageBackend: одни и те же проверки для SQLite и PostgreSQL
+
+Фикстура storage параметризована видом хранилища; PostgreSQL берётся из
+TEST_POSTGRES_URL или поднимается локально (см. conftest.py), а без него
+эти варианты пропускаются.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from services.records import DailyTotals, DiaryEntry, Product, UserSettings
+from services.storage import StorageBackend
+
+SETTINGS = {"weight": 70.0, "height": 175.0, "age": 30, "gender": "male", "activity_level": 1.55}
+
+
+def product(barcode, name="Продукт", calories=100.0, proteins=10.0, fats=5.0, carbs=20.0):
+    return {"barcode": barcode, "name": name, "calories": calories,
+            "proteins": proteins, "fats": fats, "carbs": carbs}
+
+
+def day(days_ago: int) -> str:
+    """Дата days_ago дней назад; CURRENT_DATE обоих хранилищ здесь в UTC"""
+    return (datetime.now(timezone.utc).date() - timedelta(days=days_ago)).isoformat()
+
+
+def reopen(storage):
+    """Второй объект того же хранилища (своё соединение из пула)"""
+    return type(storage)(storage.location)
+
+
+def diary_user(storage, dates=(0, 1, 1, 3, 40)):
+    """Пользователь с продуктом и записями дневника за даты dates (дней назад)"""
+    user_id = storage.create_user()
+    product_id = storage.add_or_update_product(product("4600000000001", "Гречка", 300, 12, 3, 60))
+    storage.add_consumptions([(user_id, product_id, day(days_ago), 100.0 + i)
+                              for i, days_ago in enumerate(dates)])
+    return user_id, product_id
+
+
+# Каталог
+
+def test_product_upsert_and_lookup(storage):
+    product_id = storage.add_or_update_product(product("100", "Кефир", 50, 3, 2.5, 4))
+    assert storage.get_product_by_barcode("100") == Product(product_id, "Кефир", "100", 50, 3, 2.5, 4)
+
+    assert storage.add_or_update_product(product("100", "Кефир 1%", 40, 3, 1, 4)) == product_id
+    assert storage.get_product_by_barcode("100") == Product(product_id, "Кефир 1%", "100", 40, 3, 1, 4)
+    assert storage.get_product_by_barcode("missing") is None
+
+
+def test_products_without_barcode_are_distinct(storage):
+    first = storage.add_or_update_product(product(None, "Домашний суп"))
+    second = storage.add_or_update_product(product(None, "Домашний суп"))
+    assert first != second
+    assert [row.barcode for row in storage.iter_catalog_rows()] == [None, None]
+
+
+def test_bulk_upsert_and_catalog_rows(storage):
+    assert storage.add_or_update_products([product("1", "Яблоко"), product("2", "Груша")]) == 2
+    assert storage.add_or_update_products([product("2", "Груша спелая", calories=57)]) == 1
+    assert storage.add_or_update_products([]) == 0
+
+    rows = sorted(storage.iter_catalog_rows())
+    assert all(isinstance(row, Product) for row in rows)
+    assert [(row.barcode, row.name, row.calories) for row in rows] == [
+        ("1", "Яблоко", 100), ("2", "Груша спелая", 57)]
+
+
+def test_catalog_versions_grow_on_writes(storage):
+    version = storage.catalog_version()
+    generation = StorageBackend.catalog_generation
+    storage.add_or_update_product(product("1"))
+    assert storage.catalog_version() > version
+    assert StorageBackend.catalog_generation > generation
+
+    version = storage.catalog_version()
+    storage.add_or_update_products([product("2")])
+    assert storage.catalog_version() > version
+
+
+def test_catalog_token_sees_other_connection(storage):
+    other = reopen(storage)
+    try:
+        token = storage.catalog_token()
+        other.add_or_update_product(product("1"))
+        assert storage.catalog_token() != token
+    finally:
+        other.close()
+
+
+def test_product_listeners(storage, monkeypatch):
+    calls = []
+    monkeypatch.setattr(StorageBackend, "product_listeners", [lambda *args: calls.append(args)])
+    product_id = storage.add_or_update_product(product("1", "Сыр", 350, 25, 27, 0))
+
+    [(location, row, before, after)] = calls
+    assert location == storage.location
+    assert tuple(row) == (product_id, "Сыр", "1", 350, 25, 27, 0)
+    assert after > before
+
+
+def test_search_products(storage):
+    storage.add_or_update_products([
+        product("1", "Молоко коровье"),
+        product("2", "Шоколад молочный"),
+        product("3", "Творог"),
+        product("4", "Apple juice"),
+    ])
+
+    def names(query, limit=10):
+        return sorted(row.name for row in storage.search_products(query, limit))
+
+    assert names("мол") == ["Молоко коровье", "Шоколад молочный"]
+    assert names("МОЛ кор") == ["Молоко коровье"]
+    assert names("шок") == ["Шоколад молочный"]
+    assert names("JUICE") == ["Apple juice"]
+    assert names("рыба") == []
+    assert names("  ,; ") == []
+    assert len(storage.search_products("мол", limit=1)) == 1
+    assert all(isinstance(row, Product) for row in storage.search_products("творог"))
+
+
+# Пользователи
+
+def test_users_and_settings(storage):
+    user_id = storage.create_user()
+    assert storage.create_user() != user_id
+    assert storage.user_exists(user_id)
+    assert not storage.user_exists(user_id + 1000)
+
+    assert storage.get_user_settings(user_id) is None
+    assert storage.save_user_settings(user_id, SETTINGS)
+    assert storage.get_user_settings(user_id) == UserSettings(70.0, 175.0, 30, "male", 1.55)
+
+    assert storage.clear_user_settings(user_id)
+    assert storage.get_user_settings(user_id) is None
+    assert storage.user_exists(user_id)
+
+    assert not storage.save_user_settings(user_id + 1000, SETTINGS)
+
+
+# Дневник
+
+def test_add_consumption(storage):
+    user_id = storage.create_user()
+    product_id = storage.add_or_update_product(product("1", "Рис", 330, 7, 1, 74))
+    assert storage.add_consumption(user_id, product_id, 150)
+
+    [entry] = storage.get_food_diary(user_id)
+    assert isinstance(entry, DiaryEntry)
+    assert (entry.name, entry.barcode, entry.date, entry.grams, entry.user_id) == ("Рис", "1", day(0), 150, user_id)
+    assert (entry.calories, entry.proteins, entry.fats, entry.carbs) == pytest.approx((495, 10.5, 1.5, 111))
+
+
+def test_food_diary_window_and_order(storage):
+    user_id, _ = diary_user(storage)
+    other_id, _ = diary_user(storage)
+    assert storage.add_consumptions([]) == 0
+
+    rows = storage.get_food_diary(user_id)
+    assert [row.date for row in rows] == [day(0), day(1), day(1), day(3)]
+    assert rows[1].id > rows[2].id
+    assert {row.user_id for row in rows} == {user_id}
+    assert [row.date for row in storage.get_food_diary(user_id, days=2)] == [day(0), day(1), day(1)]
+    assert len(storage.get_food_diary(other_id, days=365)) == 5
+
+
+def test_food_diary_pages(storage):
+    user_id, _ = diary_user(storage, dates=(0, 0, 1, 2, 2, 2, 5))
+    expected = storage.get_food_diary(user_id)
+
+    pages, after = [], None
+    while True:
+        rows, after = storage.get_food_diary_page(user_id, limit=3, after=after)
+        pages.append(rows)
+        if after is None:
+            break
+    assert [len(rows) for rows in pages] == [3, 3, 1]
+    assert [row for rows in pages for row in rows] == expected
+
+    rows, after = storage.get_food_diary_page(user_id, limit=7)
+    assert rows == expected and after == (expected[-1].date, expected[-1].id)
+    assert storage.get_food_diary_page(user_id, limit=7, after=after) == ([], None)
+
+    assert list(storage.iter_food_diary(user_id, page_size=2)) == expected
+
+
+def test_export_food_diary(storage):
+    user_id, _ = diary_user(storage)
+    other_id, _ = diary_user(storage, dates=(2, 0))
+
+    chunks = list(storage.export_food_diary(user_id, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    rows = [row for chunk in chunks for row in chunk]
+    assert [row.date for row in rows] == [day(40), day(3), day(1), day(1), day(0)]
+    assert rows[2].id < rows[3].id
+
+    rows = [row for chunk in storage.export_food_diary(user_id, start=day(3), end=day(1)) for row in chunk]
+    assert [row.date for row in rows] == [day(3), day(1), day(1)]
+
+    rows = [row for chunk in storage.export_food_diary(None) for row in chunk]
+    assert [(row.user_id, row.date) for row in rows] == (
+        [(user_id, d) for d in (day(40), day(3), day(1), day(1), day(0))]
+        + [(other_id, day(2)), (other_id, day(0))])
+
+    assert list(storage.export_food_diary(user_id + 1000)) == []
+
+
+def test_daily_totals(storage):
+    user_id, _ = diary_user(storage)
+
+    today = storage.get_today_nutrition(user_id, day(0))
+    assert isinstance(today, DailyTotals)
+    assert (today.date, today.entries) == (day(0), 1)
+    assert (today.calories, today.proteins, today.fats, today.carbs) == pytest.approx((300, 12, 3, 60))
+    assert storage.get_today_nutrition(user_id, day(2)) == DailyTotals(day(2), 0, 0, 0, 0, 0)
+
+    totals = storage.get_daily_totals(user_id, day(5), day(0))
+    assert [(row.date, row.entries) for row in totals] == [(day(3), 1), (day(1), 2), (day(0), 1)]
+    assert totals[1].calories == pytest.approx(3 * (101 + 102))
+
+    assert storage.rebuild_daily_totals() == 4
+    assert storage.get_daily_totals(user_id, day(5), day(0)) == totals
+
+
+def test_totals_follow_product_updates(storage):
+    user_id, product_id = diary_user(storage, dates=(0,))
+    storage.add_or_update_product(product("4600000000001", "Гречка", 330, 12, 3, 60))
+    assert storage.get_today_nutrition(user_id, day(0)).calories == pytest.approx(330)
+    assert storage.get_food_diary(user_id)[0].calories == pytest.approx(330)
+
+
+def test_clear_food_diary(storage):
+    user_id, _ = diary_user(storage)
+    other_id, _ = diary_user(storage)
+    assert storage.clear_food_diary(user_id)
+    assert storage.get_food_diary(user_id, days=365) == []
+    assert storage.get_daily_totals(user_id, day(50), day(0)) == []
+    assert storage.get_today_nutrition(user_id, day(0)).entries == 0
+    assert len(storage.get_food_diary(other_id, days=365)) == 5
+
+
+def test_data_version(storage):
+    assert storage.get_data_version(1000) is None
+    user_id = storage.create_user()
+    version = storage.get_data_version(user_id)
+    assert storage.get_data_version(user_id) == version
+
+    product_id = storage.add_or_update_product(product("1"))
+    catalog_changed = storage.get_data_version(user_id)
+    assert catalog_changed[0] == version[0] and catalog_changed[1] != version[1]
+
+    storage.add_consumption(user_id, product_id, 100)
+    diary_changed = storage.get_data_version(user_id)
+    assert diary_changed[0] != catalog_changed[0] and diary_changed[1] == catalog_changed[1]
+
+    storage.clear_food_diary(user_id)
+    assert storage.get_data_version(user_id)[0] != diary_changed[0]
+
+
+def test_import_diary_chunk(storage):
+    user_id = storage.create_user()
+    existing = storage.add_or_update_product(product("1", "Старое название"))
+
+    storage.import_diary_chunk(user_id, [product("1", "Хлеб", 250), product("2", "Масло", 750)],
+                               [("1", day(1), 50), ("2", None, 10), ("1", day(1), 30)])
+
+    assert storage.get_product_by_barcode("1") == Product(existing, "Хлеб", "1", 250, 10, 5, 20)
+    rows = storage.get_food_diary(user_id)
+    assert [(row.barcode, row.date, row.grams) for row in rows] == [
+        ("2", day(0), 10), ("1", day(1), 30), ("1", day(1), 50)]
+
+
+# Импорт каталога
+
+def test_import_state(storage):
+    assert storage.get_import_state("dump") is None
+    storage.save_import_state("dump", ("part-1.jsonl", 1024, 100, 150))
+    assert tuple(storage.get_import_state("dump")) == ("part-1.jsonl", 1024, 100, 150)
+    storage.save_import_state("dump", (None, 0, 150, 0))
+    assert tuple(storage.get_import_state("dump")) == (None, 0, 150, 0)
+    assert storage.get_import_state("other") is None
+
+
+def test_import_products_chunk(storage):
+    version = storage.catalog_version()
+    storage.import_products_chunk(
+        [product("1", "Первый"), product("2", "Второй"), product("1", "Первый новый")],
+        "dump", ("part-1.jsonl", 300, 0, 42))
+
+    assert sorted((row.barcode, row.name) for row in storage.iter_catalog_rows()) == [
+        ("1", "Первый новый"), ("2", "Второй")]
+    assert tuple(storage.get_import_state("dump")) == ("part-1.jsonl", 300, 0, 42)
+    assert storage.catalog_version() > version
+
+    storage.import_products_chunk([], "dump", (None, 0, 42, 0))
+    assert tuple(storage.get_import_state("dump")) == (None, 0, 42, 0)
+
+
+# Кэш OpenFoodFacts
+
+def test_barcode_cache(storage):
+    assert storage.get_barcode_cache_entry("1") is None
+    payload = json.dumps({"name": "Сок", "calories": 45})
+    storage.save_barcode_cache_entry("1", payload, 1000.5)
+    assert tuple(storage.get_barcode_cache_entry("1")) == (payload, 1000.5)
+
+    storage.save_barcode_cache_entry("1", None, 2000.25)
+    assert tuple(storage.get_barcode_cache_entry("1")) == (None, 2000.25)
+
+
+# Пакеты и обслуживание
+
+def test_apply_batch_isolates_failures(storage, monkeypatch):
+    calls = []
+    monkeypatch.setattr(StorageBackend, "product_listeners", [lambda *args: calls.append(args)])
+    user_id = storage.create_user()
+
+    def fail(db):
+        raise RuntimeError("ошибка операции")
+
+    results = storage.apply_batch([
+        (lambda db, data: db.add_or_update_product(data), (product("1", "Кофе"),)),
+        (lambda db, data: db.add_or_update_product(data), ({**product("2"), "name": None},)),
+        (fail, ()),
+        (lambda db: db.add_consumption(user_id, db.get_product_by_barcode("1").id, 200), ()),
+    ])
+
+    assert [ok for ok, _ in results] == [True, False, False, True]
+    assert isinstance(results[2][1], RuntimeError)
+    assert storage.get_product_by_barcode("2") is None
+    assert [row.name for row in storage.get_food_diary(user_id)] == ["Кофе"]
+    assert len(calls) == 1
+
+    other = reopen(storage)
+    try:
+        assert [row.name for row in other.get_food_diary(user_id)] == ["Кофе"]
+    finally:
+        other.close()
+
+
+def test_reset_database(storage):
+    user_id, _ = diary_user(storage)
+    storage.save_user_settings(user_id, SETTINGS)
+    version = storage.catalog_version()
+    generation = StorageBackend.catalog_generation
+
+    assert storage.reset_database()
+    assert list(storage.iter_catalog_rows()) == []
+    assert not storage.user_exists(user_id)
+    assert storage.catalog_version() > version
+    assert StorageBackend.catalog_generation > generation
+
+    new_user, _ = diary_user(storage, dates=(0,))
+    assert len(storage.get_food_diary(new_user)) == 1
+
+
+def test_query_plans(storage):
+    assert storage.check_query_plans() == []
+
+
+def test_import_keeps_local_products(storage):
+    local = storage.add_or_update_product(product("1", "Мой хлеб", 230))
+    storage.import_products_chunk([product("1", "Хлеб"), product("2", "Сыр")], "dump", ("a", 1, 0, 1))
+    assert storage.get_product_by_barcode("1") == Product(local, "Мой хлеб", "1", 230, 10, 5, 20)
+
+    # Продукт выгрузки обновляется следующей выгрузкой, пока его не исправили локально
+    storage.import_products_chunk([product("2", "Сыр твёрдый")], "dump", ("a", 2, 0, 2))
+    assert storage.get_product_by_barcode("2").name == "Сыр твёрдый"
+    storage.add_or_update_product(product("2", "Сыр мой"))
+    storage.import_products_chunk([product("2", "Сыр")], "dump", ("a", 3, 0, 3))
+    assert storage.get_product_by_barcode("2").name == "Сыр мой"
+
+
+def test_unchanged_local_write_keeps_dump_product(storage):
+    user_id = storage.create_user()
+    dump = [product(str(barcode), f"Продукт {barcode}") for barcode in range(1, 5)]
+    storage.import_products_chunk(dump, "dump", ("a", 1, 0, 1))
+
+    # Запись в дневник и разрешение штрих-кодов отправляют КБЖУ продукта как есть
+    storage.add_or_update_product(dump[0])
+    storage.add_or_update_products([dump[1]])
+    storage.import_diary_chunk(user_id, [dump[2]], [("3", None, 100)])
+    storage.add_or_update_product({**dump[3], "fats": 6.0})
+
+    storage.import_products_chunk([{**item, "name": "Новое"} for item in dump], "dump", ("a", 2, 0, 2))
+    assert [storage.get_product_by_barcode(item["barcode"]).name for item in dump] == [
+        "Новое", "Новое", "Новое", "Продукт 4"]
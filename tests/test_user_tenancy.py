@@ -0,0 +1,55 @@
+import sqlite3
+
+from app import create_app
+from services.database import MIGRATIONS, Database, _add_user_tenancy, get_pool
+
+# Последняя версия схемы, в которой у данных ещё не было пользователя
+LEGACY_VERSION = MIGRATIONS.index(_add_user_tenancy)
+
+
+def make_legacy_db(path: str):
+    """БД единственного пользователя: настройки и запись дневника без user_id"""
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    for migration in MIGRATIONS[:LEGACY_VERSION]:
+        migration(cursor)
+    cursor.execute(f"PRAGMA user_version = {LEGACY_VERSION}")
+    cursor.execute("""
+    INSERT INTO users (weight, height, age, gender, activity_level) VALUES (82, 180, 41, 'male', 1.375)
+    """)
+    cursor.execute("""
+    INSERT INTO products (barcode, name, calories_per_100g, proteins_per_100g, fats_per_100g, carbs_per_100g)
+    VALUES ('4601', 'Овсянка', 350, 12, 6, 60)
+    """)
+    cursor.execute("INSERT INTO consumption (product_id, grams) VALUES (1, 80)")
+    conn.commit()
+    conn.close()
+
+
+def test_first_session_adopts_legacy_data(default_storage):
+    make_legacy_db(default_storage)
+    first = create_app(warmup=False).test_client()
+    second = create_app(warmup=False).test_client()
+
+    page = first.get("/").get_data(as_text=True)
+    assert "Овсянка" in page
+    assert first.get_cookie("session") is not None
+
+    # Прежние данные достаются одной сессии, следующие получают новых пользователей
+    assert "Овсянка" not in second.get("/").get_data(as_text=True)
+    assert "Овсянка" in first.get("/").get_data(as_text=True)
+
+
+def test_empty_user_is_not_adopted(tmp_path):
+    # Миграции создают пользователя 1 и в пустой БД; без данных он не отдаётся
+    # сессиям, иначе после сброса БД двум сессиям достался бы один и тот же ID
+    db = Database(str(tmp_path / "fresh.db"))
+    try:
+        assert db.user_exists(1)
+        first = db.create_user()
+        assert first != 1 and db.create_user() != first
+        assert db.reset_database()
+        assert db.create_user() != 1
+    finally:
+        db.close()
+        get_pool(db.db_path).close_all()
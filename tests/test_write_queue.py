@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.storage import SQLITE_SCHEME
+from services.write_queue import WriteQueue
+
+
+def add_product(db, number: int) -> int:
+    return db.add_or_update_product({"barcode": str(number), "name": f"Продукт {number}", "calories": 100,
+                                     "proteins": 10, "fats": 5, "carbs": 20})
+
+
+def fail(db, number: int):
+    add_product(db, number)
+    raise ValueError(f"операция {number} не удалась")
+
+
+def barcodes(db):
+    return sorted(int(row.barcode) for row in db.iter_catalog_rows())
+
+
+@pytest.fixture
+def make_queue(sqlite_db):
+    queues = []
+
+    def make(**options) -> WriteQueue:
+        queues.append(WriteQueue(SQLITE_SCHEME + sqlite_db.location, **options))
+        return queues[-1]
+
+    yield make
+    for write_queue in queues:
+        write_queue.close(timeout=5)
+
+
+def test_concurrent_submits_share_one_transaction(sqlite_db, make_queue):
+    count = 16
+    write_queue = make_queue(max_batch=count, max_delay=5)
+    barrier = threading.Barrier(count)
+
+    def submit(number):
+        barrier.wait()
+        return write_queue.submit(add_product, number)
+
+    with ThreadPoolExecutor(count) as pool:
+        futures = list(pool.map(submit, range(count)))
+    ids = [future.result(timeout=5) for future in futures]
+
+    assert len(set(ids)) == count
+    assert barcodes(sqlite_db) == list(range(count))
+    assert write_queue.stats()["batches"] == 1
+    assert write_queue.stats()["max_batch"] == count
+
+
+def test_failed_write_raises_only_to_its_caller(sqlite_db, make_queue):
+    write_queue = make_queue(max_batch=3, max_delay=5)
+    futures = [write_queue.submit(add_product, 1), write_queue.submit(fail, 2), write_queue.submit(add_product, 3)]
+
+    assert futures[0].result(timeout=5) and futures[2].result(timeout=5)
+    with pytest.raises(ValueError, match="операция 2"):
+        futures[1].result()
+    # Откатывается только упавшая операция, остальные пакета записаны
+    assert barcodes(sqlite_db) == [1, 3]
+    assert write_queue.stats()["batches"] == 1 and write_queue.stats()["errors"] == 1
+
+    # Асинхронный вызывающий получает исключение из await
+    with pytest.raises(ValueError, match="операция 4"):
+        asyncio.run(make_queue().run(fail, 4))
+    assert barcodes(sqlite_db) == [1, 3]
+
+
+def test_close_drains_pending_writes(sqlite_db, make_queue):
+    write_queue = make_queue(max_batch=4)
+    started = threading.Event()
+
+    def slow(db):
+        started.set()
+        time.sleep(0.2)
+
+    first = write_queue.submit(slow)
+    started.wait(5)
+    # Пока пишется первая операция, остальные ждут в очереди
+    futures = [write_queue.submit(add_product, number) for number in range(10)]
+    assert write_queue.stats()["queued"] == 10
+
+    write_queue.close()
+    assert first.done() and all(future.done() for future in futures)
+    assert barcodes(sqlite_db) == list(range(10))
+    assert write_queue.stats()["writes"] == 11